@@ -0,0 +1,65 @@
+"""
+Throughput benchmark: bcrypt login verification per cost factor
+
+For each cost, measures how long one verification takes and how many
+logins per second a single core can sustain. It then runs the same
+verifications on the PasswordHasher pool to show the aggregate throughput
+one worker process gets. Use it to choose BCRYPT_ROUNDS per environment.
+
+Usage:
+    python benchmarks/bench_bcrypt_cost.py [--costs 10 11 12 13] [--logins 20] [--workers 4]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from security import hash_password, verify_password
+from utils.password_hasher import PasswordHasher
+
+PASSWORD = "Bench@123456"
+
+
+def measure_single(hashed: str, logins: int) -> list:
+    samples = []
+    for _ in range(logins):
+        started = time.perf_counter()
+        verify_password(PASSWORD, hashed)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+async def measure_pool(hashed: str, logins: int, workers: int) -> float:
+    hasher = PasswordHasher(workers, max_queue=logins)
+    started = time.perf_counter()
+    await asyncio.gather(*[hasher.verify(PASSWORD, hashed) for _ in range(logins)])
+    elapsed = time.perf_counter() - started
+    hasher.shutdown()
+    return logins / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--costs", type=int, nargs="+", default=[10, 11, 12, 13])
+    parser.add_argument("--logins", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    args = parser.parse_args()
+
+    print(f"{'cost':>4} {'mean ms':>10} {'p99 ms':>10} {'logins/s/core':>14} {f'pool x{args.workers} /s':>14}")
+    for cost in args.costs:
+        hashed = hash_password(PASSWORD, rounds=cost)
+        samples = sorted(measure_single(hashed, args.logins))
+        p99 = samples[max(0, int(len(samples) * 0.99) - 1)]
+        pool_rate = asyncio.run(measure_pool(hashed, args.logins, args.workers))
+        print(
+            f"{cost:>4} {statistics.mean(samples) * 1e3:>10.1f} {p99 * 1e3:>10.1f} "
+            f"{1 / statistics.mean(samples):>14.1f} {pool_rate:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Latency benchmark: CORS header rewriting as BaseHTTPMiddleware vs pure ASGI
+
+Drives a minimal Starlette app directly through its ASGI interface (no
+network), so the numbers isolate the middleware overhead.
+
+Usage:
+    python benchmarks/bench_cors_middleware.py [--requests 20000]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from middleware import CORSHeaderMiddleware
+
+
+async def endpoint(request):
+    return JSONResponse({"message": "ok"})
+
+
+async def add_cors_header(request, call_next):
+    response = await call_next(request)
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
+    response.headers["Access-Control-Allow-Headers"] = "*"
+    return response
+
+
+def build_app(variant: str) -> Starlette:
+    app = Starlette(routes=[Route("/", endpoint)])
+    if variant == "base_http":
+        app.add_middleware(BaseHTTPMiddleware, dispatch=add_cors_header)
+    elif variant == "pure_asgi":
+        app.add_middleware(CORSHeaderMiddleware)
+    return app
+
+
+async def call(app) -> float:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/",
+        "raw_path": b"/",
+        "query_string": b"",
+        "headers": [(b"host", b"bench"), (b"origin", b"http://localhost:3000")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("bench", 80),
+    }
+
+    request_sent = False
+    response_done = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Like a real server: report the disconnect only once the response is done
+        await response_done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and not message.get("more_body", False):
+            response_done.set()
+
+    started = time.perf_counter()
+    await app(scope, receive, send)
+    return time.perf_counter() - started
+
+
+async def measure(variant: str, requests: int) -> list:
+    app = build_app(variant)
+    for _ in range(min(1000, requests)):  # warm up
+        await call(app)
+    return [await call(app) for _ in range(requests)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'variant':<12} {'mean µs':>10} {'p50 µs':>10} {'p99 µs':>10}")
+    for variant in ("none", "base_http", "pure_asgi"):
+        samples = sorted(asyncio.run(measure(variant, args.requests)))
+        p99 = samples[int(len(samples) * 0.99) - 1]
+        print(
+            f"{variant:<12} {statistics.mean(samples) * 1e6:>10.1f} "
+            f"{statistics.median(samples) * 1e6:>10.1f} {p99 * 1e6:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,12 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import asyncio
 import os
 from dotenv import load_dotenv
 from pathlib import Path
+from datetime import datetime, timezone
+from mongo_client import analytics_read_preference, create_client
+from utils.deadline import DeadlineDatabase
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -10,84 +15,147 @@ load_dotenv(ROOT_DIR / '.env')
 mongo_url = os.environ['MONGO_URL']
 db_name = os.environ['DB_NAME']
 
-client = AsyncIOMotorClient(mongo_url)
+# The one client (and connection pool) for the process; see mongo_client.py
+client = create_client(mongo_url)
 db = client[db_name]
+# Same pool; reads may be served by a recent secondary (analytics only)
+analytics_db = client.get_database(db_name, read_preference=analytics_read_preference())
 
-async def create_indexes():
-    """Create database indexes for performance"""
-    
-    # Admin users indexes
-    await db.admin_users.create_index("email", unique=True)
-    await db.admin_users.create_index("username", unique=True)
-    await db.admin_users.create_index("role")
-    
-    # Users indexes
-    await db.users.create_index("email", unique=True)
-    await db.users.create_index("username", unique=True)
-    await db.users.create_index("kyc_status")
-    await db.users.create_index("role")
-    
-    # Documents indexes
-    await db.documents.create_index("seller_id")
-    await db.documents.create_index("status")
-    await db.documents.create_index("category")
-    await db.documents.create_index("created_at")
-    
-    # Transactions indexes
-    await db.transactions.create_index("user_id")
-    await db.transactions.create_index("type")
-    await db.transactions.create_index("status")
-    await db.transactions.create_index("created_at")
-    
-    # Wallets indexes
-    await db.wallets.create_index("user_id", unique=True)
-    
-    # Deposit requests indexes
-    await db.deposit_requests.create_index("user_id")
-    await db.deposit_requests.create_index("status")
-    await db.deposit_requests.create_index("created_at")
-    
-    # Withdrawal requests indexes
-    await db.withdrawal_requests.create_index("user_id")
-    await db.withdrawal_requests.create_index("status")
-    await db.withdrawal_requests.create_index("created_at")
-    
-    # Staking positions indexes
-    await db.staking_positions.create_index("user_id")
-    await db.staking_positions.create_index("status")
-    
-    # Investment positions indexes
-    await db.investment_positions.create_index("user_id")
-    await db.investment_positions.create_index("status")
-    
-    # KYC submissions indexes
-    await db.kyc_submissions.create_index("user_id")
-    await db.kyc_submissions.create_index("status")
-    
-    # Audit logs indexes
-    await db.audit_logs.create_index("user_id")
-    await db.audit_logs.create_index("action")
-    await db.audit_logs.create_index("timestamp")
-    
-    # API tokens indexes
-    await db.api_tokens.create_index("user_id")
-    await db.api_tokens.create_index("token_key", unique=True)
-    await db.api_tokens.create_index("is_active")
-    await db.api_tokens.create_index("expires_at")
-    
-    # API permissions indexes
-    await db.api_permissions.create_index("name", unique=True)
-    await db.api_permissions.create_index("category")
-    await db.api_permissions.create_index("is_active")
-    
-    # System settings index
-    await db.system_settings.create_index("id", unique=True)
-    
-    print("Database indexes created successfully")
+async def find_duplicates(collection, index: dict, limit: int = 5) -> list:
+    """Key values that more than one document shares, for a unique index spec"""
+    keys = list(index['key'].keys())
+    match = dict(index.get('partialFilterExpression', {}))
+    if index.get('sparse'):
+        match.update({key: {"$exists": True} for key in keys})
+    
+    pipeline = [{"$match": match}] if match else []
+    pipeline += [
+        {"$group": {"_id": {key.replace(".", "_"): f"${key}" for key in keys}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$limit": limit}
+    ]
+    return [doc['_id'] async for doc in collection.aggregate(pipeline, allowDiskUse=True)]
+
+async def create_collection_indexes(database, collection: str, models: list) -> bool:
+    """
+    Create one collection's indexes, leaving out unique indexes that
+    existing duplicates would make fail. Returns False if any was left out.
+    """
+    buildable = []
+    for model in models:
+        index = model.document
+        if index.get('unique'):
+            duplicates = await find_duplicates(database[collection], index)
+            if duplicates:
+                print(f"❌ Skipping unique index {index['name']} on {collection}, duplicate values: {duplicates}")
+                continue
+        buildable.append(model)
+    
+    if buildable:
+        await database[collection].create_indexes(buildable)
+    return len(buildable) == len(models)
+
+async def create_indexes(database=None) -> bool:
+    """
+    Create database indexes for performance (declared in indexes.py).
+    Returns True only if every index was built; failures are reported and
+    do not stop the others.
+    """
+    from indexes import INDEXES
+    
+    database = database if database is not None else db
+    collections = list(INDEXES.items())
+    
+    # One createIndexes command per collection, all collections at once
+    results = await asyncio.gather(*[
+        create_collection_indexes(database, collection, models) for collection, models in collections
+    ], return_exceptions=True)
+    
+    for (collection, _), result in zip(collections, results):
+        if isinstance(result, Exception):
+            print(f"❌ Index creation failed on {collection}: {str(result)}")
+    
+    complete = all(result is True for result in results)
+    if complete:
+        print("Database indexes created successfully")
+    return complete
+
+async def normalize_transaction_hashes(database=None) -> int:
+    """Lowercase stored deposit hashes (new deposits are stored lowercase), before the unique index is built"""
+    database = database if database is not None else db
+    deposits = await database.deposit_requests.find(
+        {"metadata.transaction_hash": {"$regex": "[A-F]"}},
+        {"_id": 1, "metadata.transaction_hash": 1}
+    ).to_list(None)
+    if not deposits:
+        return 0
+    
+    try:
+        result = await database.deposit_requests.bulk_write([
+            UpdateOne(
+                {"_id": deposit['_id']},
+                {"$set": {"metadata.transaction_hash": deposit['metadata']['transaction_hash'].lower()}}
+            )
+            for deposit in deposits
+        ], ordered=False)
+        normalized = result.modified_count
+    except BulkWriteError as e:
+        # The lowercase hash is already stored: a duplicate for an admin to resolve
+        normalized = e.details.get('nModified', 0)
+        print(f"❌ {len(e.details.get('writeErrors', []))} deposit hash(es) duplicate an existing deposit once lowercased")
+    
+    print(f"Deposit transaction hashes lowercased: {normalized}")
+    return normalized
+
+async def ensure_required_indexes(database=None):
+    """Refuse to run without the unique indexes listed in indexes.REQUIRED_INDEXES"""
+    from indexes import REQUIRED_INDEXES
+    
+    database = database if database is not None else db
+    for collection, names in REQUIRED_INDEXES.items():
+        existing = await database[collection].index_information()
+        missing = [name for name in names if name not in existing]
+        if missing:
+            raise RuntimeError(
+                f"Required index(es) {', '.join(missing)} on {collection} could not be built; "
+                "resolve the duplicates reported above and restart"
+            )
+
+async def bootstrap_schema():
+    """Migrate data, create indexes and seed data unless this schema version is already applied"""
+    from indexes import SCHEMA_VERSION, schema_fingerprint
+    from utils.audit_store import audit_store, partition_name
+    
+    fingerprint = schema_fingerprint()
+    marker = await db.schema_migrations.find_one({"_id": "bootstrap"})
+    if marker and marker.get('version') == SCHEMA_VERSION and marker.get('fingerprint') == fingerprint:
+        print(f"Database schema version {SCHEMA_VERSION} already applied")
+    else:
+        await normalize_transaction_hashes()
+        indexes_complete = await create_indexes()
+        await seed_default_admin()
+        if indexes_complete:
+            await db.schema_migrations.update_one(
+                {"_id": "bootstrap"},
+                {"$set": {
+                    "version": SCHEMA_VERSION,
+                    "fingerprint": fingerprint,
+                    "applied_at": datetime.now(timezone.utc)
+                }},
+                upsert=True
+            )
+        else:
+            # Not marked as applied, so the next start tries the missing indexes again
+            print("⚠️  Some indexes were not created; resolve the errors above and restart")
+    
+    await ensure_required_indexes()
+    
+    # Audit logs indexes (current monthly partition; later months are indexed on first write)
+    await audit_store.ensure_partition(db, partition_name(datetime.now(timezone.utc)))
 
 async def seed_default_admin():
     """Create default admin user if not exists"""
-    from security import hash_password
+    from utils.password_hasher import password_hasher
     from datetime import datetime, timezone
     
     # Check if admin already exists
@@ -98,15 +166,15 @@ async def seed_default_admin():
             "id": "admin-default-001",
             "email": "admin@trading.com",
             "username": "superadmin",
-            "password_hash": hash_password("Admin@123456"),
+            "password_hash": await password_hasher.hash("Admin@123456"),
             "full_name": "Super Administrator",
             "role": "super_admin",
             "is_active": True,
             "is_2fa_enabled": False,
             "totp_secret": None,
             "last_login": None,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         }
         
         await db.admin_users.insert_one(admin_user)
@@ -132,8 +200,8 @@ async def seed_api_permissions():
             "description": "Read access to documents",
             "category": "documents",
             "is_active": True,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         },
         {
             "id": "perm_documents_write",
@@ -141,8 +209,8 @@ async def seed_api_permissions():
             "description": "Create and upload documents",
             "category": "documents",
             "is_active": True,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         },
         {
             "id": "perm_wallet_read",
@@ -150,8 +218,8 @@ async def seed_api_permissions():
             "description": "Read wallet balance and transactions",
             "category": "wallet",
             "is_active": True,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         },
         {
             "id": "perm_wallet_withdraw",
@@ -159,8 +227,8 @@ async def seed_api_permissions():
             "description": "Request withdrawals from wallet",
             "category": "wallet",
             "is_active": True,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         },
         {
             "id": "perm_trading_read",
@@ -168,8 +236,8 @@ async def seed_api_permissions():
             "description": "View trading data and market prices",
             "category": "trading",
             "is_active": True,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         },
         {
             "id": "perm_trading_execute",
@@ -177,8 +245,8 @@ async def seed_api_permissions():
             "description": "Execute trades and place orders",
             "category": "trading",
             "is_active": True,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         },
         {
             "id": "perm_staking_read",
@@ -186,8 +254,8 @@ async def seed_api_permissions():
             "description": "View staking positions and rewards",
             "category": "staking",
             "is_active": True,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         },
         {
             "id": "perm_staking_manage",
@@ -195,8 +263,8 @@ async def seed_api_permissions():
             "description": "Stake and unstake tokens",
             "category": "staking",
             "is_active": True,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         },
         {
             "id": "perm_investment_read",
@@ -204,8 +272,8 @@ async def seed_api_permissions():
             "description": "View investment packages and positions",
             "category": "investment",
             "is_active": True,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         },
         {
             "id": "perm_investment_invest",
@@ -213,20 +281,23 @@ async def seed_api_permissions():
             "description": "Create investment positions",
             "category": "investment",
             "is_active": True,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         }
     ]
     
-    # Insert permissions if they don't exist
-    for perm in default_permissions:
-        existing = await db.api_permissions.find_one({"name": perm['name']})
-        if not existing:
-            await db.api_permissions.insert_one(perm)
+    # Insert permissions if they don't exist, in one round trip
+    result = await db.api_permissions.bulk_write([
+        UpdateOne({"name": perm['name']}, {"$setOnInsert": perm}, upsert=True)
+        for perm in default_permissions
+    ], ordered=False)
     
-    perm_count = await db.api_permissions.count_documents({})
-    print(f"✅ API Permissions seeded: {perm_count} permissions available")
+    print(f"✅ API Permissions seeded: {result.upserted_count} added, {len(default_permissions)} defaults")
 
 async def get_db():
-    """Dependency to get database instance"""
-    return db
\ No newline at end of file
+    """Dependency to get database instance (reads are bounded by the request deadline)"""
+    return DeadlineDatabase(db)
+
+async def get_analytics_db():
+    """Dependency for analytics reads that can tolerate replication lag"""
+    return DeadlineDatabase(analytics_db)
\ No newline at end of file
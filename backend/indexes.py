@@ -0,0 +1,300 @@
+"""
+Declarative index specification
+
+`INDEXES` lists every index per collection. `QUERY_SHAPES` lists the
+filter + sort of each route and background query that runs on a hot path.
+Each index below exists to serve one or more of those shapes. Compound
+keys follow equality -> sort -> range order, so a filtered, sorted page is
+served by a single index scan without an in-memory sort.
+
+`check_query_plans` explains every registered shape and reports the ones
+that fall back to a collection scan or a blocking sort; it runs in
+tests/test_query_plans.py. Add the shape here whenever a route gains a
+new filter or sort order.
+
+Audit log partitions are indexed by `utils.audit_store` as they are created.
+
+Startup skips data migrations, index creation and seeding when the
+`schema_migrations` bootstrap marker already holds `SCHEMA_VERSION` and the
+fingerprint of `INDEXES`. Bump `SCHEMA_VERSION` when the seed data or a
+migration changes; index changes are picked up by the fingerprint.
+
+A unique index that existing duplicates would break is skipped, except
+that startup fails while any of `REQUIRED_INDEXES` is missing.
+"""
+import hashlib
+from collections import namedtuple
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from bson import json_util
+from pymongo import ASCENDING as ASC, DESCENDING as DESC, IndexModel
+
+SCHEMA_VERSION = 2  # 2: lowercase stored deposit transaction hashes
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "admin_users": [
+        IndexModel("id", unique=True),
+        IndexModel("email", unique=True),
+        IndexModel("username", unique=True),
+        IndexModel([("created_at", DESC)]),
+        IndexModel([("role", ASC), ("created_at", DESC)]),
+        IndexModel([("is_active", ASC), ("created_at", DESC)]),
+    ],
+    "users": [
+        IndexModel("id", unique=True),
+        IndexModel("email", unique=True),
+        IndexModel("username", unique=True),
+        IndexModel("google_id", sparse=True),
+        IndexModel([("created_at", DESC)]),
+        IndexModel([("kyc_status", ASC), ("created_at", DESC)]),
+        IndexModel([("role", ASC), ("created_at", DESC)]),
+    ],
+    "documents": [
+        IndexModel("id", unique=True),
+        IndexModel("seller_id"),
+        IndexModel("category"),
+        IndexModel([("created_at", DESC)]),
+        IndexModel([("status", ASC), ("created_at", DESC)]),
+    ],
+    "transactions": [
+        IndexModel([("user_id", ASC), ("created_at", DESC)]),
+        IndexModel([("created_at", DESC)]),
+        IndexModel([("status", ASC), ("created_at", DESC)]),
+        # Also serves the revenue total ({type, status})
+        IndexModel([("type", ASC), ("status", ASC), ("created_at", DESC)]),
+    ],
+    "wallets": [
+        IndexModel("user_id", unique=True),
+    ],
+    "deposit_requests": [
+        IndexModel("id", unique=True),
+        # User history: user_id equality, created_at sort, payment_method prefix range
+        IndexModel([("user_id", ASC), ("created_at", DESC), ("payment_method", ASC)]),
+        IndexModel([("created_at", DESC)]),
+        IndexModel([("status", ASC), ("created_at", DESC)]),
+        # Deposit watcher queue, least recently checked first: only pending deposits are indexed
+        IndexModel(
+            [("metadata.network", ASC), ("metadata.watcher_checked_at", ASC)],
+            name="pending_by_network_checked",
+            partialFilterExpression={"status": "pending"}
+        ),
+        IndexModel(
+            [("metadata.network", ASC), ("metadata.transaction_hash", ASC)],
+            unique=True,
+            partialFilterExpression={"metadata.transaction_hash": {"$exists": True}}
+        ),
+    ],
+    "withdrawal_requests": [
+        IndexModel("id", unique=True),
+        IndexModel([("user_id", ASC), ("created_at", DESC), ("withdrawal_method", ASC)]),
+        IndexModel([("user_id", ASC), ("status", ASC), ("created_at", DESC)]),
+        IndexModel([("created_at", DESC)]),
+        IndexModel([("status", ASC), ("created_at", DESC)]),
+        IndexModel("payout_batch_id"),
+        # Payout engine queue: approved withdrawals in approval order
+        IndexModel(
+            [("processed_at", ASC)],
+            name="approved_by_processed_at",
+            partialFilterExpression={"status": "approved"}
+        ),
+    ],
+    "payout_batches": [
+        IndexModel("id", unique=True),
+        IndexModel([("network", ASC), ("status", ASC)]),
+        # Crash recovery: batches stuck in "building"
+        IndexModel([("status", ASC), ("updated_at", ASC)]),
+    ],
+    "withdrawal_daily_counters": [
+        # Expire once the day is over
+        IndexModel("expires_at", expireAfterSeconds=0),
+    ],
+    "staking_positions": [
+        IndexModel([("user_id", ASC), ("status", ASC)]),
+        IndexModel("status"),
+    ],
+    "investment_positions": [
+        IndexModel([("user_id", ASC), ("status", ASC)]),
+        IndexModel("status"),
+    ],
+    "kyc_submissions": [
+        IndexModel("id", unique=True),
+        IndexModel([("user_id", ASC), ("status", ASC)]),
+        IndexModel([("created_at", DESC)]),
+        IndexModel([("status", ASC), ("created_at", DESC)]),
+        # Multikey: file download looks up the submission owning a file
+        IndexModel("file_ids"),
+        IndexModel(
+            "analysis.validation_score",
+            partialFilterExpression={"analysis.validation_score": {"$exists": True}}
+        ),
+    ],
+    "revoked_tokens": [
+        # Kept until the token would have expired
+        IndexModel("jti", unique=True),
+        IndexModel("revoked_at"),
+        IndexModel("expires_at", expireAfterSeconds=0),
+    ],
+    "api_tokens": [
+        IndexModel("id", unique=True),
+        IndexModel("token_key", unique=True),
+        IndexModel([("created_at", DESC)]),
+        IndexModel([("user_id", ASC), ("created_at", DESC)]),
+        IndexModel([("is_active", ASC), ("created_at", DESC)]),
+        IndexModel("expires_at"),
+    ],
+    "api_token_usage": [
+        # One document per token and minute
+        IndexModel([("token_id", ASC), ("minute", ASC)], unique=True),
+        IndexModel("expires_at", expireAfterSeconds=0),
+    ],
+    "api_permissions": [
+        IndexModel("id", unique=True),
+        IndexModel("name", unique=True),
+        IndexModel("category"),
+        IndexModel("is_active"),
+    ],
+    "rate_limits": [
+        # Shared rate limit counters (RATE_LIMIT_BACKEND=mongo)
+        IndexModel("expires_at", expireAfterSeconds=0),
+    ],
+    "system_settings": [
+        IndexModel("id", unique=True),
+    ],
+}
+
+
+# Unique indexes the app relies on instead of checking in code: web3
+# deposits refuse a transaction hash submitted twice only through this one
+REQUIRED_INDEXES: Dict[str, List[str]] = {
+    "deposit_requests": ["metadata.network_1_metadata.transaction_hash_1"],
+}
+
+
+def schema_fingerprint() -> str:
+    """Stable hash of the declared indexes"""
+    spec = {
+        collection: [model.document for model in models]
+        for collection, models in sorted(INDEXES.items())
+    }
+    return hashlib.sha256(json_util.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
+QueryShape = namedtuple("QueryShape", ["name", "collection", "filter", "sort"])
+
+# Sample values only need the right type; the planner picks indexes by shape
+QUERY_SHAPES: List[QueryShape] = [
+    # Admin listings
+    QueryShape("admin users", "admin_users", {}, [("created_at", DESC)]),
+    QueryShape("admin users by role", "admin_users", {"role": "admin"}, [("created_at", DESC)]),
+    QueryShape("admin users by state", "admin_users", {"is_active": True}, [("created_at", DESC)]),
+    QueryShape("users", "users", {}, [("created_at", DESC)]),
+    QueryShape("users by kyc status", "users", {"kyc_status": "pending"}, [("created_at", DESC)]),
+    QueryShape("users by role", "users", {"role": "user"}, [("created_at", DESC)]),
+    QueryShape("documents", "documents", {}, [("created_at", DESC)]),
+    QueryShape("documents by status", "documents", {"status": "pending"}, [("created_at", DESC)]),
+    QueryShape("deposits", "deposit_requests", {}, [("created_at", DESC)]),
+    QueryShape("deposits by status", "deposit_requests", {"status": "pending"}, [("created_at", DESC)]),
+    QueryShape("withdrawals", "withdrawal_requests", {}, [("created_at", DESC)]),
+    QueryShape("withdrawals by status", "withdrawal_requests", {"status": "pending"}, [("created_at", DESC)]),
+    QueryShape("transactions", "transactions", {}, [("created_at", DESC)]),
+    QueryShape("transactions by status", "transactions", {"status": "completed"}, [("created_at", DESC)]),
+    QueryShape(
+        "transactions by type", "transactions", {"type": "purchase", "status": "completed"}, [("created_at", DESC)]
+    ),
+    QueryShape("kyc queue", "kyc_submissions", {"status": "pending"}, [("created_at", DESC)]),
+    QueryShape("kyc submissions", "kyc_submissions", {}, [("created_at", DESC)]),
+    QueryShape("api tokens", "api_tokens", {}, [("created_at", DESC)]),
+    QueryShape("api tokens by user", "api_tokens", {"user_id": "u"}, [("created_at", DESC)]),
+    QueryShape("api tokens by state", "api_tokens", {"is_active": True}, [("created_at", DESC)]),
+    # Point lookups
+    QueryShape("user by id", "users", {"id": "u"}, None),
+    QueryShape("user by google id", "users", {"google_id": "g"}, None),
+    QueryShape("admin by id", "admin_users", {"id": "a"}, None),
+    QueryShape("deposit by id", "deposit_requests", {"id": "d"}, None),
+    QueryShape("withdrawal by id", "withdrawal_requests", {"id": "w"}, None),
+    QueryShape("document by id", "documents", {"id": "d"}, None),
+    QueryShape("kyc by id", "kyc_submissions", {"id": "k"}, None),
+    QueryShape("kyc by file", "kyc_submissions", {"file_ids": "f"}, None),
+    QueryShape("api token by id", "api_tokens", {"id": "t"}, None),
+    QueryShape("api permission by id", "api_permissions", {"id": "p"}, None),
+    # User-facing
+    QueryShape("user kyc", "kyc_submissions", {"user_id": "u", "status": {"$in": ["pending", "approved"]}}, None),
+    QueryShape(
+        "user deposit history", "deposit_requests",
+        {"user_id": "u", "payment_method": {"$regex": "^web3_"}}, [("created_at", DESC)]
+    ),
+    QueryShape(
+        "user withdrawal history", "withdrawal_requests",
+        {"user_id": "u", "withdrawal_method": {"$regex": "^web3_"}}, [("created_at", DESC)]
+    ),
+    QueryShape(
+        "user withdrawals by status", "withdrawal_requests",
+        {"user_id": "u", "status": "pending"}, [("created_at", DESC)]
+    ),
+    QueryShape("user transactions", "transactions", {"user_id": "u"}, [("created_at", DESC)]),
+    QueryShape("user stakings", "staking_positions", {"user_id": "u", "status": "active"}, None),
+    QueryShape("user investments", "investment_positions", {"user_id": "u", "status": "active"}, None),
+    # Background workers
+    QueryShape(
+        "deposit watcher", "deposit_requests",
+        {
+            "status": "pending",
+            "metadata.deposit_type": "crypto",
+            "metadata.network": "ethereum",
+            "metadata.watcher_status": {"$nin": ["needs_review", "verified"]}
+        },
+        [("metadata.watcher_checked_at", ASC)]
+    ),
+    QueryShape(
+        "payout engine", "withdrawal_requests",
+        {"status": "approved", "metadata.withdrawal_type": "crypto", "payout_status": "queued"},
+        [("processed_at", ASC)]
+    ),
+    QueryShape(
+        "payout recovery", "withdrawal_requests",
+        {"status": "approved", "payout_status": "batched", "updated_at": {"$lt": datetime(2000, 1, 1)}}, None
+    ),
+    QueryShape(
+        "stale payout batches", "payout_batches",
+        {"status": "building", "updated_at": {"$lt": datetime(2000, 1, 1)}}, None
+    ),
+    QueryShape("payout batch", "withdrawal_requests", {"payout_batch_id": "b"}, None),
+]
+
+# Plan stages that mean the query is not served by an index
+BAD_STAGES = {"COLLSCAN", "SORT"}
+
+
+def plan_stages(plan) -> List[str]:
+    """Every stage name in an explain() plan tree (classic and SBE formats)"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"].upper())
+        for key, value in plan.items():
+            if key in ("inputStage", "queryPlan", "winningPlan", "inputStages", "shards"):
+                stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+
+async def explain_shape(db, shape: QueryShape) -> List[str]:
+    cursor = db[shape.collection].find(shape.filter)
+    if shape.sort:
+        cursor = cursor.sort(shape.sort)
+    explained = await cursor.explain()
+    return plan_stages(explained["queryPlanner"]["winningPlan"])
+
+
+async def check_query_plans(db, shapes: Optional[List[QueryShape]] = None) -> List[str]:
+    """Names and stages of the shapes whose winning plan scans or sorts in memory"""
+    problems = []
+    for shape in shapes or QUERY_SHAPES:
+        stages = await explain_shape(db, shape)
+        bad = BAD_STAGES.intersection(stages)
+        if bad:
+            problems.append(f"{shape.name} ({shape.collection}): {', '.join(sorted(bad))}")
+    return problems
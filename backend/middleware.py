@@ -1,55 +1,159 @@
 from fastapi import Request, HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Optional, Dict
-import time
-from collections import defaultdict
 from datetime import datetime, timezone
-import os
-from motor.motor_asyncio import AsyncIOMotorClient
-from security import decode_token
+from security import token_cache, check_permission
+from database import get_db
+from utils.token_revocation import revocation_list
+from utils.permissions import permission_registry
+from utils.admin_state import admin_state_cache
+from utils.audit_writer import audit_writer
+from utils.audit_store import normalize_record
+from utils.api_keys import (
+    api_key_index, api_key_usage, hash_api_key,
+    DEFAULT_TOKEN_RATE_PER_MINUTE, DEFAULT_TOKEN_DAILY_QUOTA
+)
+from utils.rate_limit import create_rate_limit_backend, retry_after_header
+from utils.deadline import budget_for, reset_deadline, start_deadline
 
-# Rate limiting storage (in-memory)
-rate_limit_storage = defaultdict(lambda: {'count': 0, 'reset_time': time.time() + 60})
+# Rate limiting storage (bounded in-memory store or shared Mongo counters)
+rate_limit_backend = create_rate_limit_backend()
 
 # Security scheme
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+class CORSHeaderMiddleware:
+    """Pure ASGI middleware that forces permissive CORS headers on every response"""
+    
+    HEADERS = [
+        (b"access-control-allow-origin", b"*"),
+        (b"access-control-allow-methods", b"GET, POST, PUT, DELETE, OPTIONS"),
+        (b"access-control-allow-headers", b"*"),
+    ]
+    OVERRIDDEN = {name for name, _ in HEADERS}
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers = [
+                    (name, value) for name, value in message.get("headers", [])
+                    if name.lower() not in self.OVERRIDDEN
+                ]
+                message["headers"] = headers + self.HEADERS
+            await send(message)
+        
+        await self.app(scope, receive, send_with_headers)
+
+class DeadlineMiddleware:
+    """Pure ASGI middleware that gives every request a time budget (see utils/deadline.py)"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        budget = budget_for(scope["path"]) if scope["type"] == "http" else None
+        if budget is None:
+            await self.app(scope, receive, send)
+            return
+        
+        # Only sets the deadline; the handler is never cancelled part-way
+        token = start_deadline(budget)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            reset_deadline(token)
+
+def get_api_key(request: Request) -> Optional[str]:
+    """API key from the X-API-Key header or an `Authorization: Bearer tk_...` header"""
+    api_key = request.headers.get("x-api-key")
+    if api_key:
+        return api_key
+    
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer ") and authorization[7:].strip().startswith("tk_"):
+        return authorization[7:].strip()
+    
+    return None
+
+def api_key_expired(principal: Dict) -> bool:
+    return bool(principal['expires_at'] and principal['expires_at'] <= datetime.now(timezone.utc))
+
+async def get_rate_limit_principal(request: Request, db) -> str:
+    """Identify who is calling: API token, authenticated user, or client IP
+    
+    Only a key that resolves to an active, unexpired token counts as a
+    principal; otherwise sending a random key with every request would get
+    a fresh bucket each time.
+    """
+    api_key = get_api_key(request)
+    if api_key:
+        principal = await api_key_index.resolve(db, hash_api_key(api_key))
+        if principal and principal['is_active'] and not api_key_expired(principal):
+            return f"key:{principal['token_id']}"
+    
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        try:
+            payload = token_cache.decode(authorization[7:].strip())
+            if payload.get('sub'):
+                return f"user:{payload['sub']}"
+        except HTTPException:
+            pass
+    
+    return f"ip:{request.client.host if request.client else 'unknown'}"
 
 class RateLimiter:
-    """Rate limiting middleware"""
+    """Rate limiting dependency, keyed per route class and principal"""
     
-    def __init__(self, requests_per_minute: int = 100):
+    def __init__(
+        self,
+        requests_per_minute: int = 100,
+        route_class: str = "default",
+        algorithm: str = "sliding_window",
+        burst: Optional[int] = None
+    ):
+        if algorithm not in ("sliding_window", "token_bucket"):
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm}")
         self.requests_per_minute = requests_per_minute
+        self.route_class = route_class
+        self.algorithm = algorithm
+        self.burst = burst or requests_per_minute
     
-    async def __call__(self, request: Request):
-        client_ip = request.client.host
-        current_time = time.time()
-        
-        # Check if rate limit window has expired
-        if current_time > rate_limit_storage[client_ip]['reset_time']:
-            rate_limit_storage[client_ip] = {
-                'count': 0,
-                'reset_time': current_time + 60
-            }
+    async def __call__(self, request: Request, db = Depends(get_db)):
+        key = f"{self.route_class}:{await get_rate_limit_principal(request, db)}"
         
-        # Increment request count
-        rate_limit_storage[client_ip]['count'] += 1
+        if self.algorithm == "token_bucket":
+            result = await rate_limit_backend.token_bucket(key, self.burst, self.requests_per_minute / 60)
+        else:
+            result = await rate_limit_backend.sliding_window(key, self.requests_per_minute, 60)
         
         # Check if limit exceeded
-        if rate_limit_storage[client_ip]['count'] > self.requests_per_minute:
+        if not result.allowed:
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="Rate limit exceeded. Please try again later."
+                detail="Rate limit exceeded. Please try again later.",
+                headers={"Retry-After": retry_after_header(result)}
             )
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    request: Request = None
+    request: Request = None,
+    db = Depends(get_db)
 ) -> Dict:
     """Get current authenticated user from token"""
     token = credentials.credentials
     
     try:
-        payload = decode_token(token)
+        # Verified claims are cached per token until they expire
+        payload = token_cache.decode(token)
         
         # Verify token type
         if payload.get('type') != 'access':
@@ -67,10 +171,12 @@ async def get_current_user(
                 detail="Invalid token payload"
             )
         
-        return {
+        current_user = {
             'id': user_id,
             'role': role,
-            'email': payload.get('email')
+            'email': payload.get('email'),
+            'jti': payload.get('jti'),
+            'exp': payload.get('exp')
         }
     
     except Exception as e:
@@ -78,32 +184,190 @@ async def get_current_user(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials"
         )
+    
+    # Bloom filter fast path: only possible revocations reach the database
+    if current_user['jti'] and await revocation_list.is_revoked(db, current_user['jti']):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has been revoked"
+        )
+    
+    return current_user
 
-async def get_current_admin_user(
-    current_user: Dict = Depends(get_current_user)
+async def get_api_principal(
+    request: Request,
+    db = Depends(get_db)
 ) -> Dict:
-    """Verify user is an admin"""
-    allowed_roles = ['admin', 'super_admin', 'moderator']
+    """Authenticate a request made with an API key"""
+    api_key = get_api_key(request)
+    if not api_key:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="API key required"
+        )
+    
+    principal = await api_key_index.resolve(db, hash_api_key(api_key))
+    if not principal or not principal['is_active']:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid API key"
+        )
+    
+    if api_key_expired(principal):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="API key has expired"
+        )
+    
+    await enforce_api_token_quota(principal)
+    api_key_usage.record(principal['token_id'])
+    
+    return {
+        'id': principal['user_id'],
+        'role': 'user',
+        'email': None,
+        'token_id': principal['token_id'],
+        'permissions': principal['permissions'],
+        'permission_mask': permission_registry.principal_mask(principal)
+    }
+
+async def enforce_api_token_quota(principal: Dict):
+    """Apply the token's per-minute token bucket, then its daily quota"""
+    token_id = principal['token_id']
+    rate = principal['rate_limit_per_minute'] or DEFAULT_TOKEN_RATE_PER_MINUTE
+    burst = principal['burst'] or rate
+    daily_quota = principal['daily_quota'] or DEFAULT_TOKEN_DAILY_QUOTA
+    
+    result = await rate_limit_backend.token_bucket(f"api_token:{token_id}", burst, rate / 60)
+    detail = "API token rate limit exceeded"
+    if result.allowed and daily_quota:
+        result = await rate_limit_backend.fixed_window(f"api_token_daily:{token_id}", daily_quota, 86400)
+        detail = "API token daily quota exhausted"
+    
+    if not result.allowed:
+        api_key_usage.record(token_id, throttled=True)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=detail,
+            headers={"Retry-After": retry_after_header(result)}
+        )
+
+def get_user_or_api_principal(permission: str):
+    """Accept either a user access token or an API key holding `permission`"""
+    async def dependency(
+        request: Request,
+        credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+        db = Depends(get_db)
+    ) -> Dict:
+        if get_api_key(request):
+            await permission_registry.ensure_fresh(db)
+            principal = await get_api_principal(request, db)
+            if not permission_registry.allows(principal['permission_mask'], permission):
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail=f"API key lacks permission: {permission}"
+                )
+            return principal
+        
+        if not credentials:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Not authenticated"
+            )
+        return await get_current_user(credentials, request, db)
     
-    if current_user.get('role') not in allowed_roles:
+    return dependency
+
+ADMIN_ROLES = ['admin', 'super_admin', 'moderator']
+
+async def authorize_admin(db, current_user: Dict) -> Dict:
+    """Check that the user is an active admin, using the admin's current role"""
+    if current_user.get('role') not in ADMIN_ROLES:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin access required"
         )
     
-    return current_user
+    # The token's role may be stale; the cached account state is authoritative
+    state = await admin_state_cache.get(db, current_user['id'])
+    if not state:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Admin account not found"
+        )
+    
+    if not state['is_active']:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin account is deactivated"
+        )
+    
+    if state['role'] not in ADMIN_ROLES:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    
+    return {**current_user, 'role': state['role']}
+
+async def get_current_admin_user(
+    current_user: Dict = Depends(get_current_user),
+    db = Depends(get_db)
+) -> Dict:
+    """Verify user is an active admin, using the admin's current role"""
+    return await authorize_admin(db, current_user)
+
+async def reauthorize_admin(db, current_admin: Dict, permission: str) -> Dict:
+    """
+    Repeat the admin checks for a long-lived connection: the token must not
+    have expired or been revoked, and the account must still be active
+    with a role that grants `permission`
+    """
+    exp = current_admin.get('exp')
+    if exp and exp <= datetime.now(timezone.utc).timestamp():
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has expired"
+        )
+    
+    if current_admin.get('jti') and await revocation_list.is_revoked(db, current_admin['jti']):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has been revoked"
+        )
+    
+    current_admin = await authorize_admin(db, current_admin)
+    if not check_permission(current_admin['role'], permission):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Insufficient permissions"
+        )
+    
+    return current_admin
 
 async def get_current_super_admin(
-    current_user: Dict = Depends(get_current_user)
+    current_admin: Dict = Depends(get_current_admin_user)
 ) -> Dict:
     """Verify user is a super admin"""
-    if current_user.get('role') != 'super_admin':
+    if current_admin.get('role') != 'super_admin':
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Super admin access required"
         )
     
-    return current_user
+    return current_admin
+
+def require_permission(permission: str):
+    """Dependency factory: the current admin's role must grant `permission`"""
+    async def dependency(current_admin: Dict = Depends(get_current_admin_user)) -> Dict:
+        if not check_permission(current_admin.get('role'), permission):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Insufficient permissions"
+            )
+        return current_admin
+    
+    return dependency
 
 async def log_audit(
     db,
@@ -111,16 +375,25 @@ async def log_audit(
     action: str,
     details: dict,
     ip_address: Optional[str] = None,
-    user_agent: Optional[str] = None
+    user_agent: Optional[str] = None,
+    critical: bool = False
 ):
-    """Log audit trail"""
+    """Log audit trail
+    
+    Records are written behind in batches; `critical` records are written
+    before returning.
+    """
     audit_log = {
         'user_id': user_id,
         'action': action,
         'details': details,
         'ip_address': ip_address,
         'user_agent': user_agent,
-        'timestamp': datetime.now(timezone.utc).isoformat()
+        'timestamp': datetime.now(timezone.utc)
     }
+    normalize_record(audit_log)
     
-    await db.audit_logs.insert_one(audit_log)
\ No newline at end of file
+    if critical or not audit_writer.running:
+        await audit_writer.write(db, audit_log)
+    else:
+        audit_writer.enqueue(audit_log)
\ No newline at end of file
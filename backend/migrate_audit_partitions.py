@@ -0,0 +1,136 @@
+"""
+Audit log partition migration
+
+Moves records from the legacy unpartitioned `audit_logs` collection into
+the monthly `audit_logs_YYYYMM` partitions. Records keep their `_id`, so
+the migration can be interrupted and re-run: records that were already
+copied are skipped as duplicates. The legacy collection is only dropped
+with --drop, once every record has been copied.
+
+Copied records get the normalized lookup fields (action_lc, subject_type,
+subject_id). --backfill adds them to partition records written before
+those fields existed.
+
+Usage:
+    python migrate_audit_partitions.py [--batch-size 5000] [--drop] [--backfill]
+"""
+import argparse
+import asyncio
+import sys
+import time
+from typing import List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from database import client, db
+from utils.audit_store import LEGACY_COLLECTION, PARTITION_PATTERN, audit_store, normalize_record
+
+DEFAULT_BATCH_SIZE = 5000
+DUPLICATE_KEY = 11000
+
+
+async def copy_batch(records: List[dict]) -> int:
+    """Insert a batch into its partitions; returns how many were new"""
+    inserted = 0
+    for name, group in audit_store.group_by_partition(records).items():
+        await audit_store.ensure_partition(db, name)
+        try:
+            result = await db[name].insert_many(group, ordered=False)
+            inserted += len(result.inserted_ids)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if any(err.get('code') != DUPLICATE_KEY for err in errors):
+                raise
+            inserted += e.details.get('nInserted', 0)
+    return inserted
+
+
+async def migrate(batch_size: int) -> tuple:
+    legacy = db[LEGACY_COLLECTION]
+    copied = 0
+    seen = 0
+    batch = []
+
+    async for record in legacy.find({}).sort("_id", 1).batch_size(batch_size):
+        batch.append(normalize_record(record))
+        if len(batch) >= batch_size:
+            copied += await copy_batch(batch)
+            seen += len(batch)
+            batch = []
+            print(f"   … {seen} records processed")
+
+    if batch:
+        copied += await copy_batch(batch)
+        seen += len(batch)
+
+    return seen, copied
+
+
+async def backfill(batch_size: int) -> int:
+    """Add normalized lookup fields to partition records that lack them"""
+    updated = 0
+    for name in await db.list_collection_names():
+        if not PARTITION_PATTERN.match(name):
+            continue
+
+        operations = []
+        async for record in db[name].find({"action_lc": {"$exists": False}}).batch_size(batch_size):
+            normalize_record(record)
+            operations.append(UpdateOne(
+                {"_id": record['_id']},
+                {"$set": {
+                    "action_lc": record['action_lc'],
+                    "subject_type": record['subject_type'],
+                    "subject_id": record['subject_id']
+                }}
+            ))
+            if len(operations) >= batch_size:
+                await db[name].bulk_write(operations, ordered=False)
+                updated += len(operations)
+                operations = []
+
+        if operations:
+            await db[name].bulk_write(operations, ordered=False)
+            updated += len(operations)
+    return updated
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Move legacy audit logs into monthly partitions")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Records per insert")
+    parser.add_argument("--drop", action="store_true", help="Drop the legacy collection after copying")
+    parser.add_argument("--backfill", action="store_true", help="Add lookup fields to existing partition records")
+    args = parser.parse_args(argv)
+
+    print("📦 Migrating audit logs into monthly partitions...")
+    started = time.monotonic()
+
+    try:
+        if args.backfill:
+            updated = await backfill(args.batch_size)
+            print(f"✅ Added lookup fields to {updated} partition records")
+
+        if LEGACY_COLLECTION not in await db.list_collection_names():
+            print("✅ No legacy audit_logs collection, nothing to migrate")
+            return 0
+
+        seen, copied = await migrate(args.batch_size)
+        print(f"✅ {seen} records processed, {copied} copied ({seen - copied} already present)")
+
+        if args.drop:
+            remaining = await db[LEGACY_COLLECTION].estimated_document_count()
+            if remaining > seen:
+                print("⚠️  New records arrived in the legacy collection; re-run before dropping")
+                return 1
+            await db.drop_collection(LEGACY_COLLECTION)
+            print("🗑️  Dropped legacy audit_logs collection")
+    finally:
+        client.close()
+
+    print(f"⏱️  Finished in {time.monotonic() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
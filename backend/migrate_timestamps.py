@@ -0,0 +1,157 @@
+"""
+Timestamp migration: ISO strings -> native BSON dates
+
+Converts the ISO-string timestamps written before the storage switch
+(see utils/timestamps.py) into native dates, in place, collection by
+collection. The application keeps running while this runs:
+
+- documents are walked in `_id` order in batches; each batch is one
+  unordered bulk write
+- every update is conditional on the old string value, so a document
+  rewritten by the application in the meantime is left alone
+- progress is stored in `schema_migrations` after every batch, so an
+  interrupted run continues where it stopped
+
+API usage rollups keyed by an ISO-string `minute` are folded into the
+rollup for the same minute as a date: each string document is deleted
+first, then its counts are added with an upsert, so no count is added
+twice when two runs overlap.
+
+Usage:
+    python migrate_timestamps.py [--batch-size 1000] [--collection users ...] [--pause 0.05] [--restart]
+"""
+import argparse
+import asyncio
+import sys
+import time
+from typing import List, Optional
+
+from pymongo import UpdateOne
+
+from database import client, db
+from utils.timestamps import TIMESTAMP_FIELDS, encode_timestamps, parse_timestamp
+
+DEFAULT_BATCH_SIZE = 1000
+PROGRESS_COLLECTION = "schema_migrations"
+PROGRESS_PREFIX = "timestamps:"
+
+
+def _has_string_timestamp() -> dict:
+    return {"$or": [{field: {"$type": "string"}} for field in TIMESTAMP_FIELDS]}
+
+
+async def migrate_collection(name: str, batch_size: int, pause: float) -> int:
+    progress_id = PROGRESS_PREFIX + name
+    progress = await db[PROGRESS_COLLECTION].find_one({"_id": progress_id}) or {}
+    if progress.get("done"):
+        print(f"   {name}: already migrated")
+        return 0
+
+    last_id = progress.get("last_id")
+    converted = progress.get("converted", 0)
+    while True:
+        query = _has_string_timestamp()
+        if last_id is not None:
+            query = {"$and": [{"_id": {"$gt": last_id}}, query]}
+        projection = {field: 1 for field in TIMESTAMP_FIELDS}
+        batch = await db[name].find(query, projection).sort("_id", 1).to_list(batch_size)
+        if not batch:
+            break
+
+        operations = []
+        for doc in batch:
+            updates = encode_timestamps(doc)
+            if updates:
+                # Only if the application has not rewritten these fields meanwhile
+                unchanged = {field: doc[field] for field in updates}
+                operations.append(UpdateOne({"_id": doc['_id'], **unchanged}, {"$set": updates}))
+        if operations:
+            result = await db[name].bulk_write(operations, ordered=False)
+            converted += result.modified_count
+
+        last_id = batch[-1]['_id']
+        await db[PROGRESS_COLLECTION].update_one(
+            {"_id": progress_id},
+            {"$set": {"last_id": last_id, "converted": converted}},
+            upsert=True
+        )
+        if pause:
+            await asyncio.sleep(pause)
+
+    await db[PROGRESS_COLLECTION].update_one(
+        {"_id": progress_id},
+        {"$set": {"done": True, "converted": converted}},
+        upsert=True
+    )
+    print(f"   {name}: {converted} documents converted")
+    return converted
+
+
+async def migrate_usage_minutes(batch_size: int, pause: float) -> int:
+    folded = 0
+    while True:
+        batch = await db.api_token_usage.find({"minute": {"$type": "string"}}).to_list(batch_size)
+        if not batch:
+            break
+
+        operations = []
+        for doc in batch:
+            # Whoever deletes the string document adds its counts
+            result = await db.api_token_usage.delete_one({"_id": doc['_id']})
+            if result.deleted_count != 1:
+                continue
+            minute = parse_timestamp(doc['minute'])
+            operations.append(UpdateOne(
+                {"token_id": doc['token_id'], "minute": minute},
+                {
+                    "$inc": {"requests": doc.get('requests', 0), "throttled": doc.get('throttled', 0)},
+                    "$setOnInsert": {"expires_at": doc.get('expires_at')}
+                },
+                upsert=True
+            ))
+        if operations:
+            await db.api_token_usage.bulk_write(operations, ordered=False)
+            folded += len(operations)
+        if pause:
+            await asyncio.sleep(pause)
+
+    print(f"   api_token_usage: {folded} minutes folded into date keys")
+    return folded
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Convert ISO-string timestamps to native dates")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Documents per bulk write")
+    parser.add_argument("--collection", action="append", help="Only migrate this collection (repeatable)")
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+    parser.add_argument("--restart", action="store_true", help="Forget saved progress and start over")
+    args = parser.parse_args(argv)
+
+    print("🕒 Converting ISO-string timestamps to native dates...")
+    started = time.monotonic()
+
+    try:
+        names = args.collection or sorted(
+            name for name in await db.list_collection_names()
+            if not name.startswith("system.") and name != PROGRESS_COLLECTION
+        )
+        if args.restart:
+            await db[PROGRESS_COLLECTION].delete_many(
+                {"_id": {"$in": [PROGRESS_PREFIX + name for name in names]}}
+            )
+
+        total = 0
+        for name in names:
+            total += await migrate_collection(name, args.batch_size, args.pause)
+        if "api_token_usage" in names:
+            total += await migrate_usage_minutes(args.batch_size, args.pause)
+        print(f"✅ {total} documents converted")
+    finally:
+        client.close()
+
+    print(f"⏱️  Finished in {time.monotonic() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
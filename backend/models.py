@@ -293,6 +293,10 @@ class TokenResponse(BaseModel):
     refresh_token: str
     token_type: str = "bearer"
 
+class LogoutRequest(BaseModel):
+    """Optional logout payload to also revoke the refresh token"""
+    refresh_token: Optional[str] = None
+
 class MessageResponse(BaseModel):
     """Generic message response"""
     message: str
@@ -324,6 +328,11 @@ class APIToken(BaseModel):
     is_active: bool = True
     expires_at: Optional[datetime] = None
     last_used_at: Optional[datetime] = None
+    usage_count: int = 0
+    # Throughput limits; None falls back to the platform defaults
+    rate_limit_per_minute: Optional[int] = None
+    burst: Optional[int] = None
+    daily_quota: Optional[int] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -333,12 +342,18 @@ class APITokenCreate(BaseModel):
     name: str
     permissions: List[str] = Field(default_factory=list)
     expires_in_days: Optional[int] = None  # None = no expiration
+    rate_limit_per_minute: Optional[int] = Field(None, ge=1)
+    burst: Optional[int] = Field(None, ge=1)
+    daily_quota: Optional[int] = Field(None, ge=1)
 
 class APITokenUpdate(BaseModel):
     """Schema for updating API token"""
     name: Optional[str] = None
     permissions: Optional[List[str]] = None
     is_active: Optional[bool] = None
+    rate_limit_per_minute: Optional[int] = Field(None, ge=1)
+    burst: Optional[int] = Field(None, ge=1)
+    daily_quota: Optional[int] = Field(None, ge=1)
 
 # ============ API PERMISSION MODELS ============
 
@@ -0,0 +1,157 @@
+"""
+Shared MongoDB client factory
+
+The app, background services and scripts share one AsyncIOMotorClient
+(see database.py), so each process holds one connection pool. All
+settings come from the environment and are only passed when they are
+set, so options given in MONGO_URL keep working:
+
+    MONGO_MAX_POOL_SIZE / MONGO_MIN_POOL_SIZE / MONGO_MAX_IDLE_TIME_MS
+    MONGO_WAIT_QUEUE_TIMEOUT_MS   how long a request waits for a free connection
+    MONGO_CONNECT_TIMEOUT_MS / MONGO_SOCKET_TIMEOUT_MS / MONGO_SERVER_SELECTION_TIMEOUT_MS
+    MONGO_COMPRESSORS             e.g. "zstd,snappy,zlib" (zstd needs `zstandard`,
+                                  snappy needs `python-snappy`)
+    MONGO_READ_PREFERENCE         primary, primaryPreferred, secondaryPreferred, ...
+    MONGO_WRITE_CONCERN           w value: "majority" or a number
+    MONGO_WRITE_CONCERN_TIMEOUT_MS / MONGO_JOURNAL
+    MONGO_APP_NAME                shown in server logs and currentOp
+
+`pool_stats` receives pymongo's connection pool events and is reported on
+GET /admin/system/metrics.
+
+Analytics reads (dashboard counts, statistics, audit browsing, wallet
+reconciliation) go through `database.analytics_db`. That handle uses
+`analytics_read_preference()`, so on a replica set they are served by a
+secondary no more than ANALYTICS_MAX_STALENESS_SECONDS behind the
+primary. Money-moving reads stay on `database.db`, which reads from the
+primary.
+
+    ANALYTICS_READ_PREFERENCE         default secondaryPreferred ("primary" turns routing off)
+    ANALYTICS_MAX_STALENESS_SECONDS   default 90 (the driver's minimum), -1 for no bound
+"""
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+from utils.timestamps import CLIENT_OPTIONS
+
+# env var -> client option
+INT_OPTIONS = {
+    "MONGO_MAX_POOL_SIZE": "maxPoolSize",
+    "MONGO_MIN_POOL_SIZE": "minPoolSize",
+    "MONGO_MAX_IDLE_TIME_MS": "maxIdleTimeMS",
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": "waitQueueTimeoutMS",
+    "MONGO_CONNECT_TIMEOUT_MS": "connectTimeoutMS",
+    "MONGO_SOCKET_TIMEOUT_MS": "socketTimeoutMS",
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": "serverSelectionTimeoutMS",
+    "MONGO_WRITE_CONCERN_TIMEOUT_MS": "wTimeoutMS",
+}
+STRING_OPTIONS = {
+    "MONGO_COMPRESSORS": "compressors",
+    "MONGO_READ_PREFERENCE": "readPreference",
+    "MONGO_APP_NAME": "appname",
+}
+
+READ_PREFERENCES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+DEFAULT_MAX_STALENESS = 90  # seconds; the smallest value drivers accept
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool events per server address"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def _bump(self, event, **changes):
+        address = "%s:%s" % event.address
+        with self._lock:
+            pool = self._pools[address]
+            for key, delta in changes.items():
+                pool[key] += delta
+
+    def pool_created(self, event):
+        self._bump(event, pools_created=1)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._bump(event, pool_cleared=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._bump(event, open=1, created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._bump(event, open=-1, closed=1)
+
+    def connection_check_out_started(self, event):
+        self._bump(event, waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._bump(event, waiting=-1, checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._bump(event, waiting=-1, in_use=1, checkouts=1)
+
+    def connection_checked_in(self, event):
+        self._bump(event, in_use=-1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {address: dict(pool) for address, pool in self._pools.items()}
+
+
+def client_options() -> dict:
+    """Client keyword arguments from the environment (unset options are omitted)"""
+    options = dict(CLIENT_OPTIONS)
+    for env, option in INT_OPTIONS.items():
+        if os.getenv(env):
+            options[option] = int(os.environ[env])
+    for env, option in STRING_OPTIONS.items():
+        if os.getenv(env):
+            options[option] = os.environ[env]
+
+    w = os.getenv("MONGO_WRITE_CONCERN")
+    if w:
+        options["w"] = int(w) if w.isdigit() else w
+    if os.getenv("MONGO_JOURNAL"):
+        options["journal"] = os.environ["MONGO_JOURNAL"].lower() in ("1", "true", "yes")
+    return options
+
+
+def analytics_read_preference():
+    mode = os.getenv("ANALYTICS_READ_PREFERENCE", "secondaryPreferred")
+    if mode == "primary":
+        return Primary()
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"Unknown ANALYTICS_READ_PREFERENCE: {mode}")
+    max_staleness = int(os.getenv("ANALYTICS_MAX_STALENESS_SECONDS", DEFAULT_MAX_STALENESS))
+    return READ_PREFERENCES[mode](max_staleness=max_staleness)
+
+
+pool_stats = PoolStatsListener()
+
+
+def create_client(url: Optional[str] = None) -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(
+        url or os.environ['MONGO_URL'],
+        event_listeners=[pool_stats],
+        **client_options()
+    )
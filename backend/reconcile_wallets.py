@@ -0,0 +1,289 @@
+"""
+Wallet reconciliation job
+
+Rebuilds the expected balance of every wallet from the money-movement history
+(`transactions`, `deposit_requests`, `withdrawal_requests`) and reports every
+user whose stored `balance + locked_balance` disagrees with it.
+
+Collections are streamed in large batches and reduced with vectorized pandas
+group-bys, so memory stays bounded by the batch size and the number of users
+rather than the number of transactions.
+
+Reads use the analytics handle, so on a replica set they are served by a
+secondary (see mongo_client.py). A mismatch for a user with activity in the
+last few seconds can be replication lag; re-run before investigating.
+
+Usage:
+    python reconcile_wallets.py [--batch-size 100000] [--tolerance 0.01] [--output report.csv]
+"""
+import argparse
+import asyncio
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from database import analytics_db as db, client
+
+# Sign applied to a completed transaction amount when rebuilding a balance.
+# Types missing from this map are reported as "unclassified" instead of guessed.
+TRANSACTION_SIGNS = {
+    "deposit": 1.0,
+    "withdrawal": -1.0,
+    "purchase": -1.0,
+    "sale": 1.0,
+    "refund": 1.0,
+    "staking": -1.0,
+    "unstaking": 1.0,
+    "staking_reward": 1.0,
+    "investment": -1.0,
+    "investment_return": 1.0,
+    "fee": -1.0,
+}
+
+DEFAULT_BATCH_SIZE = 100_000
+DEFAULT_TOLERANCE = 0.01
+
+# Merge partial group-by results once this many have piled up
+COMPACT_EVERY = 32
+
+REPORT_COLUMNS = [
+    "user_id",
+    "balance",
+    "locked_balance",
+    "actual_total",
+    "ledger_total",
+    "total_diff",
+    "expected_locked",
+    "locked_diff",
+    "approved_deposits",
+    "deposit_ledger",
+    "deposit_diff",
+    "approved_withdrawals",
+    "withdrawal_ledger",
+    "withdrawal_diff",
+    "unclassified_amount",
+    "has_wallet",
+]
+
+
+class GroupedSum:
+    """Running per-user sums built from chunked, vectorized group-bys"""
+
+    def __init__(self, columns: List[str]):
+        self.columns = columns
+        self._partials: List[pd.DataFrame] = []
+
+    def add(self, frame: pd.DataFrame):
+        if frame.empty:
+            return
+        self._partials.append(frame.groupby("user_id", sort=False)[self.columns].sum())
+        if len(self._partials) >= COMPACT_EVERY:
+            self._partials = [self._combine()]
+
+    def _combine(self) -> pd.DataFrame:
+        if not self._partials:
+            return pd.DataFrame(columns=self.columns, dtype="float64")
+        return pd.concat(self._partials).groupby(level=0, sort=False).sum()
+
+    def result(self) -> pd.DataFrame:
+        combined = self._combine()
+        combined.index.name = "user_id"
+        return combined
+
+
+async def stream_batches(
+    collection,
+    query: Dict,
+    projection: Dict,
+    to_row: Callable[[Dict], tuple],
+    columns: List[str],
+    batch_size: int
+):
+    """Yield DataFrames of at most `batch_size` projected rows from a collection"""
+    cursor = collection.find(query, projection).batch_size(batch_size)
+    rows = []
+    async for doc in cursor:
+        rows.append(to_row(doc))
+        if len(rows) >= batch_size:
+            yield pd.DataFrame.from_records(rows, columns=columns)
+            rows = []
+    if rows:
+        yield pd.DataFrame.from_records(rows, columns=columns)
+
+
+async def sum_transactions(batch_size: int) -> pd.DataFrame:
+    """Signed ledger totals per user from completed transactions"""
+    sums = GroupedSum(["ledger_total", "deposit_ledger", "withdrawal_ledger", "unclassified_amount"])
+    signs = pd.Series(TRANSACTION_SIGNS, dtype="float64")
+
+    async for frame in stream_batches(
+        db.transactions,
+        {"status": "completed"},
+        {"_id": 0, "user_id": 1, "type": 1, "amount": 1},
+        lambda doc: (doc.get("user_id"), doc.get("type"), doc.get("amount") or 0.0),
+        ["user_id", "type", "amount"],
+        batch_size
+    ):
+        amount = frame["amount"].to_numpy(dtype="float64")
+        sign = frame["type"].map(signs).to_numpy(dtype="float64")
+        classified = ~np.isnan(sign)
+        is_deposit = (frame["type"] == "deposit").to_numpy()
+        is_withdrawal = (frame["type"] == "withdrawal").to_numpy()
+
+        sums.add(pd.DataFrame({
+            "user_id": frame["user_id"],
+            "ledger_total": np.where(classified, amount * np.nan_to_num(sign), 0.0),
+            "deposit_ledger": np.where(is_deposit, amount, 0.0),
+            "withdrawal_ledger": np.where(is_withdrawal, amount, 0.0),
+            "unclassified_amount": np.where(classified, 0.0, amount),
+        }))
+
+    return sums.result()
+
+
+async def sum_deposits(batch_size: int) -> pd.DataFrame:
+    """Approved deposit request totals per user"""
+    sums = GroupedSum(["approved_deposits"])
+
+    async for frame in stream_batches(
+        db.deposit_requests,
+        {"status": "approved"},
+        {"_id": 0, "user_id": 1, "amount": 1},
+        lambda doc: (doc.get("user_id"), doc.get("amount") or 0.0),
+        ["user_id", "approved_deposits"],
+        batch_size
+    ):
+        frame["approved_deposits"] = frame["approved_deposits"].astype("float64")
+        sums.add(frame)
+
+    return sums.result()
+
+
+async def sum_withdrawals(batch_size: int) -> pd.DataFrame:
+    """Approved withdrawal totals and currently locked amounts per user"""
+    sums = GroupedSum(["approved_withdrawals", "expected_locked"])
+
+    def to_row(doc: Dict) -> tuple:
+        metadata = doc.get("metadata") or {}
+        locked = metadata.get("total_deducted", doc.get("amount") or 0.0)
+        return (doc.get("user_id"), doc.get("status"), doc.get("amount") or 0.0, locked)
+
+    async for frame in stream_batches(
+        db.withdrawal_requests,
+        {"status": {"$in": ["pending", "approved"]}},
+        {"_id": 0, "user_id": 1, "status": 1, "amount": 1, "metadata.total_deducted": 1},
+        to_row,
+        ["user_id", "status", "amount", "locked"],
+        batch_size
+    ):
+        is_pending = (frame["status"] == "pending").to_numpy()
+        sums.add(pd.DataFrame({
+            "user_id": frame["user_id"],
+            "approved_withdrawals": np.where(is_pending, 0.0, frame["amount"].to_numpy(dtype="float64")),
+            "expected_locked": np.where(is_pending, frame["locked"].to_numpy(dtype="float64"), 0.0),
+        }))
+
+    return sums.result()
+
+
+async def load_wallets(batch_size: int) -> pd.DataFrame:
+    """Stored wallet balances indexed by user"""
+    frames = []
+    async for frame in stream_batches(
+        db.wallets,
+        {},
+        {"_id": 0, "user_id": 1, "balance": 1, "locked_balance": 1},
+        lambda doc: (doc.get("user_id"), doc.get("balance") or 0.0, doc.get("locked_balance") or 0.0),
+        ["user_id", "balance", "locked_balance"],
+        batch_size
+    ):
+        frames.append(frame)
+
+    if not frames:
+        return pd.DataFrame(columns=["balance", "locked_balance"], dtype="float64").rename_axis("user_id")
+
+    wallets = pd.concat(frames, ignore_index=True).set_index("user_id")
+    return wallets.astype("float64")
+
+
+def build_report(
+    wallets: pd.DataFrame,
+    ledger: pd.DataFrame,
+    deposits: pd.DataFrame,
+    withdrawals: pd.DataFrame,
+    tolerance: float
+) -> pd.DataFrame:
+    """Join the per-user sums and keep only users that do not reconcile"""
+    report = wallets.join([ledger, deposits, withdrawals], how="outer")
+    report["has_wallet"] = report.index.isin(wallets.index)
+    report = report.fillna(0.0)
+
+    report["actual_total"] = report["balance"] + report["locked_balance"]
+    report["total_diff"] = report["actual_total"] - report["ledger_total"]
+    report["locked_diff"] = report["locked_balance"] - report["expected_locked"]
+    report["deposit_diff"] = report["approved_deposits"] - report["deposit_ledger"]
+    report["withdrawal_diff"] = report["approved_withdrawals"] - report["withdrawal_ledger"]
+
+    mismatched = (
+        (report["total_diff"].abs() > tolerance)
+        | (report["locked_diff"].abs() > tolerance)
+        | (report["deposit_diff"].abs() > tolerance)
+        | (report["withdrawal_diff"].abs() > tolerance)
+        | (report["unclassified_amount"].abs() > tolerance)
+        | ~report["has_wallet"]
+    )
+
+    discrepancies = report[mismatched].reset_index()
+    discrepancies = discrepancies.sort_values("total_diff", key=lambda s: s.abs(), ascending=False)
+    return discrepancies[REPORT_COLUMNS]
+
+
+async def reconcile(batch_size: int = DEFAULT_BATCH_SIZE, tolerance: float = DEFAULT_TOLERANCE) -> pd.DataFrame:
+    """Compute the discrepancy report for every wallet"""
+    wallets, ledger, deposits, withdrawals = await asyncio.gather(
+        load_wallets(batch_size),
+        sum_transactions(batch_size),
+        sum_deposits(batch_size),
+        sum_withdrawals(batch_size)
+    )
+    return build_report(wallets, ledger, deposits, withdrawals, tolerance)
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Reconcile wallet balances against transaction history")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Documents per streamed batch")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed absolute difference")
+    parser.add_argument("--output", help="Write the discrepancy report to this CSV file")
+    args = parser.parse_args(argv)
+
+    print("🔎 Reconciling wallets...")
+    started = time.monotonic()
+
+    try:
+        report = await reconcile(args.batch_size, args.tolerance)
+    finally:
+        client.close()
+
+    elapsed = time.monotonic() - started
+    print(f"⏱️  Finished in {elapsed:.1f}s")
+
+    if report.empty:
+        print("✅ All wallets reconcile")
+        return 0
+
+    print(f"⚠️  {len(report)} wallet(s) do not reconcile")
+    if args.output:
+        report.to_csv(args.output, index=False)
+        print(f"📄 Report written to {args.output}")
+    else:
+        with pd.option_context("display.max_rows", 50, "display.width", 200):
+            print(report.head(50).to_string(index=False))
+
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -5,9 +5,18 @@ from models import (
     SystemSettings, SystemSettingsUpdate,
     AdminUserCreate, MessageResponse
 )
-from middleware import get_current_admin_user, get_current_super_admin, log_audit
+from middleware import get_current_admin_user, get_current_super_admin, log_audit, require_permission
 from database import get_db
-from security import hash_password, generate_secure_token
+from mongo_client import pool_stats
+from utils.token_revocation import revocation_list
+from utils.password_hasher import password_hasher
+from utils.api_keys import api_key_index, api_key_usage
+from utils.permissions import permission_registry
+from utils.admin_state import admin_state_cache
+from utils.audit_writer import audit_writer
+from utils.audit_store import audit_store
+from utils.audit_stream import audit_hub
+from security import hash_password, generate_secure_token, token_cache
 from typing import Dict, Optional, List
 from datetime import datetime, timezone, timedelta
 import hashlib
@@ -19,7 +28,7 @@ router = APIRouter(prefix="/admin", tags=["Admin Advanced Features"])
 @router.post("/api-tokens", response_model=Dict)
 async def create_api_token(
     token_data: APITokenCreate,
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_users")),
     request: Request = None,
     db = Depends(get_db)
 ):
@@ -50,14 +59,13 @@ async def create_api_token(
         name=token_data.name,
         token_key=api_key_hash,
         permissions=token_data.permissions,
-        expires_at=expires_at
+        expires_at=expires_at,
+        rate_limit_per_minute=token_data.rate_limit_per_minute,
+        burst=token_data.burst,
+        daily_quota=token_data.daily_quota
     )
     
     token_doc = token.model_dump()
-    token_doc['created_at'] = token_doc['created_at'].isoformat()
-    token_doc['updated_at'] = token_doc['updated_at'].isoformat()
-    if token_doc['expires_at']:
-        token_doc['expires_at'] = token_doc['expires_at'].isoformat()
     
     await db.api_tokens.insert_one(token_doc)
     
@@ -76,12 +84,15 @@ async def create_api_token(
         "api_key": api_key,  # Only returned once!
         "name": token.name,
         "permissions": token.permissions,
+        "rate_limit_per_minute": token.rate_limit_per_minute,
+        "burst": token.burst,
+        "daily_quota": token.daily_quota,
         "expires_at": token.expires_at.isoformat() if token.expires_at else None
     }
 
 @router.get("/api-tokens")
 async def get_all_api_tokens(
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_users")),
     db = Depends(get_db),
     page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1, le=100),
@@ -123,7 +134,7 @@ async def get_all_api_tokens(
 @router.get("/api-tokens/{token_id}")
 async def get_api_token_detail(
     token_id: str,
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_users")),
     db = Depends(get_db)
 ):
     """Get API token details"""
@@ -144,11 +155,58 @@ async def get_api_token_detail(
     
     return token
 
+@router.get("/api-tokens/{token_id}/usage")
+async def get_api_token_usage(
+    token_id: str,
+    current_admin: Dict = Depends(require_permission("manage_users")),
+    db = Depends(get_db),
+    hours: int = Query(24, ge=1, le=24 * 30),
+    granularity: str = Query("hour", pattern="^(minute|hour|day)$")
+):
+    """Get metered usage of an API token (served and throttled requests)"""
+    token = await db.api_tokens.find_one(
+        {"id": token_id},
+        {"_id": 0, "id": 1, "name": 1, "usage_count": 1, "last_used_at": 1,
+         "rate_limit_per_minute": 1, "burst": 1, "daily_quota": 1}
+    )
+    
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="API token not found"
+        )
+    
+    since = (datetime.now(timezone.utc) - timedelta(hours=hours)).replace(second=0, microsecond=0)
+    # Minutes are native dates; each bucket is labelled with its ISO prefix
+    bucket_format = {"minute": "%Y-%m-%dT%H:%M", "hour": "%Y-%m-%dT%H", "day": "%Y-%m-%d"}[granularity]
+    
+    series = await db.api_token_usage.aggregate([
+        {"$match": {"token_id": token_id, "minute": {"$gte": since}}},
+        {"$group": {
+            "_id": {"$dateToString": {"date": "$minute", "format": bucket_format}},
+            "requests": {"$sum": "$requests"},
+            "throttled": {"$sum": "$throttled"}
+        }},
+        {"$sort": {"_id": 1}}
+    ]).to_list(None)
+    
+    return {
+        "token": token,
+        "granularity": granularity,
+        "since": since.isoformat(),
+        "series": [
+            {"period": row['_id'], "requests": row['requests'], "throttled": row['throttled']}
+            for row in series
+        ],
+        "total_requests": sum(row['requests'] for row in series),
+        "total_throttled": sum(row['throttled'] for row in series)
+    }
+
 @router.put("/api-tokens/{token_id}", response_model=MessageResponse)
 async def update_api_token(
     token_id: str,
     token_update: APITokenUpdate,
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_users")),
     request: Request = None,
     db = Depends(get_db)
 ):
@@ -169,12 +227,13 @@ async def update_api_token(
             detail="No data to update"
         )
     
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update_data['updated_at'] = datetime.now(timezone.utc)
     
     await db.api_tokens.update_one(
         {"id": token_id},
         {"$set": update_data}
     )
+    api_key_index.invalidate(token['token_key'])
     
     await log_audit(
         db, current_admin['id'], "api_token_updated",
@@ -188,7 +247,7 @@ async def update_api_token(
 @router.delete("/api-tokens/{token_id}", response_model=MessageResponse)
 async def delete_api_token(
     token_id: str,
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_users")),
     request: Request = None,
     db = Depends(get_db)
 ):
@@ -202,6 +261,7 @@ async def delete_api_token(
         )
     
     await db.api_tokens.delete_one({"id": token_id})
+    api_key_index.invalidate(token['token_key'])
     
     await log_audit(
         db, current_admin['id'], "api_token_deleted",
@@ -232,10 +292,9 @@ async def create_api_permission(
     
     permission = APIPermission(**permission_data.model_dump())
     permission_doc = permission.model_dump()
-    permission_doc['created_at'] = permission_doc['created_at'].isoformat()
-    permission_doc['updated_at'] = permission_doc['updated_at'].isoformat()
     
     await db.api_permissions.insert_one(permission_doc)
+    await permission_registry.load(db)
     
     await log_audit(
         db, current_admin['id'], "api_permission_created",
@@ -248,22 +307,14 @@ async def create_api_permission(
 
 @router.get("/api-permissions")
 async def get_all_api_permissions(
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_users")),
     db = Depends(get_db),
     category: Optional[str] = None,
     is_active: Optional[bool] = None
 ):
     """Get all API permissions"""
-    query = {}
-    if category:
-        query["category"] = category
-    if is_active is not None:
-        query["is_active"] = is_active
-    
-    permissions = await db.api_permissions.find(
-        query,
-        {"_id": 0}
-    ).sort("category", 1).to_list(1000)
+    await permission_registry.ensure_fresh(db)
+    permissions = permission_registry.list(category, is_active)
     
     # Group by category
     grouped = {}
@@ -304,12 +355,13 @@ async def update_api_permission(
             detail="No data to update"
         )
     
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update_data['updated_at'] = datetime.now(timezone.utc)
     
     await db.api_permissions.update_one(
         {"id": permission_id},
         {"$set": update_data}
     )
+    await permission_registry.load(db)
     
     await log_audit(
         db, current_admin['id'], "api_permission_updated",
@@ -337,6 +389,7 @@ async def delete_api_permission(
         )
     
     await db.api_permissions.delete_one({"id": permission_id})
+    await permission_registry.load(db)
     
     await log_audit(
         db, current_admin['id'], "api_permission_deleted",
@@ -351,7 +404,7 @@ async def delete_api_permission(
 
 @router.get("/admin-users")
 async def get_all_admin_users(
-    current_admin: Dict = Depends(get_current_super_admin),  # Only super admin
+    current_admin: Dict = Depends(require_permission("manage_admins")),
     db = Depends(get_db),
     page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1, le=100),
@@ -385,7 +438,7 @@ async def get_all_admin_users(
 @router.get("/admin-users/{admin_id}")
 async def get_admin_user_detail(
     admin_id: str,
-    current_admin: Dict = Depends(get_current_super_admin),
+    current_admin: Dict = Depends(require_permission("manage_admins")),
     db = Depends(get_db)
 ):
     """Get admin user details (Super admin only)"""
@@ -401,10 +454,7 @@ async def get_admin_user_detail(
         )
     
     # Get audit logs for this admin
-    recent_activities = await db.audit_logs.find(
-        {"user_id": admin_id},
-        {"_id": 0}
-    ).sort("timestamp", -1).limit(10).to_list(10)
+    recent_activities = await audit_store.find(db, {"user_id": admin_id}, limit=10)
     
     admin['recent_activities'] = recent_activities
     
@@ -414,7 +464,7 @@ async def get_admin_user_detail(
 async def update_admin_user_status(
     admin_id: str,
     is_active: bool,
-    current_admin: Dict = Depends(get_current_super_admin),
+    current_admin: Dict = Depends(require_permission("manage_admins")),
     request: Request = None,
     db = Depends(get_db)
 ):
@@ -438,15 +488,17 @@ async def update_admin_user_status(
         {"id": admin_id},
         {"$set": {
             "is_active": is_active,
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "updated_at": datetime.now(timezone.utc)
         }}
     )
+    admin_state_cache.invalidate(admin_id)
     
     await log_audit(
         db, current_admin['id'], "admin_user_status_updated",
         {"admin_id": admin_id, "is_active": is_active},
         request.client.host if request else None,
-        request.headers.get("user-agent") if request else None
+        request.headers.get("user-agent") if request else None,
+        critical=True
     )
     
     return MessageResponse(message=f"Admin {'activated' if is_active else 'deactivated'} successfully")
@@ -455,7 +507,7 @@ async def update_admin_user_status(
 async def update_admin_user_role(
     admin_id: str,
     new_role: str,
-    current_admin: Dict = Depends(get_current_super_admin),
+    current_admin: Dict = Depends(require_permission("manage_admins")),
     request: Request = None,
     db = Depends(get_db)
 ):
@@ -487,15 +539,17 @@ async def update_admin_user_role(
         {"id": admin_id},
         {"$set": {
             "role": new_role,
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "updated_at": datetime.now(timezone.utc)
         }}
     )
+    admin_state_cache.invalidate(admin_id)
     
     await log_audit(
         db, current_admin['id'], "admin_user_role_updated",
         {"admin_id": admin_id, "old_role": admin['role'], "new_role": new_role},
         request.client.host if request else None,
-        request.headers.get("user-agent") if request else None
+        request.headers.get("user-agent") if request else None,
+        critical=True
     )
     
     return MessageResponse(message="Admin role updated successfully")
@@ -503,7 +557,7 @@ async def update_admin_user_role(
 @router.delete("/admin-users/{admin_id}", response_model=MessageResponse)
 async def delete_admin_user(
     admin_id: str,
-    current_admin: Dict = Depends(get_current_super_admin),
+    current_admin: Dict = Depends(require_permission("manage_admins")),
     request: Request = None,
     db = Depends(get_db)
 ):
@@ -524,12 +578,14 @@ async def delete_admin_user(
         )
     
     await db.admin_users.delete_one({"id": admin_id})
+    admin_state_cache.invalidate(admin_id)
     
     await log_audit(
         db, current_admin['id'], "admin_user_deleted",
         {"admin_id": admin_id, "email": admin['email']},
         request.client.host if request else None,
-        request.headers.get("user-agent") if request else None
+        request.headers.get("user-agent") if request else None,
+        critical=True
     )
     
     return MessageResponse(message="Admin user deleted successfully")
@@ -554,7 +610,7 @@ async def get_system_settings(
 @router.put("/settings", response_model=MessageResponse)
 async def update_system_settings(
     settings_update: SystemSettingsUpdate,
-    current_admin: Dict = Depends(get_current_super_admin),  # Only super admin
+    current_admin: Dict = Depends(require_permission("manage_system_settings")),
     request: Request = None,
     db = Depends(get_db)
 ):
@@ -567,7 +623,7 @@ async def update_system_settings(
             detail="No data to update"
         )
     
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update_data['updated_at'] = datetime.now(timezone.utc)
     update_data['updated_by'] = current_admin['id']
     
     # Upsert settings (create if not exists)
@@ -588,14 +644,14 @@ async def update_system_settings(
 
 @router.post("/settings/reset", response_model=MessageResponse)
 async def reset_system_settings(
-    current_admin: Dict = Depends(get_current_super_admin),
+    current_admin: Dict = Depends(require_permission("manage_system_settings")),
     request: Request = None,
     db = Depends(get_db)
 ):
     """Reset system settings to defaults (Super admin only)"""
     default_settings = SystemSettings()
     settings_doc = default_settings.model_dump()
-    settings_doc['updated_at'] = datetime.now(timezone.utc).isoformat()
+    settings_doc['updated_at'] = datetime.now(timezone.utc)
     settings_doc['updated_by'] = current_admin['id']
     
     await db.system_settings.replace_one(
@@ -612,3 +668,23 @@ async def reset_system_settings(
     )
     
     return MessageResponse(message="System settings reset to defaults successfully")
+
+# ============ SYSTEM METRICS ============
+
+@router.get("/system/metrics")
+async def get_system_metrics(
+    current_admin: Dict = Depends(get_current_super_admin)
+):
+    """Get in-process cache and worker metrics (Super admin only)"""
+    return {
+        "token_cache": token_cache.stats(),
+        "token_revocation": revocation_list.stats(),
+        "password_hasher": password_hasher.stats(),
+        "api_key_cache": api_key_index.stats(),
+        "api_key_usage": api_key_usage.stats(),
+        "permission_registry": permission_registry.stats(),
+        "admin_state_cache": admin_state_cache.stats(),
+        "audit_writer": audit_writer.stats(),
+        "audit_stream": audit_hub.stats(),
+        "mongo_pool": pool_stats.stats()
+    }
@@ -1,17 +1,23 @@
 from fastapi import APIRouter, HTTPException, status, Depends, Request
-from models import AdminUserCreate, AdminLogin, TokenResponse, MessageResponse, AdminUser, AdminUpdateProfile, AdminChangePassword
-from security import hash_password, verify_password, create_access_token, create_refresh_token, decode_token, generate_totp_secret, verify_totp, generate_qr_uri
-from middleware import log_audit, get_current_admin_user
+from models import AdminUserCreate, AdminLogin, TokenResponse, MessageResponse, AdminUser, AdminUpdateProfile, AdminChangePassword, LogoutRequest
+from security import password_needs_rehash, create_access_token, create_refresh_token, decode_token, generate_totp_secret, verify_totp, generate_qr_uri
+from middleware import log_audit, get_current_admin_user, RateLimiter
 from database import get_db
+from pymongo.errors import ExecutionTimeout
+from utils.token_revocation import revocation_list
+from utils.password_hasher import password_hasher
 from datetime import datetime, timezone, timedelta
-from typing import Dict
+from typing import Dict, Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/admin/auth", tags=["Admin Authentication"])
 
-@router.post("/login", response_model=TokenResponse)
+# Login attempts per client (the "auth" route class is shared with Google sign-in)
+auth_rate_limiter = RateLimiter(requests_per_minute=20, route_class="auth")
+
+@router.post("/login", response_model=TokenResponse, dependencies=[Depends(auth_rate_limiter)])
 async def admin_login(login_data: AdminLogin, request: Request, db = Depends(get_db)):
     """
     Admin login endpoint
@@ -41,7 +47,7 @@ async def admin_login(login_data: AdminLogin, request: Request, db = Depends(get
             )
         
         # Verify password
-        if not verify_password(login_data.password, admin_user['password_hash']):
+        if not await password_hasher.verify(login_data.password, admin_user['password_hash']):
             await log_audit(
                 db, admin_user['id'], "admin_login_failed",
                 {"reason": "invalid_password"},
@@ -80,6 +86,17 @@ async def admin_login(login_data: AdminLogin, request: Request, db = Depends(get
                     detail="Invalid 2FA code"
                 )
         
+        # Upgrade (or downgrade) the stored hash to the current cost policy
+        if password_needs_rehash(admin_user['password_hash']):
+            try:
+                new_hash = await password_hasher.hash(login_data.password)
+                await db.admin_users.update_one(
+                    {"id": admin_user['id'], "password_hash": admin_user['password_hash']},
+                    {"$set": {"password_hash": new_hash}}
+                )
+            except Exception as e:
+                logger.warning(f"Could not rehash password: {str(e)}")
+        
         # FIX: Update last_login - sử dụng None thay vì datetime để tránh lỗi validation
         try:
             await db.admin_users.update_one(
@@ -114,7 +131,8 @@ async def admin_login(login_data: AdminLogin, request: Request, db = Depends(get
             token_type="bearer"
         )
         
-    except HTTPException:
+    except (HTTPException, ExecutionTimeout):
+        # Errors with their own status, including the request deadline (503)
         raise
     except Exception as e:
         logger.error(f"Login error: {str(e)}")
@@ -159,12 +177,10 @@ async def register_admin(
         
         # Create admin user
         admin_dict = admin_data.model_dump()
-        admin_dict['password_hash'] = hash_password(admin_dict.pop('password'))
+        admin_dict['password_hash'] = await password_hasher.hash(admin_dict.pop('password'))
         
         admin_user = AdminUser(**admin_dict)
         admin_doc = admin_user.model_dump()
-        admin_doc['created_at'] = admin_doc['created_at'].isoformat()
-        admin_doc['updated_at'] = admin_doc['updated_at'].isoformat()
         
         await db.admin_users.insert_one(admin_doc)
         
@@ -178,6 +194,8 @@ async def register_admin(
         
         return MessageResponse(message="Admin user created successfully")
         
+    except (HTTPException, ExecutionTimeout):
+        raise
     except Exception as e:
         logger.error(f"Register admin error: {str(e)}")
         raise HTTPException(
@@ -205,6 +223,8 @@ async def get_admin_profile(
         
         return admin
         
+    except (HTTPException, ExecutionTimeout):
+        raise
     except Exception as e:
         logger.error(f"Get profile error: {str(e)}")
         raise HTTPException(
@@ -228,7 +248,7 @@ async def update_admin_profile(
                 detail="No data to update"
             )
         
-        update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+        update_data['updated_at'] = datetime.now(timezone.utc)
         
         await db.admin_users.update_one(
             {"id": current_admin['id']},
@@ -237,6 +257,8 @@ async def update_admin_profile(
         
         return MessageResponse(message="Profile updated successfully")
         
+    except (HTTPException, ExecutionTimeout):
+        raise
     except Exception as e:
         logger.error(f"Update profile error: {str(e)}")
         raise HTTPException(
@@ -261,25 +283,27 @@ async def change_admin_password(
             )
         
         # Verify old password
-        if not verify_password(password_data.old_password, admin['password_hash']):
+        if not await password_hasher.verify(password_data.old_password, admin['password_hash']):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid old password"
             )
         
         # Update password
-        new_password_hash = hash_password(password_data.new_password)
+        new_password_hash = await password_hasher.hash(password_data.new_password)
         
         await db.admin_users.update_one(
             {"id": current_admin['id']},
             {"$set": {
                 "password_hash": new_password_hash,
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                "updated_at": datetime.now(timezone.utc)
             }}
         )
         
         return MessageResponse(message="Password changed successfully")
         
+    except (HTTPException, ExecutionTimeout):
+        raise
     except Exception as e:
         logger.error(f"Change password error: {str(e)}")
         raise HTTPException(
@@ -310,6 +334,8 @@ async def setup_2fa(
             "message": "Scan QR code with Google Authenticator and verify with a code"
         }
         
+    except (HTTPException, ExecutionTimeout):
+        raise
     except Exception as e:
         logger.error(f"2FA setup error: {str(e)}")
         raise HTTPException(
@@ -348,6 +374,8 @@ async def verify_and_enable_2fa(
         
         return MessageResponse(message="2FA enabled successfully")
         
+    except (HTTPException, ExecutionTimeout):
+        raise
     except Exception as e:
         logger.error(f"2FA verify error: {str(e)}")
         raise HTTPException(
@@ -372,7 +400,7 @@ async def disable_2fa(
             )
         
         # Verify password
-        if not verify_password(password, admin['password_hash']):
+        if not await password_hasher.verify(password, admin['password_hash']):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid password"
@@ -386,6 +414,8 @@ async def disable_2fa(
         
         return MessageResponse(message="2FA disabled successfully")
         
+    except (HTTPException, ExecutionTimeout):
+        raise
     except Exception as e:
         logger.error(f"2FA disable error: {str(e)}")
         raise HTTPException(
@@ -396,11 +426,33 @@ async def disable_2fa(
 @router.post("/logout", response_model=MessageResponse)
 async def admin_logout(
     request: Request,
+    logout_data: Optional[LogoutRequest] = None,
     current_admin: Dict = Depends(get_current_admin_user),
     db = Depends(get_db)
 ):
-    """Admin logout"""
+    """Admin logout (revokes the access token and, if given, the refresh token)"""
     try:
+        if current_admin.get('jti'):
+            await revocation_list.revoke(
+                db, current_admin['jti'],
+                datetime.fromtimestamp(current_admin['exp'], timezone.utc),
+                current_admin['id'], "logout"
+            )
+        
+        if logout_data and logout_data.refresh_token:
+            try:
+                refresh_payload = decode_token(logout_data.refresh_token)
+            except HTTPException:
+                refresh_payload = {}
+            
+            # Only revoke refresh tokens that belong to this admin
+            if refresh_payload.get('jti') and refresh_payload.get('sub') == current_admin['id']:
+                await revocation_list.revoke(
+                    db, refresh_payload['jti'],
+                    datetime.fromtimestamp(refresh_payload['exp'], timezone.utc),
+                    current_admin['id'], "logout"
+                )
+        
         await log_audit(
             db, current_admin['id'], "admin_logout",
             {},
@@ -410,6 +462,8 @@ async def admin_logout(
         
         return MessageResponse(message="Logged out successfully")
         
+    except (HTTPException, ExecutionTimeout):
+        raise
     except Exception as e:
         logger.error(f"Logout error: {str(e)}")
         raise HTTPException(
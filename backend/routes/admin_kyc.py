@@ -1,8 +1,10 @@
 """Enhanced KYC Management Routes with Analytics and Timeline"""
 from fastapi import APIRouter, HTTPException, status, Depends, Request, Query
 from models import MessageResponse
-from middleware import get_current_admin_user, log_audit
-from database import get_db
+from middleware import log_audit, require_permission
+from database import get_db, get_analytics_db
+from utils.audit_store import audit_store
+from utils.timestamps import parse_timestamp, timestamp_range
 from typing import Dict, Optional, List
 from datetime import datetime, timezone, timedelta
 from collections import defaultdict
@@ -18,8 +20,8 @@ UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
 @router.get("/statistics")
 async def get_kyc_statistics(
-    current_admin: Dict = Depends(get_current_admin_user),
-    db = Depends(get_db),
+    current_admin: Dict = Depends(require_permission("manage_kyc")),
+    db = Depends(get_analytics_db),
     days: int = Query(30, ge=1, le=365)
 ):
     """Get comprehensive KYC statistics"""
@@ -44,8 +46,8 @@ async def get_kyc_statistics(
     for sub in processed_submissions:
         if sub.get('reviewed_at') and sub.get('created_at'):
             try:
-                created = datetime.fromisoformat(sub['created_at'])
-                reviewed = datetime.fromisoformat(sub['reviewed_at'])
+                created = parse_timestamp(sub['created_at'])
+                reviewed = parse_timestamp(sub['reviewed_at'])
                 diff = (reviewed - created).total_seconds() / 3600  # hours
                 processing_times.append(diff)
             except:
@@ -55,16 +57,17 @@ async def get_kyc_statistics(
     
     # Time series data (last N days)
     date_cutoff = datetime.now(timezone.utc) - timedelta(days=days)
-    recent_submissions = await db.kyc_submissions.find({
-        "created_at": {"$gte": date_cutoff.isoformat()}
-    }, {"_id": 0, "created_at": 1, "status": 1}).to_list(10000)
+    recent_submissions = await db.kyc_submissions.find(
+        timestamp_range("created_at", since=date_cutoff),
+        {"_id": 0, "created_at": 1, "status": 1}
+    ).to_list(10000)
     
     # Group by date
     daily_stats = defaultdict(lambda: {'submitted': 0, 'approved': 0, 'rejected': 0, 'pending': 0})
     
     for sub in recent_submissions:
         try:
-            date = datetime.fromisoformat(sub['created_at']).date().isoformat()
+            date = parse_timestamp(sub['created_at']).date().isoformat()
             daily_stats[date]['submitted'] += 1
             if sub.get('status'):
                 daily_stats[date][sub['status']] += 1
@@ -136,7 +139,7 @@ async def get_kyc_statistics(
 @router.get("/timeline/{kyc_id}")
 async def get_kyc_timeline(
     kyc_id: str,
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_kyc")),
     db = Depends(get_db)
 ):
     """Get detailed timeline for a specific KYC submission"""
@@ -188,10 +191,9 @@ async def get_kyc_timeline(
         })
     
     # Get audit logs for this KYC
-    audit_logs = await db.audit_logs.find(
-        {"details.kyc_id": kyc_id},
-        {"_id": 0}
-    ).sort("timestamp", 1).to_list(100)
+    audit_logs = await audit_store.find(
+        db, {"subject_type": "kyc", "subject_id": kyc_id}, limit=100, newest_first=False
+    )
     
     for log in audit_logs:
         timeline.append({
@@ -201,8 +203,9 @@ async def get_kyc_timeline(
             'details': log.get('details', {})
         })
     
-    # Sort timeline by timestamp
-    timeline.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+    # Sort timeline by timestamp (older documents may hold ISO strings)
+    oldest = datetime.min.replace(tzinfo=timezone.utc)
+    timeline.sort(key=lambda x: parse_timestamp(x.get('timestamp')) or oldest, reverse=True)
     
     return {
         'kyc_id': kyc_id,
@@ -215,7 +218,7 @@ async def get_kyc_timeline(
 
 @router.get("/all")
 async def get_all_kyc_submissions(
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_kyc")),
     db = Depends(get_db),
     page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1, le=100),
@@ -268,7 +271,7 @@ async def get_all_kyc_submissions(
 @router.get("/file/{file_id}")
 async def get_kyc_file_info(
     file_id: str,
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_kyc")),
     db = Depends(get_db)
 ):
     """Get file information and path for viewing"""
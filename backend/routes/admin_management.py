@@ -1,9 +1,17 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Request, Query
+from fastapi import APIRouter, HTTPException, status, Depends, Request, Query, Header
+from fastapi.responses import StreamingResponse
 from models import DashboardStats, MessageResponse
-from middleware import get_current_admin_user, log_audit
-from database import get_db
+from middleware import log_audit, reauthorize_admin, require_permission
+from database import get_db, get_analytics_db
+from utils.audit_store import audit_store
+from utils.audit_stream import audit_hub, format_sse, replay_since, serialize_record
+from utils.withdrawal_limits import release_daily_withdrawal
+from utils.payout_engine import PAYOUT_QUEUED, automatic_payouts_enabled
 from typing import Dict, Optional, List
 from datetime import datetime, timezone
+import asyncio
+import re
+import time
 
 router = APIRouter(prefix="/admin", tags=["Admin Management"])
 
@@ -11,8 +19,8 @@ router = APIRouter(prefix="/admin", tags=["Admin Management"])
 
 @router.get("/dashboard", response_model=DashboardStats)
 async def get_dashboard_stats(
-    current_admin: Dict = Depends(get_current_admin_user),
-    db = Depends(get_db)
+    current_admin: Dict = Depends(require_permission("view_analytics")),
+    db = Depends(get_analytics_db)
 ):
     """
     Get dashboard statistics for admin panel
@@ -61,7 +69,7 @@ async def get_dashboard_stats(
 
 @router.get("/users")
 async def get_all_users(
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_users")),
     db = Depends(get_db),
     page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1, le=100),
@@ -105,7 +113,7 @@ async def get_all_users(
 @router.get("/users/{user_id}")
 async def get_user_detail(
     user_id: str,
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_users")),
     db = Depends(get_db)
 ):
     """Get detailed user information"""
@@ -147,7 +155,7 @@ async def get_user_detail(
 async def update_user_status(
     user_id: str,
     is_active: bool,
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_users")),
     request: Request = None,
     db = Depends(get_db)
 ):
@@ -162,7 +170,7 @@ async def update_user_status(
     
     await db.users.update_one(
         {"id": user_id},
-        {"$set": {"is_active": is_active, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"is_active": is_active, "updated_at": datetime.now(timezone.utc)}}
     )
     
     await log_audit(
@@ -179,7 +187,7 @@ async def update_user_status(
 async def toggle_user_verification(
     user_id: str,
     is_verified: bool,
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_users")),
     request: Request = None,
     db = Depends(get_db)
 ):
@@ -194,7 +202,7 @@ async def toggle_user_verification(
     
     await db.users.update_one(
         {"id": user_id},
-        {"$set": {"is_verified": is_verified, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"is_verified": is_verified, "updated_at": datetime.now(timezone.utc)}}
     )
     
     await log_audit(
@@ -209,12 +217,12 @@ async def toggle_user_verification(
 @router.post("/users/create", response_model=MessageResponse)
 async def create_user_by_admin(
     user_data: Dict,
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_users")),
     request: Request = None,
     db = Depends(get_db)
 ):
     """Admin creates a new user"""
-    from security import hash_password
+    from utils.password_hasher import password_hasher
     from models import User
     
     # Check if email already exists
@@ -237,7 +245,7 @@ async def create_user_by_admin(
     user_dict = {
         "email": user_data['email'],
         "username": user_data['username'],
-        "password_hash": hash_password(user_data['password']),
+        "password_hash": await password_hasher.hash(user_data['password']),
         "full_name": user_data.get('full_name', ''),
         "is_verified": user_data.get('is_verified', False),
         "is_active": user_data.get('is_active', True)
@@ -245,8 +253,6 @@ async def create_user_by_admin(
     
     user = User(**user_dict)
     user_doc = user.model_dump()
-    user_doc['created_at'] = user_doc['created_at'].isoformat()
-    user_doc['updated_at'] = user_doc['updated_at'].isoformat()
     
     await db.users.insert_one(user_doc)
     
@@ -255,8 +261,8 @@ async def create_user_by_admin(
         "user_id": user.id,
         "balance": 0.0,
         "locked_balance": 0.0,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc)
     }
     await db.wallets.insert_one(wallet_doc)
     
@@ -272,7 +278,7 @@ async def create_user_by_admin(
 @router.delete("/users/{user_id}", response_model=MessageResponse)
 async def delete_user(
     user_id: str,
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_users")),
     request: Request = None,
     db = Depends(get_db)
 ):
@@ -304,7 +310,7 @@ async def delete_user(
 
 @router.get("/kyc/pending")
 async def get_pending_kyc(
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_kyc")),
     db = Depends(get_db),
     page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1, le=100)
@@ -341,7 +347,7 @@ async def verify_kyc(
     kyc_id: str,
     approved: bool,
     admin_note: Optional[str] = None,
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_kyc")),
     request: Request = None,
     db = Depends(get_db)
 ):
@@ -362,7 +368,7 @@ async def verify_kyc(
         {"$set": {
             "status": new_status,
             "admin_note": admin_note,
-            "reviewed_at": datetime.now(timezone.utc).isoformat()
+            "reviewed_at": datetime.now(timezone.utc)
         }}
     )
     
@@ -371,7 +377,7 @@ async def verify_kyc(
         {"id": kyc['user_id']},
         {"$set": {
             "kyc_status": "verified" if approved else "rejected",
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "updated_at": datetime.now(timezone.utc)
         }}
     )
     
@@ -388,7 +394,7 @@ async def verify_kyc(
 
 @router.get("/documents")
 async def get_all_documents(
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_documents")),
     db = Depends(get_db),
     page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1, le=100),
@@ -436,7 +442,7 @@ async def approve_document(
     doc_id: str,
     approved: bool,
     admin_note: Optional[str] = None,
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_documents")),
     request: Request = None,
     db = Depends(get_db)
 ):
@@ -455,7 +461,7 @@ async def approve_document(
         {"id": doc_id},
         {"$set": {
             "status": new_status,
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "updated_at": datetime.now(timezone.utc)
         }}
     )
     
@@ -472,7 +478,7 @@ async def approve_document(
 
 @router.get("/deposits")
 async def get_deposit_requests(
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_deposits")),
     db = Depends(get_db),
     page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1, le=100),
@@ -513,7 +519,7 @@ async def process_deposit(
     deposit_id: str,
     approved: bool,
     admin_note: Optional[str] = None,
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_deposits")),
     request: Request = None,
     db = Depends(get_db)
 ):
@@ -540,7 +546,7 @@ async def process_deposit(
         {"$set": {
             "status": new_status,
             "admin_note": admin_note,
-            "processed_at": datetime.now(timezone.utc).isoformat()
+            "processed_at": datetime.now(timezone.utc)
         }}
     )
     
@@ -550,7 +556,7 @@ async def process_deposit(
             {"user_id": deposit['user_id']},
             {
                 "$inc": {"balance": deposit['amount']},
-                "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+                "$set": {"updated_at": datetime.now(timezone.utc)}
             }
         )
         
@@ -562,8 +568,8 @@ async def process_deposit(
             "amount": deposit['amount'],
             "status": "completed",
             "metadata": {"deposit_id": deposit_id, "approved_by": current_admin['id']},
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         }
         await db.transactions.insert_one(transaction)
     
@@ -571,7 +577,8 @@ async def process_deposit(
         db, current_admin['id'], "deposit_processed",
         {"deposit_id": deposit_id, "user_id": deposit['user_id'], "approved": approved, "amount": deposit['amount']},
         request.client.host if request else None,
-        request.headers.get("user-agent") if request else None
+        request.headers.get("user-agent") if request else None,
+        critical=True
     )
     
     return MessageResponse(message=f"Deposit {'approved' if approved else 'rejected'} successfully")
@@ -580,7 +587,7 @@ async def process_deposit(
 
 @router.get("/withdrawals")
 async def get_withdrawal_requests(
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_withdrawals")),
     db = Depends(get_db),
     page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1, le=100),
@@ -621,7 +628,7 @@ async def process_withdrawal(
     withdrawal_id: str,
     approved: bool,
     admin_note: Optional[str] = None,
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("manage_withdrawals")),
     request: Request = None,
     db = Depends(get_db)
 ):
@@ -640,36 +647,59 @@ async def process_withdrawal(
             detail="Withdrawal already processed"
         )
     
-    new_status = "approved" if approved else "rejected"
-    
-    # Update withdrawal request
-    await db.withdrawal_requests.update_one(
-        {"id": withdrawal_id},
-        {"$set": {
-            "status": new_status,
-            "admin_note": admin_note,
-            "processed_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
-    
     if approved:
-        # Deduct from wallet
-        wallet = await db.wallets.find_one({"user_id": withdrawal['user_id']})
-        
-        if not wallet or wallet['balance'] < withdrawal['amount']:
+        # Debit first, in one conditional update: an approved (and possibly
+        # queued for automatic payout) withdrawal must never be unfunded
+        debit = await db.wallets.update_one(
+            {"user_id": withdrawal['user_id'], "balance": {"$gte": withdrawal['amount']}},
+            {
+                "$inc": {"balance": -withdrawal['amount']},
+                "$set": {"updated_at": datetime.now(timezone.utc)}
+            }
+        )
+        if debit.modified_count != 1:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Insufficient balance"
             )
-        
-        await db.wallets.update_one(
-            {"user_id": withdrawal['user_id']},
-            {
-                "$inc": {"balance": -withdrawal['amount']},
-                "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
-            }
+    
+    new_status = "approved" if approved else "rejected"
+    update = {
+        "status": new_status,
+        "admin_note": admin_note,
+        "processed_at": datetime.now(timezone.utc)
+    }
+    if approved and automatic_payouts_enabled() and withdrawal.get('metadata', {}).get('withdrawal_type') == 'crypto':
+        # Paid by the payout engine instead of by hand
+        update["payout_status"] = PAYOUT_QUEUED
+    
+    # Only one of several concurrent decisions can move the request out of pending
+    result = await db.withdrawal_requests.update_one(
+        {"id": withdrawal_id, "status": "pending"},
+        {"$set": update}
+    )
+    if result.modified_count != 1:
+        if approved:
+            # Another admin decided first: give the debit back
+            await db.wallets.update_one(
+                {"user_id": withdrawal['user_id']},
+                {
+                    "$inc": {"balance": withdrawal['amount']},
+                    "$set": {"updated_at": datetime.now(timezone.utc)}
+                }
+            )
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Withdrawal already processed"
         )
-        
+    
+    if not approved and withdrawal.get('metadata', {}).get('daily_limit_reserved'):
+        # Free the rejected amount from the user's daily withdrawal counter
+        await release_daily_withdrawal(
+            db, withdrawal['user_id'], withdrawal['amount'], withdrawal['created_at']
+        )
+    
+    if approved:
         # Create transaction record
         transaction = {
             "id": f"tx-{withdrawal_id}",
@@ -678,8 +708,8 @@ async def process_withdrawal(
             "amount": withdrawal['amount'],
             "status": "completed",
             "metadata": {"withdrawal_id": withdrawal_id, "approved_by": current_admin['id']},
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         }
         await db.transactions.insert_one(transaction)
     
@@ -687,7 +717,8 @@ async def process_withdrawal(
         db, current_admin['id'], "withdrawal_processed",
         {"withdrawal_id": withdrawal_id, "user_id": withdrawal['user_id'], "approved": approved, "amount": withdrawal['amount']},
         request.client.host if request else None,
-        request.headers.get("user-agent") if request else None
+        request.headers.get("user-agent") if request else None,
+        critical=True
     )
     
     return MessageResponse(message=f"Withdrawal {'approved' if approved else 'rejected'} successfully")
@@ -696,7 +727,7 @@ async def process_withdrawal(
 
 @router.get("/transactions")
 async def get_all_transactions(
-    current_admin: Dict = Depends(get_current_admin_user),
+    current_admin: Dict = Depends(require_permission("view_analytics")),
     db = Depends(get_db),
     page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1, le=100),
@@ -731,25 +762,43 @@ async def get_all_transactions(
 
 @router.get("/audit-logs")
 async def get_audit_logs(
-    current_admin: Dict = Depends(get_current_admin_user),
-    db = Depends(get_db),
+    current_admin: Dict = Depends(require_permission("view_audit_logs")),
+    db = Depends(get_analytics_db),
     page: int = Query(1, ge=1),
     limit: int = Query(50, ge=1, le=100),
-    action_filter: Optional[str] = None
+    action_filter: Optional[str] = None,
+    action: Optional[str] = None,
+    user_id: Optional[str] = None,
+    subject_type: Optional[str] = None,
+    subject_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None
 ):
-    """Get audit logs"""
+    """
+    Get audit logs
+    - action_filter: case-insensitive action prefix (e.g. "admin_login")
+    - action: exact action, case-insensitive
+    - subject_type / subject_id: entity the event is about (e.g. kyc, withdrawal)
+    - date_from / date_to: limit the monthly partitions scanned
+    """
     skip = (page - 1) * limit
     
+    # Every filter is on an indexed, normalized field
     query = {}
-    if action_filter:
-        query["action"] = {"$regex": action_filter, "$options": "i"}
+    if action:
+        query["action_lc"] = action.lower()
+    elif action_filter:
+        query["action_lc"] = {"$regex": f"^{re.escape(action_filter.lower())}"}
+    if user_id:
+        query["user_id"] = user_id
+    if subject_type:
+        query["subject_type"] = subject_type
+    if subject_id:
+        query["subject_id"] = subject_id
     
-    total = await db.audit_logs.count_documents(query)
+    total = await audit_store.count(db, query, date_from, date_to)
     
-    logs = await db.audit_logs.find(
-        query,
-        {"_id": 0}
-    ).sort("timestamp", -1).skip(skip).limit(limit).to_list(limit)
+    logs = await audit_store.find(db, query, skip, limit, date_from, date_to)
     
     return {
         "logs": logs,
@@ -758,3 +807,67 @@ async def get_audit_logs(
         "limit": limit,
         "pages": (total + limit - 1) // limit
     }
+
+SSE_KEEPALIVE_SECONDS = 15
+# How often an open stream re-checks that the admin may still read audit logs
+SSE_REAUTHORIZE_SECONDS = 30
+
+@router.get("/audit-logs/stream")
+async def stream_audit_logs(
+    request: Request,
+    current_admin: Dict = Depends(require_permission("view_audit_logs")),
+    db = Depends(get_db),
+    last_event_id: Optional[str] = Header(None)
+):
+    """
+    Live audit events over Server-Sent Events
+    - event "audit": a new audit record (id is the record id)
+    - event "counters": dashboard counter deltas, e.g. {"pending_kyc": -1};
+      apply them to the values from /admin/dashboard
+    - event "dropped": the client fell too far behind and was disconnected
+    - event "revoked": the token expired or was revoked, or the admin lost
+      access; the stream is closed
+    Reconnects with Last-Event-ID receive the records they missed.
+    """
+    async def event_stream():
+        subscriber = audit_hub.subscribe()
+        try:
+            yield "retry: 3000\n\n"
+            
+            if last_event_id:
+                for record in await replay_since(db, last_event_id):
+                    yield format_sse("audit", serialize_record(record), str(record['_id']))
+            
+            next_check = time.monotonic() + SSE_REAUTHORIZE_SECONDS
+            while True:
+                if subscriber.dropped:
+                    yield format_sse("dropped", {"reason": "Client too slow"})
+                    break
+                
+                if time.monotonic() >= next_check:
+                    try:
+                        await reauthorize_admin(db, current_admin, "view_audit_logs")
+                    except HTTPException as e:
+                        yield format_sse("revoked", {"reason": e.detail})
+                        break
+                    next_check = time.monotonic() + SSE_REAUTHORIZE_SECONDS
+                
+                try:
+                    message = await asyncio.wait_for(
+                        subscriber.queue.get(),
+                        min(SSE_KEEPALIVE_SECONDS, max(next_check - time.monotonic(), 0))
+                    )
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                yield message
+        finally:
+            audit_hub.unsubscribe(subscriber)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException, status, Depends, Request, UploadFile, File
 from models import MessageResponse, KYCSubmission
-from middleware import get_current_user, log_audit
+from middleware import get_current_user, log_audit, RateLimiter
 from database import get_db
+from pymongo.errors import ExecutionTimeout
 from typing import Dict, List
 from datetime import datetime, timezone
 import uuid
@@ -127,7 +128,6 @@ async def submit_kyc(
     )
     
     kyc_doc = kyc_submission.model_dump()
-    kyc_doc['created_at'] = kyc_doc['created_at'].isoformat()
     
     # Add analysis results
     kyc_doc['analysis'] = {
@@ -135,13 +135,13 @@ async def submit_kyc(
         'auto_approved': auto_approved,
         'requires_manual_review': requires_review,
         'file_analyses': analysis_results,
-        'analyzed_at': datetime.now(timezone.utc).isoformat()
+        'analyzed_at': datetime.now(timezone.utc)
     }
     
     # Set initial status based on analysis
     if auto_approved:
         kyc_doc['status'] = 'approved'
-        kyc_doc['reviewed_at'] = datetime.now(timezone.utc).isoformat()
+        kyc_doc['reviewed_at'] = datetime.now(timezone.utc)
         kyc_doc['admin_note'] = 'Automatically approved based on quality analysis'
     
     await db.kyc_submissions.insert_one(kyc_doc)
@@ -226,7 +226,7 @@ async def get_user_profile(
     return user
 
 
-@router.post("/auth/google")
+@router.post("/auth/google", dependencies=[Depends(RateLimiter(requests_per_minute=20, route_class="auth"))])
 async def google_auth(
     token: str,
     request: Request,
@@ -272,12 +272,12 @@ async def google_auth(
                 # Link Google account to existing user
                 await db.users.update_one(
                     {"id": user['id']},
-                    {"$set": {"google_id": google_id, "updated_at": datetime.now(timezone.utc).isoformat()}}
+                    {"$set": {"google_id": google_id, "updated_at": datetime.now(timezone.utc)}}
                 )
             else:
                 # Create new user
                 from models import User
-                from security import hash_password
+                from utils.password_hasher import password_hasher
                 import secrets
                 
                 # Generate random username from email
@@ -286,7 +286,7 @@ async def google_auth(
                 user_dict = {
                     "email": email,
                     "username": username,
-                    "password_hash": hash_password(secrets.token_hex(16)),  # Random password
+                    "password_hash": await password_hasher.hash(secrets.token_hex(16)),  # Random password
                     "full_name": name,
                     "google_id": google_id,
                     "is_verified": False,
@@ -295,8 +295,6 @@ async def google_auth(
                 
                 user = User(**user_dict)
                 user_doc = user.model_dump()
-                user_doc['created_at'] = user_doc['created_at'].isoformat()
-                user_doc['updated_at'] = user_doc['updated_at'].isoformat()
                 
                 await db.users.insert_one(user_doc)
                 
@@ -305,8 +303,8 @@ async def google_auth(
                     "user_id": user.id,
                     "balance": 0.0,
                     "locked_balance": 0.0,
-                    "created_at": datetime.now(timezone.utc).isoformat(),
-                    "updated_at": datetime.now(timezone.utc).isoformat()
+                    "created_at": datetime.now(timezone.utc),
+                    "updated_at": datetime.now(timezone.utc)
                 }
                 await db.wallets.insert_one(wallet_doc)
                 
@@ -350,6 +348,9 @@ async def google_auth(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid Google token"
         )
+    except (HTTPException, ExecutionTimeout):
+        # Errors with their own status, including the request deadline (503)
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1,10 +1,13 @@
 from fastapi import APIRouter, HTTPException, status, Depends, Request
 from models import Web3DepositRequest, Web3WithdrawalRequest, MessageResponse
-from middleware import get_current_user, log_audit
+from middleware import get_current_user, get_user_or_api_principal, log_audit
 from database import get_db
+from utils.withdrawal_limits import reserve_daily_withdrawal, release_daily_withdrawal
 from typing import Dict
 from datetime import datetime, timezone
+from pymongo.errors import DuplicateKeyError
 import re
+import uuid
 
 router = APIRouter(prefix="/web3", tags=["Web3 Crypto"])
 
@@ -30,6 +33,24 @@ SUPPORTED_NETWORKS = {
     }
 }
 
+# Platform deposit addresses per network
+# These should be configured in admin settings
+# For demo purposes, using example addresses
+PLATFORM_WALLETS = {
+    "ethereum": {
+        "mainnet": "0x742d35Cc6634C0532925a3b844Bc9e7595f0bEb0",  # Example address
+        "testnet": "0x742d35Cc6634C0532925a3b844Bc9e7595f0bEb0"
+    },
+    "bsc": {
+        "mainnet": "0x742d35Cc6634C0532925a3b844Bc9e7595f0bEb0",
+        "testnet": "0x742d35Cc6634C0532925a3b844Bc9e7595f0bEb0"
+    },
+    "polygon": {
+        "mainnet": "0x742d35Cc6634C0532925a3b844Bc9e7595f0bEb0",
+        "testnet": "0x742d35Cc6634C0532925a3b844Bc9e7595f0bEb0"
+    }
+}
+
 def validate_ethereum_address(address: str) -> bool:
     """Validate Ethereum address format"""
     if not address:
@@ -48,6 +69,11 @@ def validate_transaction_hash(tx_hash: str) -> bool:
         return False
     return True
 
+def is_duplicate_transaction_hash(error: DuplicateKeyError) -> bool:
+    """Whether the violated unique index is the (network, transaction_hash) one"""
+    key_pattern = (error.details or {}).get("keyPattern") or {}
+    return set(key_pattern) == {"metadata.network", "metadata.transaction_hash"}
+
 @router.get("/networks")
 async def get_supported_networks():
     """Get list of supported blockchain networks"""
@@ -64,25 +90,8 @@ async def get_platform_wallets(db = Depends(get_db)):
     
     settings = await db.system_settings.find_one({"id": "system_settings"}, {"_id": 0})
     
-    # These should be configured in admin settings
-    # For demo purposes, returning example addresses
-    wallets = {
-        "ethereum": {
-            "mainnet": "0x742d35Cc6634C0532925a3b844Bc9e7595f0bEb0",  # Example address
-            "testnet": "0x742d35Cc6634C0532925a3b844Bc9e7595f0bEb0"
-        },
-        "bsc": {
-            "mainnet": "0x742d35Cc6634C0532925a3b844Bc9e7595f0bEb0",
-            "testnet": "0x742d35Cc6634C0532925a3b844Bc9e7595f0bEb0"
-        },
-        "polygon": {
-            "mainnet": "0x742d35Cc6634C0532925a3b844Bc9e7595f0bEb0",
-            "testnet": "0x742d35Cc6634C0532925a3b844Bc9e7595f0bEb0"
-        }
-    }
-    
     return {
-        "wallets": wallets,
+        "wallets": PLATFORM_WALLETS,
         "message": "Send crypto to these addresses to deposit. Include your user ID in the transaction memo if supported."
     }
 
@@ -126,14 +135,6 @@ async def submit_crypto_deposit(
             detail="Invalid wallet address format"
         )
     
-    # Check if transaction hash already exists
-    existing_tx = await db.deposit_requests.find_one({"metadata.transaction_hash": deposit_data.transaction_hash})
-    if existing_tx:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Transaction hash already submitted"
-        )
-    
     # Get system settings for limits
     settings = await db.system_settings.find_one({"id": "system_settings"})
     if settings:
@@ -154,24 +155,33 @@ async def submit_crypto_deposit(
     
     # Create deposit request
     deposit_doc = {
-        "id": f"dep_web3_{deposit_data.transaction_hash[-8:]}_{current_user['id'][-4:]}",
+        "id": f"dep_web3_{uuid.uuid4()}",
         "user_id": current_user['id'],
         "amount": deposit_data.amount,
         "payment_method": f"web3_{deposit_data.network}",
         "status": "pending",
         "admin_note": None,
         "metadata": {
-            "transaction_hash": deposit_data.transaction_hash,
+            "transaction_hash": deposit_data.transaction_hash.lower(),
             "network": deposit_data.network,
             "token_symbol": deposit_data.token_symbol,
             "from_address": deposit_data.from_address,
             "deposit_type": "crypto"
         },
-        "created_at": datetime.now(timezone.utc).isoformat(),
+        "created_at": datetime.now(timezone.utc),
         "processed_at": None
     }
     
-    await db.deposit_requests.insert_one(deposit_doc)
+    # The unique (network, transaction_hash) index rejects duplicate submissions
+    try:
+        await db.deposit_requests.insert_one(deposit_doc)
+    except DuplicateKeyError as e:
+        if not is_duplicate_transaction_hash(e):
+            raise
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Transaction hash already submitted"
+        )
     
     # Log audit
     await log_audit(
@@ -287,39 +297,25 @@ async def submit_crypto_withdrawal(
             )
     
     # Check daily limit
-    settings = await db.system_settings.find_one({"id": "system_settings"})
+    daily_limit_reserved = False
     if settings:
         daily_limit = settings.get('daily_withdrawal_limit', 10000.0)
         
-        # Calculate today's withdrawals
-        today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-        today_withdrawals = await db.withdrawal_requests.aggregate([
-            {
-                "$match": {
-                    "user_id": current_user['id'],
-                    "status": {"$in": ["pending", "approved"]},
-                    "created_at": {"$gte": today_start.isoformat()}
-                }
-            },
-            {
-                "$group": {
-                    "_id": None,
-                    "total": {"$sum": "$amount"}
-                }
-            }
-        ]).to_list(1)
-        
-        today_total = today_withdrawals[0]['total'] if today_withdrawals else 0.0
+        # Reserve the amount against today's counter (atomic check-and-increment)
+        reserved, today_total = await reserve_daily_withdrawal(
+            db, current_user['id'], withdrawal_data.amount, daily_limit
+        )
         
-        if today_total + withdrawal_data.amount > daily_limit:
+        if not reserved:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Daily withdrawal limit exceeded. Limit: {daily_limit}, Today's total: {today_total}"
             )
+        daily_limit_reserved = True
     
     # Create withdrawal request
     withdrawal_doc = {
-        "id": f"wdr_web3_{current_user['id'][-8:]}_{int(datetime.now(timezone.utc).timestamp())}",
+        "id": f"wdr_web3_{uuid.uuid4()}",
         "user_id": current_user['id'],
         "amount": withdrawal_data.amount,
         "withdrawal_method": f"web3_{withdrawal_data.network}",
@@ -332,13 +328,21 @@ async def submit_crypto_withdrawal(
             "to_address": withdrawal_data.to_address,
             "fee_amount": fee_amount,
             "total_deducted": total_required,
-            "withdrawal_type": "crypto"
+            "withdrawal_type": "crypto",
+            "daily_limit_reserved": daily_limit_reserved
         },
-        "created_at": datetime.now(timezone.utc).isoformat(),
+        "created_at": datetime.now(timezone.utc),
         "processed_at": None
     }
     
-    await db.withdrawal_requests.insert_one(withdrawal_doc)
+    try:
+        await db.withdrawal_requests.insert_one(withdrawal_doc)
+    except Exception:
+        if daily_limit_reserved:
+            await release_daily_withdrawal(
+                db, current_user['id'], withdrawal_data.amount, withdrawal_doc['created_at']
+            )
+        raise
     
     # Lock the funds in wallet (pending withdrawal)
     await db.wallets.update_one(
@@ -348,7 +352,7 @@ async def submit_crypto_withdrawal(
                 "balance": -total_required,
                 "locked_balance": total_required
             },
-            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+            "$set": {"updated_at": datetime.now(timezone.utc)}
         }
     )
     
@@ -380,7 +384,7 @@ async def submit_crypto_withdrawal(
 
 @router.get("/deposit-history")
 async def get_crypto_deposit_history(
-    current_user: Dict = Depends(get_current_user),
+    current_user: Dict = Depends(get_user_or_api_principal("wallet:read")),
     db = Depends(get_db)
 ):
     """Get user's crypto deposit history"""
@@ -399,7 +403,7 @@ async def get_crypto_deposit_history(
 
 @router.get("/withdrawal-history")
 async def get_crypto_withdrawal_history(
-    current_user: Dict = Depends(get_current_user),
+    current_user: Dict = Depends(get_user_or_api_principal("wallet:read")),
     db = Depends(get_db)
 ):
     """Get user's crypto withdrawal history"""
@@ -418,7 +422,7 @@ async def get_crypto_withdrawal_history(
 
 @router.get("/wallet")
 async def get_user_wallet(
-    current_user: Dict = Depends(get_current_user),
+    current_user: Dict = Depends(get_user_or_api_principal("wallet:read")),
     db = Depends(get_db)
 ):
     """Get user's wallet information"""
@@ -430,8 +434,8 @@ async def get_user_wallet(
             "user_id": current_user['id'],
             "balance": 0.0,
             "locked_balance": 0.0,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         }
         await db.wallets.insert_one(wallet_doc)
         wallet = wallet_doc
@@ -4,8 +4,18 @@ import jwt
 import bcrypt
 import pyotp
 import secrets
+import hashlib
+import uuid
+import os
+import time
+from cachetools import TLRUCache
+from dotenv import load_dotenv
+from pathlib import Path
 from fastapi import HTTPException, status
 
+# Settings below are read at import time, before server.py loads .env
+load_dotenv(Path(__file__).parent / '.env')
+
 # JWT Configuration
 JWT_SECRET_KEY = "your-super-secret-jwt-key-change-in-production-min-32-chars"
 JWT_ALGORITHM = "HS256"
@@ -42,9 +52,34 @@ ROLE_PERMISSIONS = {
     ]
 }
 
-def hash_password(password: str) -> str:
-    """Hash password using bcrypt"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+# Role permissions compiled into bitsets, so a check is a single AND
+PERMISSION_BITS = {
+    name: 1 << bit
+    for bit, name in enumerate(sorted({p for perms in ROLE_PERMISSIONS.values() for p in perms}))
+}
+ROLE_PERMISSION_MASKS = {
+    role: sum(PERMISSION_BITS[p] for p in set(perms))
+    for role, perms in ROLE_PERMISSIONS.items()
+}
+
+# bcrypt cost factor (log2 rounds); lower it only for load-test fixtures
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+def hash_password(password: str, rounds: Optional[int] = None) -> str:
+    """Hash password using bcrypt at the configured cost"""
+    salt = bcrypt.gensalt(rounds=rounds or BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+def password_hash_rounds(hashed_password: str) -> Optional[int]:
+    """Read the cost factor from a `$2b$12$...` hash"""
+    try:
+        return int(hashed_password.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """True when a stored hash was created at a different cost than the policy"""
+    return password_hash_rounds(hashed_password) != BCRYPT_ROUNDS
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify password against hash"""
@@ -58,7 +93,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire, "type": "access"})
+    to_encode.update({"exp": expire, "type": "access", "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
@@ -66,7 +101,7 @@ def create_refresh_token(data: dict) -> str:
     """Create JWT refresh token"""
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-    to_encode.update({"exp": expire, "type": "refresh"})
+    to_encode.update({"exp": expire, "type": "refresh", "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
@@ -86,6 +121,61 @@ def decode_token(token: str) -> dict:
             detail="Invalid token"
         )
 
+class VerifiedTokenCache:
+    """
+    Bounded LRU of verified JWT claims keyed by token digest.
+    Entries live until the token's `exp`, so repeated requests with the same
+    token skip signature verification. Revoked tokens must be invalidated.
+    """
+    
+    def __init__(self, maxsize: int = 10000):
+        self._cache = TLRUCache(maxsize=maxsize, ttu=lambda key, claims, now: claims['exp'], timer=time.time)
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def digest(token: str) -> str:
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+    
+    def decode(self, token: str) -> dict:
+        """Return verified claims, from cache when possible"""
+        key = self.digest(token)
+        claims = self._cache.get(key)
+        if claims is not None:
+            self.hits += 1
+            return claims
+        
+        self.misses += 1
+        claims = decode_token(token)
+        if isinstance(claims.get('exp'), (int, float)):
+            self._cache[key] = claims
+        return claims
+    
+    def invalidate(self, token: str):
+        """Drop one token, e.g. after it has been revoked"""
+        self._cache.pop(self.digest(token), None)
+    
+    def invalidate_subject(self, subject: str):
+        """Drop every cached token issued to a subject"""
+        for key, claims in list(self._cache.items()):
+            if claims.get('sub') == subject:
+                self._cache.pop(key, None)
+    
+    def clear(self):
+        self._cache.clear()
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "maxsize": self._cache.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+token_cache = VerifiedTokenCache(int(os.getenv("TOKEN_CACHE_SIZE", "10000")))
+
 def generate_totp_secret() -> str:
     """Generate TOTP secret for 2FA"""
     return pyotp.random_base32()
@@ -102,30 +192,8 @@ def generate_qr_uri(secret: str, email: str, issuer: str = "DocumentExchange") -
 
 def check_permission(user_role: str, required_permission: str) -> bool:
     """Check if user role has required permission"""
-    permissions = ROLE_PERMISSIONS.get(user_role, [])
-    return required_permission in permissions
-
-def require_permission(required_permission: str):
-    """Decorator to require specific permission"""
-    def decorator(func):
-        async def wrapper(*args, **kwargs):
-            # Get current user from kwargs or context
-            current_user = kwargs.get('current_user')
-            if not current_user:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Not authenticated"
-                )
-            
-            if not check_permission(current_user.get('role'), required_permission):
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="Insufficient permissions"
-                )
-            
-            return await func(*args, **kwargs)
-        return wrapper
-    return decorator
+    required = PERMISSION_BITS.get(required_permission, 0)
+    return required != 0 and ROLE_PERMISSION_MASKS.get(user_role, 0) & required == required
 
 def generate_secure_token(length: int = 32) -> str:
     """Generate secure random token"""
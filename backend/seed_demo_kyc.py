@@ -2,7 +2,6 @@
 Script to seed demo data for testing KYC functionality
 """
 import asyncio
-from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timezone
 import uuid
 import sys
@@ -12,36 +11,35 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from security import hash_password
+from database import client, db
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
-DB_NAME = os.getenv("DB_NAME", "trading_db")
-
 async def seed_demo_data():
     """Seed demo users and KYC submissions"""
-    client = AsyncIOMotorClient(MONGO_URL)
-    db = client[DB_NAME]
     
     print("🌱 Starting to seed demo data...")
     
+    # Every demo user shares one password, so hash it once
+    demo_password_hash = hash_password("Demo@123456")
+    
     # Create demo users
     demo_users = [
         {
             "id": f"user-demo-{i}",
             "email": f"user{i}@demo.com",
             "username": f"demouser{i}",
-            "password_hash": hash_password("Demo@123456"),
+            "password_hash": demo_password_hash,
             "full_name": f"Demo User {i}",
             "role": "user",
             "kyc_status": "pending" if i <= 3 else "not_submitted",
             "is_active": True,
             "is_2fa_enabled": False,
             "totp_secret": None,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         }
         for i in range(1, 6)
     ]
@@ -70,7 +68,7 @@ async def seed_demo_data():
                 "file_ids": [f"file-demo-{i}-1", f"file-demo-{i}-2"],
                 "status": "pending",
                 "admin_note": None,
-                "created_at": datetime.now(timezone.utc).isoformat(),
+                "created_at": datetime.now(timezone.utc),
                 "reviewed_at": None
             }
             
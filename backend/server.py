@@ -1,7 +1,7 @@
 from fastapi import FastAPI, APIRouter
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 from contextlib import asynccontextmanager
 import os
 import logging
@@ -18,6 +18,9 @@ from routes.admin_advanced import router as admin_advanced_router
 from routes.web3 import router as web3_router
 from routes.user_routes import router as user_router
 from routes.admin_kyc import router as admin_kyc_router
+from middleware import CORSHeaderMiddleware, DeadlineMiddleware
+from utils.deadline import DeadlineExceeded
+from pymongo.errors import ExecutionTimeout
 
 # --------------------
 # Load environment
@@ -25,15 +28,14 @@ from routes.admin_kyc import router as admin_kyc_router
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-MONGO_URL = os.getenv("MONGO_URL")
-DB_NAME = os.getenv("DB_NAME", "trading_db")
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
+CORS_MAX_AGE = int(os.getenv("CORS_MAX_AGE", "600"))
 
 # --------------------
 # MongoDB setup
 # --------------------
-client = AsyncIOMotorClient(MONGO_URL)
-db = client[DB_NAME]
+# Shared with the routes and background services (one connection pool)
+from database import client, db
 
 # --------------------
 # Logging
@@ -50,14 +52,58 @@ logger = logging.getLogger(__name__)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    from database import create_indexes, seed_default_admin
-    await create_indexes()
-    await seed_default_admin()
+    from database import bootstrap_schema
+    from utils.deposit_watcher import DepositConfirmationWatcher
+    from utils.payout_engine import PayoutEngine
+    from utils.token_revocation import revocation_list
+    from utils.password_hasher import password_hasher
+    from utils.api_keys import api_key_usage
+    from utils.permissions import permission_registry
+    from utils.audit_writer import audit_writer
+    from utils.audit_store import audit_store
+    from utils.audit_stream import audit_hub, audit_tailer
+    await bootstrap_schema()
+    await permission_registry.load(db)
     logger.info("✅ Database initialized successfully")
     
+    # Batch audit log writes (replays any records spilled while Mongo was down)
+    await audit_writer.start(db)
+    # Drop audit partitions older than AUDIT_RETENTION_MONTHS (if set)
+    await audit_store.start(db)
+    # Push new audit records to SSE clients, including other workers' records
+    audit_writer.add_listener(audit_hub.publish)
+    await audit_tailer.start(db)
+    
+    # Load revoked token ids into this worker's Bloom filter and keep it in sync
+    await revocation_list.start(db)
+    
+    # Write API key usage counters behind in batches
+    await api_key_usage.start(db)
+    
+    # Check Web3 deposits on-chain when RPC endpoints are configured
+    deposit_watcher = DepositConfirmationWatcher.from_env(db)
+    if deposit_watcher:
+        await deposit_watcher.start()
+    
+    # Batch approved crypto withdrawals when a payout backend is configured
+    payout_engine = PayoutEngine.from_env(db)
+    if payout_engine:
+        await payout_engine.start()
+    
     yield
     
     # Shutdown
+    await revocation_list.stop()
+    await audit_tailer.stop()
+    await audit_store.stop()
+    await api_key_usage.stop(db)
+    password_hasher.shutdown()
+    if deposit_watcher:
+        await deposit_watcher.stop()
+    if payout_engine:
+        await payout_engine.stop()
+    # Last, so audit records from the services above are flushed too
+    await audit_writer.stop()
     client.close()
     logger.info("✅ MongoDB connection closed")
 
@@ -71,6 +117,15 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Per-request time budget, passed down to Mongo as maxTimeMS
+app.add_middleware(DeadlineMiddleware)
+
+@app.exception_handler(ExecutionTimeout)
+async def execution_timeout_handler(request, exc):
+    # maxTimeMS from the request deadline expired on the server
+    deadline = DeadlineExceeded()
+    return JSONResponse({"detail": deadline.detail}, status_code=deadline.status_code, headers=deadline.headers)
+
 # FIX CORS COMPLETELY
 app.add_middleware(
     CORSMiddleware,
@@ -78,6 +133,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    max_age=CORS_MAX_AGE,  # Let browsers cache preflight responses
 )
 
 # --------------------
@@ -108,18 +164,13 @@ async def create_status_check(input: StatusCheckCreate):
     status_obj = StatusCheck(**input.dict())
     
     doc = status_obj.dict()
-    doc['timestamp'] = doc['timestamp'].isoformat()
     await db.status_checks.insert_one(doc)
     
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
 async def get_status_checks():
-    results = await db.status_checks.find({}, {"_id": 0}).to_list(1000)
-    for item in results:
-        if isinstance(item.get("timestamp"), str):
-            item["timestamp"] = datetime.fromisoformat(item["timestamp"])
-    return results
+    return await db.status_checks.find({}, {"_id": 0}).to_list(1000)
 
 # --------------------
 # Include routers - FIX PREFIX
@@ -136,13 +187,7 @@ app.include_router(api_router)
 # --------------------
 # Additional CORS handlers
 # --------------------
-@app.middleware("http")
-async def add_cors_header(request, call_next):
-    response = await call_next(request)
-    response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-    response.headers["Access-Control-Allow-Headers"] = "*"
-    return response
+app.add_middleware(CORSHeaderMiddleware)
 
 @app.options("/{rest_of_path:path}")
 async def preflight_handler(request, rest_of_path: str):
@@ -0,0 +1,57 @@
+"""Short-lived cache of admin account state
+
+Admin JWTs carry the role the admin had at login. The admin auth
+dependency uses this cache to check the current `is_active` and `role`
+without a database round trip on every request. Entries expire after a
+few seconds, and the endpoints that change an admin drop the entry right
+away on the worker that served them.
+"""
+import os
+from typing import Dict, Optional
+
+from cachetools import TTLCache
+
+DEFAULT_CACHE_SIZE = 1_000
+DEFAULT_CACHE_TTL = 30  # seconds
+
+# Cached for deleted or unknown admins
+MISSING = {}
+
+
+class AdminStateCache:
+    """TTL cache of admin id -> {is_active, role}"""
+
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE, ttl: float = DEFAULT_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, db, admin_id: str) -> Optional[Dict]:
+        state = self._cache.get(admin_id)
+        if state is not None:
+            self.hits += 1
+            return state or None
+
+        self.misses += 1
+        admin = await db.admin_users.find_one({"id": admin_id}, {"_id": 0, "is_active": 1, "role": 1})
+        state = MISSING
+        if admin:
+            state = {"is_active": admin.get('is_active', True), "role": admin.get('role')}
+        self._cache[admin_id] = state
+        return state or None
+
+    def invalidate(self, admin_id: str):
+        self._cache.pop(admin_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+admin_state_cache = AdminStateCache(
+    int(os.getenv("ADMIN_STATE_CACHE_SIZE", DEFAULT_CACHE_SIZE)),
+    float(os.getenv("ADMIN_STATE_CACHE_TTL", DEFAULT_CACHE_TTL))
+)
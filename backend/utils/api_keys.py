@@ -0,0 +1,227 @@
+"""API key lookup cache and write-behind usage tracking
+
+API keys (`tk_...`) are stored as SHA-256 hashes in `api_tokens.token_key`.
+`ApiKeyIndex` caches hash -> principal for a short TTL so authenticating a
+key normally costs no database round trip; admin updates and deletes
+invalidate the entry on the worker that served them, other workers pick
+the change up when their entry expires.
+
+`ApiKeyUsageRecorder` accumulates `usage_count` and `last_used_at` in
+memory and writes them back in one bulk write per flush interval instead
+of one update per request. It also meters requests per token and minute
+into the `api_token_usage` rollup collection, split into served and
+throttled requests.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Optional, Tuple
+
+from cachetools import TTLCache
+from pymongo import UpdateOne
+
+from utils.permissions import permission_registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 10_000
+DEFAULT_CACHE_TTL = 60  # seconds
+DEFAULT_FLUSH_INTERVAL = 10  # seconds
+DEFAULT_USAGE_RETENTION_DAYS = 30
+
+# Limits for tokens that do not set their own (0 = no daily quota)
+DEFAULT_TOKEN_RATE_PER_MINUTE = int(os.getenv("API_TOKEN_DEFAULT_RATE_PER_MINUTE", "600"))
+DEFAULT_TOKEN_DAILY_QUOTA = int(os.getenv("API_TOKEN_DEFAULT_DAILY_QUOTA", "0"))
+
+# Cached for unknown keys so guessing does not hit the database every time
+UNKNOWN_KEY = {}
+
+
+def hash_api_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+def _parse_expiry(value) -> Optional[datetime]:
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class ApiKeyIndex:
+    """In-process TTL cache of API key hash -> token principal"""
+
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE, ttl: float = DEFAULT_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    async def resolve(self, db, key_hash: str) -> Optional[Dict]:
+        """Return the token's principal, limits and status, or None for unknown keys"""
+        entry = self._cache.get(key_hash)
+        if entry is not None:
+            self.hits += 1
+            return entry or None
+
+        self.misses += 1
+        token = await db.api_tokens.find_one(
+            {"token_key": key_hash},
+            {
+                "_id": 0, "id": 1, "user_id": 1, "permissions": 1, "expires_at": 1, "is_active": 1,
+                "rate_limit_per_minute": 1, "burst": 1, "daily_quota": 1
+            }
+        )
+        entry = UNKNOWN_KEY
+        if token:
+            entry = {
+                "token_id": token['id'],
+                "user_id": token['user_id'],
+                "permissions": token.get('permissions', []),
+                "permission_mask": permission_registry.mask(token.get('permissions', [])),
+                "permission_generation": permission_registry.generation,
+                "expires_at": _parse_expiry(token.get('expires_at')),
+                "is_active": token.get('is_active', True),
+                "rate_limit_per_minute": token.get('rate_limit_per_minute'),
+                "burst": token.get('burst'),
+                "daily_quota": token.get('daily_quota')
+            }
+        self._cache[key_hash] = entry
+        return entry or None
+
+    def invalidate(self, key_hash: str):
+        self._cache.pop(key_hash, None)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._cache),
+            "maxsize": self._cache.maxsize,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+class ApiKeyUsageRecorder:
+    """Buffers per-token usage and minute rollups and flushes them in bulk"""
+
+    def __init__(
+        self,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        retention_days: int = DEFAULT_USAGE_RETENTION_DAYS
+    ):
+        self.flush_interval = flush_interval
+        self.retention = timedelta(days=retention_days)
+        self._pending: Dict[str, list] = {}
+        self._minutes: Dict[Tuple[str, datetime], list] = defaultdict(lambda: [0, 0])
+        self._task: Optional[asyncio.Task] = None
+        self.flushed_updates = 0
+
+    def record(self, token_id: str, throttled: bool = False):
+        now = datetime.now(timezone.utc)
+        counts = self._minutes[(token_id, now.replace(second=0, microsecond=0))]
+        if throttled:
+            counts[1] += 1
+            return
+
+        counts[0] += 1
+        entry = self._pending.get(token_id)
+        if entry:
+            entry[0] += 1
+            entry[1] = now
+        else:
+            self._pending[token_id] = [1, now]
+
+    async def flush(self, db) -> int:
+        if not self._pending and not self._minutes:
+            return 0
+
+        pending, self._pending = self._pending, {}
+        minutes, self._minutes = self._minutes, defaultdict(lambda: [0, 0])
+        token_operations = [
+            UpdateOne(
+                {"id": token_id},
+                {"$inc": {"usage_count": count}, "$set": {"last_used_at": last_used}}
+            )
+            for token_id, (count, last_used) in pending.items()
+        ]
+        rollup_operations = [
+            UpdateOne(
+                {"token_id": token_id, "minute": minute},
+                {
+                    "$inc": {"requests": served, "throttled": throttled},
+                    "$setOnInsert": {"expires_at": minute + self.retention}
+                },
+                upsert=True
+            )
+            for (token_id, minute), (served, throttled) in minutes.items()
+        ]
+        try:
+            if token_operations:
+                await db.api_tokens.bulk_write(token_operations, ordered=False)
+                token_operations = []
+            if rollup_operations:
+                await db.api_token_usage.bulk_write(rollup_operations, ordered=False)
+        except Exception:
+            # Put the counts back so the next flush retries them
+            if token_operations:
+                for token_id, (count, last_used) in pending.items():
+                    entry = self._pending.setdefault(token_id, [0, last_used])
+                    entry[0] += count
+                    entry[1] = max(entry[1], last_used)
+            for key, (served, throttled) in minutes.items():
+                self._minutes[key][0] += served
+                self._minutes[key][1] += throttled
+            raise
+
+        self.flushed_updates += len(pending) + len(minutes)
+        return len(pending) + len(minutes)
+
+    async def start(self, db):
+        self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self, db):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        try:
+            await self.flush(db)
+        except Exception as e:
+            logger.warning(f"Final API key usage flush failed: {str(e)}")
+
+    async def _run(self, db):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush(db)
+            except Exception as e:
+                logger.warning(f"API key usage flush failed: {str(e)}")
+
+    def stats(self) -> dict:
+        return {
+            "pending_tokens": len(self._pending),
+            "pending_minutes": len(self._minutes),
+            "flushed_updates": self.flushed_updates
+        }
+
+
+api_key_index = ApiKeyIndex(
+    int(os.getenv("API_KEY_CACHE_SIZE", DEFAULT_CACHE_SIZE)),
+    float(os.getenv("API_KEY_CACHE_TTL", DEFAULT_CACHE_TTL))
+)
+api_key_usage = ApiKeyUsageRecorder(
+    float(os.getenv("API_KEY_USAGE_FLUSH_SECONDS", DEFAULT_FLUSH_INTERVAL)),
+    int(os.getenv("API_KEY_USAGE_RETENTION_DAYS", DEFAULT_USAGE_RETENTION_DAYS))
+)
@@ -0,0 +1,253 @@
+"""Monthly partitioned audit log storage
+
+Audit records live in one collection per calendar month
+(`audit_logs_YYYYMM`, by record timestamp), so each partition's indexes
+stay bounded. Retention drops whole partitions instead of deleting
+documents one by one.
+
+Reads go through `AuditStore`, which fans a query out over only the
+partitions that overlap the requested time range. Newest-first pages are
+served by walking partitions from the newest one. A partition that lies
+entirely inside the skipped rows is skipped with a count instead of a
+cursor skip.
+
+Records also carry normalized lookup fields: `action_lc` (lowercase
+action, for exact and prefix filters) and `subject_type`/`subject_id`
+(the main entity the event is about, taken from `details`). Both are
+served by compound indexes that end in `timestamp`.
+
+The legacy unpartitioned `audit_logs` collection, if it still exists, is
+read as the oldest partition until `migrate_audit_partitions.py` has
+moved its records.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from pymongo import IndexModel
+
+from utils.timestamps import timestamp_range
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "audit_logs"
+LEGACY_COLLECTION = "audit_logs"
+PARTITION_PATTERN = re.compile(rf"^{PREFIX}_(\d{{6}})$")
+PARTITION_LIST_TTL = 60  # seconds
+RETENTION_CHECK_INTERVAL = 6 * 3600  # seconds
+
+
+def _month_key(value) -> str:
+    """YYYYMM for an ISO timestamp string or a datetime"""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value.strftime("%Y%m")
+    if isinstance(value, str) and len(value) >= 7:
+        return value[0:4] + value[5:7]
+    return datetime.now(timezone.utc).strftime("%Y%m")
+
+
+# details key -> subject type, most specific first
+SUBJECT_FIELDS = [
+    ("kyc_id", "kyc"),
+    ("withdrawal_id", "withdrawal"),
+    ("deposit_id", "deposit"),
+    ("document_id", "document"),
+    ("batch_id", "payout_batch"),
+    ("token_id", "api_token"),
+    ("permission_id", "api_permission"),
+    ("admin_id", "admin"),
+    ("new_admin_id", "admin"),
+    ("new_user_id", "user"),
+    ("user_id", "user"),
+]
+
+
+def normalize_record(record: Dict) -> Dict:
+    """Fill in action_lc, subject_type and subject_id (idempotent)"""
+    record['action_lc'] = (record.get('action') or '').lower()
+
+    details = record.get('details') or {}
+    record['subject_type'] = None
+    record['subject_id'] = None
+    for field, subject_type in SUBJECT_FIELDS:
+        if details.get(field):
+            record['subject_type'] = subject_type
+            record['subject_id'] = str(details[field])
+            break
+    return record
+
+
+def partition_name(timestamp) -> str:
+    return f"{PREFIX}_{_month_key(timestamp)}"
+
+
+class AuditStore:
+    """Routes audit reads and writes to monthly partitions"""
+
+    def __init__(self, retention_months: int = 0):
+        self.retention_months = retention_months
+        self._known: set = set()
+        self._partitions: Optional[List[str]] = None
+        self._listed_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    # ---- writes ----
+
+    async def ensure_partition(self, db, name: str):
+        """Create a partition's indexes once per process"""
+        if name in self._known:
+            return
+
+        await db[name].create_indexes([
+            IndexModel("timestamp"),
+            IndexModel([("user_id", 1), ("timestamp", -1)]),
+            IndexModel([("action_lc", 1), ("timestamp", -1)]),
+            IndexModel([("subject_type", 1), ("subject_id", 1), ("timestamp", -1)]),
+        ])
+        self._known.add(name)
+        self._partitions = None
+
+    async def collection_for(self, db, record: Dict):
+        name = partition_name(record.get('timestamp'))
+        await self.ensure_partition(db, name)
+        return db[name]
+
+    def group_by_partition(self, records: List[Dict]) -> Dict[str, List[Dict]]:
+        groups: Dict[str, List[Dict]] = {}
+        for record in records:
+            groups.setdefault(partition_name(record.get('timestamp')), []).append(record)
+        return groups
+
+    # ---- reads ----
+
+    async def partitions(self, db) -> List[str]:
+        """Existing partitions, newest first, legacy collection last"""
+        if self._partitions is None or time.monotonic() - self._listed_at > PARTITION_LIST_TTL:
+            names = await db.list_collection_names()
+            partitions = sorted((n for n in names if PARTITION_PATTERN.match(n)), reverse=True)
+            if LEGACY_COLLECTION in names:
+                partitions.append(LEGACY_COLLECTION)
+            self._partitions = partitions
+            self._listed_at = time.monotonic()
+        return self._partitions
+
+    async def partitions_for_range(self, db, since=None, until=None) -> List[str]:
+        low = _month_key(since) if since else None
+        high = _month_key(until) if until else None
+
+        selected = []
+        for name in await self.partitions(db):
+            match = PARTITION_PATTERN.match(name)
+            if match:
+                month = match.group(1)
+                if (low and month < low) or (high and month > high):
+                    continue
+            selected.append(name)
+        return selected
+
+    @staticmethod
+    def _with_range(query: Dict, since=None, until=None) -> Dict:
+        if not since and not until:
+            return query
+        ranged = timestamp_range("timestamp", since, until)
+        return {"$and": [query, ranged]} if query else ranged
+
+    async def count(self, db, query: Dict, since=None, until=None) -> int:
+        names = await self.partitions_for_range(db, since, until)
+        ranged = self._with_range(query, since, until)
+        counts = await asyncio.gather(*[db[name].count_documents(ranged) for name in names])
+        return sum(counts)
+
+    async def find(
+        self,
+        db,
+        query: Dict,
+        skip: int = 0,
+        limit: int = 50,
+        since=None,
+        until=None,
+        newest_first: bool = True,
+        projection: Optional[Dict] = None
+    ) -> List[Dict]:
+        names = await self.partitions_for_range(db, since, until)
+        if not newest_first:
+            names = list(reversed(names))
+        ranged = self._with_range(query, since, until)
+        projection = projection or {"_id": 0}
+        direction = -1 if newest_first else 1
+
+        results: List[Dict] = []
+        for name in names:
+            if len(results) >= limit:
+                break
+            collection = db[name]
+
+            if skip:
+                in_partition = await collection.count_documents(ranged)
+                if skip >= in_partition:
+                    skip -= in_partition
+                    continue
+
+            remaining = limit - len(results)
+            results.extend(
+                await collection.find(ranged, projection)
+                .sort("timestamp", direction).skip(skip).limit(remaining).to_list(remaining)
+            )
+            skip = 0
+
+        return results
+
+    # ---- retention ----
+
+    def _cutoff(self, now: Optional[datetime] = None) -> str:
+        now = now or datetime.now(timezone.utc)
+        months = now.year * 12 + now.month - 1 - self.retention_months
+        return f"{months // 12:04d}{months % 12 + 1:02d}"
+
+    async def drop_expired(self, db, now: Optional[datetime] = None) -> List[str]:
+        """Drop partitions whose whole month is older than the retention window"""
+        if not self.retention_months:
+            return []
+
+        cutoff = self._cutoff(now)
+        dropped = []
+        for name in await self.partitions(db):
+            match = PARTITION_PATTERN.match(name)
+            if match and match.group(1) < cutoff:
+                await db.drop_collection(name)
+                self._known.discard(name)
+                dropped.append(name)
+
+        if dropped:
+            self._partitions = None
+            logger.info(f"Dropped expired audit partitions: {', '.join(dropped)}")
+        return dropped
+
+    async def start(self, db):
+        self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, db):
+        while True:
+            try:
+                await self.drop_expired(db)
+            except Exception as e:
+                logger.warning(f"Audit retention check failed: {str(e)}")
+            await asyncio.sleep(RETENTION_CHECK_INTERVAL)
+
+
+audit_store = AuditStore(int(os.getenv("AUDIT_RETENTION_MONTHS", "0")))
@@ -0,0 +1,236 @@
+"""Live audit event fan-out for Server-Sent Events clients
+
+`AuditEventHub` pushes every new audit record, plus the dashboard counter
+changes it implies, to each connected admin stream. Every subscriber has
+a bounded queue. A client that falls behind far enough to fill it is
+dropped (and told so) instead of slowing down everyone else.
+
+Records reach the hub from two places:
+- the in-process `AuditWriter`, as soon as a record is logged on this worker
+- `AuditTailer`, which polls the audit partitions for records written by
+  other workers, paging forward from the last ObjectId it saw
+
+Both paths can deliver the same record, so the hub de-duplicates by `_id`.
+`_id` is assigned when the record is queued, so records another worker
+flushes late sort behind the tailer's resume point; each poll also pages
+through the short window behind it to catch those.
+"""
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+
+from bson import ObjectId
+
+from utils.audit_store import partition_name
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CLIENT_QUEUE = 256
+DEFAULT_POLL_INTERVAL = 2  # seconds
+# How far behind the resume point the tailer re-reads (write-behind delay)
+TAIL_OVERLAP = timedelta(seconds=15)
+TAIL_BATCH = 500
+SEEN_IDS = 20_000
+
+# Dashboard counters affected by an audit action
+COUNTER_DELTAS = {
+    "kyc_submitted": {"pending_kyc": 1},
+    "kyc_verified": {"pending_kyc": -1},
+    "crypto_deposit_submitted": {"pending_deposits": 1},
+    "deposit_processed": {"pending_deposits": -1},
+    "crypto_deposit_auto_rejected": {"pending_deposits": -1},
+    "crypto_withdrawal_requested": {"pending_withdrawals": 1},
+    "withdrawal_processed": {"pending_withdrawals": -1},
+    "user_created_by_admin": {"total_users": 1},
+    "user_deleted": {"total_users": -1},
+}
+
+
+def _json_default(value):
+    # Same ISO 8601 output the REST endpoints produce for stored timestamps
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def format_sse(event: str, data: Dict, event_id: Optional[str] = None) -> str:
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=_json_default)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def serialize_record(record: Dict) -> Dict:
+    event = {k: v for k, v in record.items() if k != '_id'}
+    event['id'] = str(record['_id'])
+    return event
+
+
+async def replay_since(db, last_event_id: str, now: Optional[datetime] = None) -> List[Dict]:
+    """Records after a client's Last-Event-ID, for reconnects"""
+    try:
+        last_id = ObjectId(last_event_id)
+    except Exception:
+        return []
+
+    now = now or datetime.now(timezone.utc)
+    names = sorted({partition_name(last_id.generation_time), partition_name(now)})
+    records: List[Dict] = []
+    for name in names:
+        remaining = TAIL_BATCH - len(records)
+        if remaining <= 0:
+            break
+        records.extend(
+            await db[name].find({"_id": {"$gt": last_id}}).sort("_id", 1).to_list(remaining)
+        )
+    return records
+
+
+def _partition_names(since: datetime, until: datetime) -> List[str]:
+    """Monthly partition names from `since`'s month through `until`'s"""
+    names = []
+    month = since.year * 12 + since.month - 1
+    last = until.year * 12 + until.month - 1
+    while month <= last:
+        names.append(partition_name(datetime(month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)))
+        month += 1
+    return names
+
+
+class Subscriber:
+    def __init__(self, max_queue: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = False
+
+
+class AuditEventHub:
+    """Fans audit records out to subscriber queues"""
+
+    def __init__(self, client_queue: int = DEFAULT_CLIENT_QUEUE):
+        self.client_queue = client_queue
+        self.subscribers: Set[Subscriber] = set()
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self.published = 0
+        self.duplicates = 0
+        self.dropped_clients = 0
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(self.client_queue)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, record: Dict):
+        if '_id' not in record:
+            return
+
+        record_id = str(record['_id'])
+        if record_id in self._seen:
+            self.duplicates += 1
+            return
+        self._seen[record_id] = None
+        if len(self._seen) > SEEN_IDS:
+            self._seen.popitem(last=False)
+
+        if not self.subscribers:
+            return
+
+        messages = [format_sse("audit", serialize_record(record), record_id)]
+        deltas = COUNTER_DELTAS.get(record.get('action'))
+        if deltas:
+            messages.append(format_sse("counters", deltas))
+
+        self.published += 1
+        for subscriber in list(self.subscribers):
+            try:
+                for message in messages:
+                    subscriber.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Slow consumer: cut it loose rather than buffer without bound
+                subscriber.dropped = True
+                self.subscribers.discard(subscriber)
+                self.dropped_clients += 1
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self.subscribers),
+            "published": self.published,
+            "duplicates": self.duplicates,
+            "dropped_clients": self.dropped_clients
+        }
+
+
+class AuditTailer:
+    """Polls audit partitions for records written by other workers"""
+
+    def __init__(self, hub: AuditEventHub, poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.hub = hub
+        self.poll_interval = poll_interval
+        self.resume_id: Optional[ObjectId] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def poll_once(self, db, now: Optional[datetime] = None) -> int:
+        now = now or datetime.now(timezone.utc)
+        floor = ObjectId.from_datetime(now - TAIL_OVERLAP)
+        resume_id = self.resume_id
+
+        delivered = 0
+        if resume_id is not None and resume_id > floor:
+            # Records other workers flushed late sort behind the resume point
+            delivered += await self._scan(db, floor, resume_id, now)
+        delivered += await self._scan(db, resume_id or floor, None, now)
+        return delivered
+
+    async def _scan(self, db, since: ObjectId, until: Optional[ObjectId], now: datetime) -> int:
+        """Publish records in (since, until] page by page, across monthly partitions"""
+        delivered = 0
+        for name in _partition_names(since.generation_time, now):
+            after = since
+            while True:
+                query = {"_id": {"$gt": after, "$lte": until} if until else {"$gt": after}}
+                records = await db[name].find(query).sort("_id", 1).to_list(TAIL_BATCH)
+                for record in records:
+                    self.hub.publish(record)
+                    if self.resume_id is None or record['_id'] > self.resume_id:
+                        self.resume_id = record['_id']
+                delivered += len(records)
+                if len(records) < TAIL_BATCH:
+                    break
+                after = records[-1]['_id']
+        return delivered
+
+    async def start(self, db):
+        self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, db):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            # Nobody is listening: skip the query, but do not fall behind
+            if not self.hub.subscribers:
+                self.resume_id = None
+                continue
+            try:
+                await self.poll_once(db)
+            except Exception as e:
+                logger.warning(f"Audit tailer poll failed: {str(e)}")
+
+
+audit_hub = AuditEventHub(int(os.getenv("AUDIT_STREAM_CLIENT_QUEUE", DEFAULT_CLIENT_QUEUE)))
+audit_tailer = AuditTailer(audit_hub, float(os.getenv("AUDIT_STREAM_POLL_SECONDS", DEFAULT_POLL_INTERVAL)))
@@ -0,0 +1,292 @@
+"""Write-behind sink for audit log records
+
+`log_audit` hands records to `AuditWriter.enqueue`, which only appends to
+an in-memory queue. A background task flushes the queue with one
+`insert_many(ordered=False)` per monthly partition whenever it reaches `batch_size` records or
+`flush_interval` seconds have passed, and once more on shutdown.
+
+Each record gets its `_id` when it is queued. Retrying a batch after a
+partial failure therefore cannot duplicate records: the rows that were
+already written fail with duplicate key errors, which are ignored.
+
+If Mongo cannot be reached, the batch is appended to a local JSON-lines
+spill file and replayed once writes succeed again. Critical events skip
+the queue and are written (or spilled) before `log_audit` returns.
+
+Every worker process spills to its own file, `audit_spill.<pid>.jsonl`
+next to the configured path, and replays it through
+`audit_spill.<pid>.replay`. Files left behind by processes that no longer
+run are adopted by renaming them to the adopter's replay file; the rename
+is atomic, so when several workers start at once only one of them
+replays each orphan.
+
+Listeners registered with `add_listener` see every record as soon as it
+is accepted, before it is written; the live audit stream uses this.
+"""
+import asyncio
+import logging
+import os
+import re
+from collections import deque
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from utils.audit_store import audit_store
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 1.0  # seconds
+DEFAULT_MAX_QUEUE = 50_000
+DEFAULT_SPILL_PATH = Path(__file__).resolve().parent.parent / "audit_spill.jsonl"
+DUPLICATE_KEY = 11000
+# How often to retry the spill file while it exists
+REPLAY_INTERVAL = 30  # seconds
+
+
+class AuditWriter:
+    """Queues audit records and writes them to the audit partitions in batches"""
+
+    def __init__(
+        self,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        spill_path: Path = DEFAULT_SPILL_PATH
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.spill_path = Path(spill_path)
+        self._queue: deque = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._db = None
+        self._stopping = False
+        self._listeners: List[Callable[[Dict], None]] = []
+        self.written = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.flushes = 0
+
+    @classmethod
+    def from_env(cls) -> "AuditWriter":
+        return cls(
+            batch_size=int(os.getenv("AUDIT_BATCH_SIZE", DEFAULT_BATCH_SIZE)),
+            flush_interval=float(os.getenv("AUDIT_FLUSH_SECONDS", DEFAULT_FLUSH_INTERVAL)),
+            max_queue=int(os.getenv("AUDIT_MAX_QUEUE", DEFAULT_MAX_QUEUE)),
+            spill_path=Path(os.getenv("AUDIT_SPILL_PATH", DEFAULT_SPILL_PATH))
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    @staticmethod
+    def prepare(record: Dict) -> Dict:
+        record.setdefault('_id', ObjectId())
+        return record
+
+    def add_listener(self, listener: Callable[[Dict], None]):
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def _notify(self, record: Dict):
+        for listener in self._listeners:
+            try:
+                listener(record)
+            except Exception as e:
+                logger.warning(f"Audit listener failed: {str(e)}")
+
+    def enqueue(self, record: Dict):
+        """Queue a record for the next batch"""
+        self._queue.append(self.prepare(record))
+        self._notify(record)
+
+        if len(self._queue) > self.max_queue:
+            # Mongo is not keeping up: move the oldest batch to disk instead of growing
+            self._spill([self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))])
+        if len(self._queue) >= self.batch_size and self._wakeup:
+            self._wakeup.set()
+
+    async def write(self, db, record: Dict):
+        """Write one record now; spill it locally if Mongo is unavailable"""
+        record = self.prepare(record)
+        self._notify(record)
+        try:
+            collection = await audit_store.collection_for(db, record)
+            await collection.insert_one(record)
+            self.written += 1
+        except DuplicateKeyError:
+            pass
+        except Exception as e:
+            logger.error(f"Audit write failed, spilling to {self.spill_path}: {str(e)}")
+            self._spill([record])
+
+    async def flush(self, db) -> int:
+        """Write everything queued so far; returns the number of records handled"""
+        handled = 0
+        while self._queue:
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            await self._insert_batch(db, batch)
+            handled += len(batch)
+        self.flushes += 1
+        return handled
+
+    async def _insert_batch(self, db, batch: List[Dict]) -> bool:
+        """Insert a batch split by partition; returns False if Mongo was unreachable"""
+        try:
+            groups = audit_store.group_by_partition(batch)
+            for name in groups:
+                await audit_store.ensure_partition(db, name)
+        except Exception as e:
+            logger.error(f"Audit batch write failed, spilling {len(batch)} records: {str(e)}")
+            self._spill(batch)
+            return False
+
+        reachable = True
+        for name, records in groups.items():
+            try:
+                await db[name].insert_many(records, ordered=False)
+                self.written += len(records)
+            except BulkWriteError as e:
+                failed = [err for err in e.details.get('writeErrors', []) if err.get('code') != DUPLICATE_KEY]
+                self.written += len(records) - len(failed)
+                if failed:
+                    self._spill([records[err['index']] for err in failed])
+            except Exception as e:
+                logger.error(f"Audit batch write failed, spilling {len(records)} records: {str(e)}")
+                self._spill(records)
+                reachable = False
+        return reachable
+
+    def _own_file(self, suffix: str) -> Path:
+        # Resolved on every call: workers may be forked after this writer is built
+        return self.spill_path.with_name(f"{self.spill_path.stem}.{os.getpid()}{suffix}")
+
+    def _spill_files(self) -> List[Path]:
+        """This process's spill files and those of processes no longer running, replay files first"""
+        if not self.spill_path.parent.exists():
+            return []
+
+        pattern = re.compile(
+            rf"{re.escape(self.spill_path.stem)}(?:\.(\d+))?(?:{re.escape(self.spill_path.suffix)}|\.replay)"
+        )
+        files = []
+        for path in self.spill_path.parent.iterdir():
+            match = pattern.fullmatch(path.name)
+            if not match:
+                continue
+            # Files without a pid were written before spills were per process
+            pid = int(match.group(1)) if match.group(1) else None
+            if pid is None or pid == os.getpid() or not _process_alive(pid):
+                files.append(path)
+        return sorted(files, key=lambda path: (path.suffix != ".replay", path.name))
+
+    def _spill(self, records: List[Dict]):
+        spill_path = self._own_file(self.spill_path.suffix)
+        spill_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(spill_path, "a", encoding="utf-8") as spill:
+            for record in records:
+                spill.write(json_util.dumps(record) + "\n")
+            spill.flush()
+            os.fsync(spill.fileno())
+        self.spilled += len(records)
+
+    async def replay_spill(self, db) -> int:
+        """Move spilled records back into Mongo"""
+        replayed = 0
+        for path in self._spill_files():
+            # New spills go to a fresh file while this one is replayed
+            replay_path = self._own_file(".replay")
+            if path != replay_path:
+                try:
+                    os.replace(path, replay_path)
+                except FileNotFoundError:
+                    # Another worker adopted this orphan first
+                    continue
+
+            with open(replay_path, encoding="utf-8") as spill:
+                records = [json_util.loads(line) for line in spill if line.strip()]
+
+            reachable = True
+            for start in range(0, len(records), self.batch_size):
+                batch = records[start:start + self.batch_size]
+                if not await self._insert_batch(db, batch):
+                    # Still unavailable; the failed batch was spilled again
+                    self._spill(records[start + self.batch_size:])
+                    reachable = False
+                    break
+                replayed += len(batch)
+
+            os.remove(replay_path)
+            if not reachable:
+                break
+
+        self.replayed += replayed
+        return replayed
+
+    async def start(self, db):
+        self._db = db
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        try:
+            await self.replay_spill(db)
+        except Exception as e:
+            logger.warning(f"Could not replay audit spill file: {str(e)}")
+        self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self):
+        # Let the loop finish its current batch instead of cancelling mid-write
+        if self._task:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+        if self._db is not None:
+            await self.flush(self._db)
+
+    async def _run(self, db):
+        loop = asyncio.get_running_loop()
+        last_replay = loop.time()
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush(db)
+                if loop.time() - last_replay >= REPLAY_INTERVAL and self._spill_files():
+                    last_replay = loop.time()
+                    await self.replay_spill(db)
+            except Exception as e:
+                logger.warning(f"Audit flush failed: {str(e)}")
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._queue),
+            "written": self.written,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "flushes": self.flushes
+        }
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, owned by another user
+        return True
+    return True
+
+
+audit_writer = AuditWriter.from_env()
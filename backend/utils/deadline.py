@@ -0,0 +1,181 @@
+"""Per-request deadlines propagated to MongoDB
+
+`DeadlineMiddleware` (middleware.py) gives each request a time budget
+that depends on its route class and stores the deadline in a context
+variable. Route handlers get their database from `get_db` /
+`get_analytics_db`, which wrap it in `DeadlineDatabase`. The wrapper
+passes the remaining budget to every read as `maxTimeMS`, so the server
+abandons a query the client has stopped waiting for.
+
+When the budget runs out, the request fails with 503 instead of holding a
+worker and a pool connection:
+- before a query starts, `DeadlineExceeded` is raised
+- during a query, the server's ExecutionTimeout is mapped to 503 by
+  server.py
+
+The deadline is only ever enforced at those two points; a handler is
+never cancelled part-way. Once a request has issued its first write, the
+deadline is dropped for the rest of it, so the writes that follow (and
+the reads between them) run to completion instead of leaving a half-made
+change behind. Writes other than find-and-modify cannot carry maxTimeMS
+and are passed through unchanged. Background services use the unwrapped
+database and have no deadline.
+"""
+import os
+import time
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+DEFAULT_BUDGET = 10.0  # seconds
+ANALYTICS_BUDGET = 30.0
+UPLOAD_BUDGET = 60.0
+RETRY_AFTER = "1"  # seconds
+
+
+class RequestDeadline:
+    """Absolute time.monotonic() deadline of one request, dropped on its first write"""
+
+    def __init__(self, at: float):
+        self.at = at
+        self.committed = False
+
+
+# Mutable, so a write made in a copied context (e.g. a dependency) still counts
+_deadline: ContextVar[Optional[RequestDeadline]] = ContextVar("request_deadline", default=None)
+
+
+def _budget(env: str, default: float) -> Optional[float]:
+    value = float(os.getenv(env, default))
+    return value if value > 0 else None
+
+
+# Path prefix -> budget in seconds, first match wins (None: no deadline)
+ROUTE_BUDGETS: List[Tuple[str, Optional[float]]] = [
+    # Long-lived Server-Sent Events stream
+    ("/api/admin/audit-logs/stream", None),
+    ("/api/admin/dashboard", _budget("REQUEST_DEADLINE_ANALYTICS_SECONDS", ANALYTICS_BUDGET)),
+    ("/api/admin/kyc/statistics", _budget("REQUEST_DEADLINE_ANALYTICS_SECONDS", ANALYTICS_BUDGET)),
+    ("/api/admin/audit-logs", _budget("REQUEST_DEADLINE_ANALYTICS_SECONDS", ANALYTICS_BUDGET)),
+    ("/api/user/kyc/submit", _budget("REQUEST_DEADLINE_UPLOAD_SECONDS", UPLOAD_BUDGET)),
+]
+DEFAULT_ROUTE_BUDGET = _budget("REQUEST_DEADLINE_SECONDS", DEFAULT_BUDGET)
+
+
+class DeadlineExceeded(HTTPException):
+    """The request's time budget is used up"""
+
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Request deadline exceeded",
+            headers={"Retry-After": RETRY_AFTER}
+        )
+
+
+def budget_for(path: str) -> Optional[float]:
+    for prefix, budget in ROUTE_BUDGETS:
+        if path.startswith(prefix):
+            return budget
+    return DEFAULT_ROUTE_BUDGET
+
+
+def start_deadline(budget: Optional[float]):
+    """Set the current request's deadline; returns the token for `reset_deadline`"""
+    return _deadline.set(RequestDeadline(time.monotonic() + budget) if budget else None)
+
+
+def reset_deadline(token):
+    _deadline.reset(token)
+
+
+def remaining_ms() -> Optional[int]:
+    """Milliseconds left for the current request (None without a deadline or after a write)"""
+    deadline = _deadline.get()
+    if deadline is None or deadline.committed:
+        return None
+    remaining = int((deadline.at - time.monotonic()) * 1000)
+    if remaining <= 0:
+        raise DeadlineExceeded()
+    return remaining
+
+
+def mark_committed():
+    """The current request has written: stop enforcing its deadline"""
+    deadline = _deadline.get()
+    if deadline is not None:
+        deadline.committed = True
+
+
+# Collection methods that modify data
+WRITE_METHODS = frozenset({
+    "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+    "delete_one", "delete_many", "bulk_write", "find_one_and_delete", "find_one_and_replace"
+})
+
+
+class DeadlineCollection:
+    """Collection proxy that adds maxTimeMS to reads"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in WRITE_METHODS:
+            mark_committed()
+        return attr
+
+    def find(self, *args, **kwargs):
+        cursor = self._collection.find(*args, **kwargs)
+        ms = remaining_ms()
+        return cursor.max_time_ms(ms) if ms else cursor
+
+    async def find_one(self, *args, **kwargs):
+        ms = remaining_ms()
+        if ms:
+            kwargs.setdefault("max_time_ms", ms)
+        return await self._collection.find_one(*args, **kwargs)
+
+    def aggregate(self, pipeline, *args, **kwargs):
+        ms = remaining_ms()
+        if ms:
+            kwargs.setdefault("maxTimeMS", ms)
+        return self._collection.aggregate(pipeline, *args, **kwargs)
+
+    async def count_documents(self, filter, *args, **kwargs):
+        ms = remaining_ms()
+        if ms:
+            kwargs.setdefault("maxTimeMS", ms)
+        return await self._collection.count_documents(filter, *args, **kwargs)
+
+    async def distinct(self, key, *args, **kwargs):
+        ms = remaining_ms()
+        if ms:
+            kwargs.setdefault("maxTimeMS", ms)
+        return await self._collection.distinct(key, *args, **kwargs)
+
+    async def find_one_and_update(self, *args, **kwargs):
+        ms = remaining_ms()
+        if ms:
+            kwargs.setdefault("maxTimeMS", ms)
+        mark_committed()
+        return await self._collection.find_one_and_update(*args, **kwargs)
+
+
+class DeadlineDatabase:
+    """Database proxy whose collections add maxTimeMS to reads"""
+
+    def __init__(self, database):
+        self._database = database
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        attr = getattr(self._database, name)
+        # Class-level check: Motor clients answer any attribute with a sub-database
+        return DeadlineCollection(attr) if hasattr(type(attr), "find") else attr
+
+    def __getitem__(self, name):
+        return DeadlineCollection(self._database[name])
@@ -0,0 +1,402 @@
+"""Blockchain confirmation watcher for Web3 deposits
+
+Polls every configured network for the receipts of pending deposit
+transaction hashes using JSON-RPC batch requests. Once a transaction has
+enough confirmations it is checked against the deposit (sender, token,
+platform recipient, value):
+- a reverted transaction rejects the deposit, once it is as deep as a
+  successful one would have to be (a reorg could still drop it before)
+- a matching transfer is marked `watcher_status: "verified"`, with the
+  confirmations, block number and block hash as evidence
+- anything else is flagged `needs_review`, as is a hash that is still not
+  mined DEPOSIT_WATCHER_UNMINED_HOURS after submission
+
+Each pass takes the pending deposits checked least recently
+(`metadata.watcher_checked_at`) and stamps them, so hashes that never
+resolve cannot keep newer deposits from being checked.
+
+Verified deposits still wait for an admin to approve them. All users pay
+into the same platform wallet, and nothing proves that the submitter owns
+`from_address`, so anyone watching the chain could claim someone else's
+transfer. Automatic crediting needs per-user deposit addresses or a
+signed ownership proof first.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from middleware import log_audit
+
+logger = logging.getLogger(__name__)
+
+# Blocks required before a deposit is considered final
+NETWORK_CONFIRMATIONS = {
+    "ethereum": 12,
+    "bsc": 15,
+    "polygon": 128
+}
+
+# Native coins are verified from the transaction value; token transfers need
+# log decoding per contract and are left for manual approval.
+NATIVE_TOKENS = {
+    "ethereum": "ETH",
+    "bsc": "BNB",
+    "polygon": "MATIC"
+}
+NATIVE_DECIMALS = 18
+
+DEFAULT_POLL_INTERVAL = 15
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_BLOCK_CACHE_TTL = 5
+PENDING_SCAN_LIMIT = 500
+DEFAULT_UNMINED_REVIEW_HOURS = 24
+
+# Deposits the watcher has finished with; they wait for an admin
+SETTLED_WATCHER_STATUSES = ("needs_review", "verified")
+
+
+def _parse_time(value) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class JSONRPCError(Exception):
+    """Raised when a JSON-RPC endpoint returns an unusable response"""
+
+
+class NetworkRPCClient:
+    """JSON-RPC client for one network with batching and a cached block height"""
+
+    def __init__(
+        self,
+        network: str,
+        url: str,
+        http: httpx.AsyncClient,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        block_cache_ttl: float = DEFAULT_BLOCK_CACHE_TTL,
+        unmined_review_after: timedelta = timedelta(hours=DEFAULT_UNMINED_REVIEW_HOURS)
+    ):
+        self.network = network
+        self.url = url
+        self.http = http
+        self.block_cache_ttl = block_cache_ttl
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._block_number: Optional[int] = None
+        self._block_fetched_at = 0.0
+        self._request_id = 0
+
+    async def batch(self, calls: List[Tuple[str, list]]) -> List:
+        """Send several calls in one HTTP request and return results in call order"""
+        if not calls:
+            return []
+
+        payload = []
+        for method, params in calls:
+            self._request_id += 1
+            payload.append({"jsonrpc": "2.0", "id": self._request_id, "method": method, "params": params})
+
+        async with self._semaphore:
+            response = await self.http.post(self.url, json=payload)
+        response.raise_for_status()
+
+        body = response.json()
+        if not isinstance(body, list):
+            raise JSONRPCError(f"{self.network}: expected a batch response, got {type(body).__name__}")
+
+        # Batch responses may come back in any order
+        by_id = {item.get("id"): item for item in body}
+        results = []
+        for request in payload:
+            item = by_id.get(request["id"])
+            if item is None or "error" in item:
+                results.append(None)
+            else:
+                results.append(item.get("result"))
+        return results
+
+    async def block_number(self) -> int:
+        """Latest block height, cached for a few seconds"""
+        now = time.monotonic()
+        if self._block_number is None or now - self._block_fetched_at > self.block_cache_ttl:
+            result, = await self.batch([("eth_blockNumber", [])])
+            if result is None:
+                raise JSONRPCError(f"{self.network}: eth_blockNumber failed")
+            self._block_number = int(result, 16)
+            self._block_fetched_at = now
+        return self._block_number
+
+    async def get_transactions(self, tx_hashes: List[str], batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, Tuple]:
+        """Fetch (receipt, transaction) pairs for many hashes in concurrent batches"""
+        chunks = [tx_hashes[i:i + batch_size] for i in range(0, len(tx_hashes), batch_size)]
+
+        async def fetch(chunk: List[str]) -> Dict[str, Tuple]:
+            calls = []
+            for tx_hash in chunk:
+                calls.append(("eth_getTransactionReceipt", [tx_hash]))
+                calls.append(("eth_getTransactionByHash", [tx_hash]))
+            results = await self.batch(calls)
+            return {
+                tx_hash: (results[2 * i], results[2 * i + 1])
+                for i, tx_hash in enumerate(chunk)
+            }
+
+        merged = {}
+        for part in await asyncio.gather(*(fetch(chunk) for chunk in chunks)):
+            merged.update(part)
+        return merged
+
+
+class DepositConfirmationWatcher:
+    """Background service that verifies pending Web3 deposits on-chain"""
+
+    def __init__(
+        self,
+        db,
+        rpc_urls: Dict[str, str],
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        block_cache_ttl: float = DEFAULT_BLOCK_CACHE_TTL,
+        unmined_review_after: timedelta = timedelta(hours=DEFAULT_UNMINED_REVIEW_HOURS)
+    ):
+        self.db = db
+        self.rpc_urls = rpc_urls
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.block_cache_ttl = block_cache_ttl
+        self.unmined_review_after = unmined_review_after
+        self.http: Optional[httpx.AsyncClient] = None
+        self.clients: Dict[str, NetworkRPCClient] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, db) -> Optional["DepositConfirmationWatcher"]:
+        """Build a watcher for every network with an `<NETWORK>_RPC_URL` set, or None"""
+        from routes.web3 import SUPPORTED_NETWORKS
+
+        rpc_urls = {
+            network: os.environ[f"{network.upper()}_RPC_URL"]
+            for network in SUPPORTED_NETWORKS
+            if os.environ.get(f"{network.upper()}_RPC_URL")
+        }
+        if not rpc_urls:
+            return None
+
+        return cls(
+            db,
+            rpc_urls,
+            poll_interval=float(os.getenv("DEPOSIT_WATCHER_POLL_SECONDS", DEFAULT_POLL_INTERVAL)),
+            batch_size=int(os.getenv("DEPOSIT_WATCHER_BATCH_SIZE", DEFAULT_BATCH_SIZE)),
+            max_concurrency=int(os.getenv("DEPOSIT_WATCHER_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)),
+            unmined_review_after=timedelta(
+                hours=float(os.getenv("DEPOSIT_WATCHER_UNMINED_HOURS", DEFAULT_UNMINED_REVIEW_HOURS))
+            )
+        )
+
+    async def start(self):
+        """Open the pooled HTTP client and start polling"""
+        self.open()
+        self._task = asyncio.create_task(self.run())
+        logger.info(f"Deposit watcher started for networks: {', '.join(self.clients)}")
+
+    def open(self):
+        """Create the pooled HTTP client and one RPC client per network"""
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(10.0),
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency * len(self.rpc_urls),
+                max_keepalive_connections=self.max_concurrency * len(self.rpc_urls)
+            )
+        )
+        self.clients = {
+            network: NetworkRPCClient(network, url, self.http, self.max_concurrency, self.block_cache_ttl)
+            for network, url in self.rpc_urls.items()
+        }
+
+    async def stop(self):
+        """Stop polling and close the HTTP client"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.http:
+            await self.http.aclose()
+            self.http = None
+
+    async def run(self):
+        while True:
+            try:
+                await self.poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Deposit watcher poll failed: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def poll_once(self) -> int:
+        """Check every network once; returns the number of deposits verified or rejected"""
+        results = await asyncio.gather(
+            *(self._check_network(network, client) for network, client in self.clients.items()),
+            return_exceptions=True
+        )
+
+        settled = 0
+        for network, result in zip(self.clients, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Deposit watcher: {network} check failed: {str(result)}")
+            else:
+                settled += result
+        return settled
+
+    async def _check_network(self, network: str, client: NetworkRPCClient) -> int:
+        deposits = await self.db.deposit_requests.find(
+            {
+                "status": "pending",
+                "metadata.deposit_type": "crypto",
+                "metadata.network": network,
+                "metadata.watcher_status": {"$nin": list(SETTLED_WATCHER_STATUSES)}
+            },
+            {"_id": 0}
+        ).sort("metadata.watcher_checked_at", 1).limit(PENDING_SCAN_LIMIT).to_list(PENDING_SCAN_LIMIT)
+
+        if not deposits:
+            return 0
+
+        # Round robin: these go to the back of the queue, whatever happens below
+        now = datetime.now(timezone.utc)
+        await self.db.deposit_requests.update_many(
+            {"id": {"$in": [deposit['id'] for deposit in deposits]}, "status": "pending"},
+            {"$set": {"metadata.watcher_checked_at": now}}
+        )
+
+        head = await client.block_number()
+        transactions = await client.get_transactions(
+            [deposit['metadata']['transaction_hash'] for deposit in deposits],
+            self.batch_size
+        )
+
+        settled = 0
+        required = NETWORK_CONFIRMATIONS.get(network, 12)
+        for deposit in deposits:
+            receipt, transaction = transactions.get(deposit['metadata']['transaction_hash'], (None, None))
+            if not receipt or not receipt.get('blockNumber'):
+                # Not mined yet, or a hash that will never be
+                if now - _parse_time(deposit['created_at']) >= self.unmined_review_after:
+                    await self._flag_for_review(deposit, "Transaction not found on-chain", 0)
+                continue
+
+            confirmations = head - int(receipt['blockNumber'], 16) + 1
+            if confirmations < required:
+                continue
+
+            if receipt.get('status') == '0x0':
+                await self._reject(deposit, "Transaction failed on-chain")
+                settled += 1
+                continue
+
+            problem = self._verify(network, deposit, receipt, transaction)
+            if problem:
+                await self._flag_for_review(deposit, problem, confirmations)
+            else:
+                await self._mark_verified(deposit, receipt, confirmations)
+                settled += 1
+
+        return settled
+
+    def _verify(self, network: str, deposit: Dict, receipt: Dict, transaction: Optional[Dict]) -> Optional[str]:
+        """Return why a deposit does not match the chain, or None if it does"""
+        from routes.web3 import PLATFORM_WALLETS
+
+        metadata = deposit['metadata']
+        if (receipt.get('from') or '').lower() != metadata['from_address'].lower():
+            return "Sender does not match submitted address"
+
+        if metadata.get('token_symbol') != NATIVE_TOKENS.get(network):
+            return "Token transfers require manual approval"
+
+        if not transaction:
+            return "Transaction details unavailable"
+
+        platform_addresses = {address.lower() for address in PLATFORM_WALLETS.get(network, {}).values()}
+        if (transaction.get('to') or '').lower() not in platform_addresses:
+            return "Recipient is not a platform wallet"
+
+        value = int(transaction.get('value') or '0x0', 16) / 10 ** NATIVE_DECIMALS
+        if value + 1e-9 < deposit['amount']:
+            return f"On-chain value {value} is below the submitted amount"
+
+        return None
+
+    async def _mark_verified(self, deposit: Dict, receipt: Dict, confirmations: int):
+        # Evidence for the admin who approves the deposit; the wallet is not touched
+        result = await self.db.deposit_requests.update_one(
+            {"id": deposit['id'], "status": "pending"},
+            {"$set": {
+                "metadata.watcher_status": "verified",
+                "metadata.watcher_note": "On-chain transfer matches the deposit; awaiting admin approval",
+                "metadata.confirmations": confirmations,
+                "metadata.block_number": int(receipt['blockNumber'], 16),
+                "metadata.block_hash": receipt.get('blockHash'),
+                "metadata.verified_at": datetime.now(timezone.utc)
+            }}
+        )
+        if result.modified_count != 1:
+            return
+
+        await log_audit(
+            self.db, None, "crypto_deposit_chain_verified",
+            {
+                "deposit_id": deposit['id'],
+                "user_id": deposit['user_id'],
+                "amount": deposit['amount'],
+                "network": deposit['metadata']['network'],
+                "tx_hash": deposit['metadata']['transaction_hash'],
+                "confirmations": confirmations
+            }
+        )
+
+    async def _reject(self, deposit: Dict, reason: str):
+        result = await self.db.deposit_requests.update_one(
+            {"id": deposit['id'], "status": "pending"},
+            {"$set": {
+                "status": "rejected",
+                "admin_note": reason,
+                "processed_at": datetime.now(timezone.utc),
+                "metadata.watcher_status": "failed"
+            }}
+        )
+        if result.modified_count != 1:
+            return
+
+        await log_audit(
+            self.db, None, "crypto_deposit_auto_rejected",
+            {
+                "deposit_id": deposit['id'],
+                "user_id": deposit['user_id'],
+                "tx_hash": deposit['metadata']['transaction_hash'],
+                "reason": reason
+            }
+        )
+
+    async def _flag_for_review(self, deposit: Dict, reason: str, confirmations: int):
+        await self.db.deposit_requests.update_one(
+            {"id": deposit['id'], "status": "pending"},
+            {"$set": {
+                "metadata.watcher_status": "needs_review",
+                "metadata.watcher_note": reason,
+                "metadata.confirmations": confirmations
+            }}
+        )
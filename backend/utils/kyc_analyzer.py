@@ -268,7 +268,7 @@ class KYCDocumentAnalyzer:
                 'document_type': doc_type,
                 'face_detection': face_info,
                 'validation_checks': validation_checks,
-                'analyzed_at': datetime.now(timezone.utc).isoformat()
+                'analyzed_at': datetime.now(timezone.utc)
             }
             
         except Exception as e:
@@ -0,0 +1,111 @@
+"""Async bcrypt hashing on a bounded worker pool
+
+bcrypt is deliberately slow (hundreds of milliseconds per call) and would
+block the event loop if called inline from a request handler. Hashing and
+verification run on a dedicated thread pool instead; bcrypt releases the
+GIL while it works, so the threads hash in parallel.
+
+Admission is bounded: once every worker is busy and the wait queue is
+full, further calls are rejected with 503 and a Retry-After header instead
+of piling up behind a login storm.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from fastapi import HTTPException, status
+
+from security import hash_password, verify_password
+
+DEFAULT_MAX_QUEUE = 64
+RETRY_AFTER_SECONDS = 1
+
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded thread pool and tracks queue metrics"""
+
+    def __init__(self, workers: int, max_queue: int = DEFAULT_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        # Guards the counters updated from worker threads
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.running = 0
+        self.peak_queue_depth = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+
+    @classmethod
+    def from_env(cls) -> "PasswordHasher":
+        default_workers = min(4, os.cpu_count() or 1)
+        return cls(
+            workers=int(os.getenv("PASSWORD_HASH_WORKERS", default_workers)),
+            max_queue=int(os.getenv("PASSWORD_HASH_MAX_QUEUE", DEFAULT_MAX_QUEUE))
+        )
+
+    @property
+    def queue_depth(self) -> int:
+        return self.in_flight - self.running
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._submit(verify_password, plain_password, hashed_password)
+
+    async def _submit(self, func: Callable, *args):
+        if self.in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication service is busy, please retry",
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+            )
+
+        self.in_flight += 1
+        self.peak_queue_depth = max(self.peak_queue_depth, self.queue_depth)
+        submitted = time.perf_counter()
+
+        def run():
+            started = time.perf_counter()
+            with self._lock:
+                self.running += 1
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.total_wait += started - submitted
+                    self.total_run += time.perf_counter() - started
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, run)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        completed = self.completed or 1
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "peak_queue_depth": self.peak_queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.total_wait / completed * 1000, 2),
+            "avg_run_ms": round(self.total_run / completed * 1000, 2)
+        }
+
+
+password_hasher = PasswordHasher.from_env()
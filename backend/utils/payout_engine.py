@@ -0,0 +1,457 @@
+"""Batched on-chain payouts for approved crypto withdrawals
+
+Approved withdrawals are grouped by network and token into batches bounded
+by size and by how long the oldest withdrawal has been waiting. Each batch
+gets a nonce from a per-network allocator, is handed to a pluggable signing
+and broadcasting backend, and its result is written back to every
+withdrawal in one update.
+
+Only withdrawals queued for automatic payout are picked up: an admin
+approving a crypto withdrawal while PAYOUT_BACKEND is set marks it
+`payout_status: "queued"`. Withdrawals approved earlier were paid by hand
+and are never touched.
+
+A send that the backend clearly rejects (`PayoutRejected`, e.g. a JSON-RPC
+error response) releases the nonce and puts the withdrawals back in the
+queue. Any other failure, such as a timeout or a reset connection, may
+have happened after the node accepted the transaction: the batch stays
+`building` with its nonce and is left to recovery.
+
+Nonces are leased to a batch id in the same update that allocates them,
+and the lease is settled once the batch is recorded.
+
+Crash recovery, at the start of every run:
+- a batch still `building` after PAYOUT_STALE_BATCH_SECONDS is re-sent with
+  the same transfers and nonce. The nonce makes the resend idempotent (a
+  backend must never pay twice for one nonce). If the resend fails, the
+  batch and its withdrawals are set to `needs_review` for an admin, since
+  the first attempt may already be on-chain.
+- withdrawals claimed by a batch that was never recorded (the process died
+  between claiming and inserting the batch) were never sent and go back to
+  the queue; a nonce still leased to such a batch is released, so later
+  transactions are not stuck behind a nonce gap.
+"""
+import asyncio
+import hashlib
+import importlib
+import logging
+import os
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from middleware import log_audit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH_SIZE = 100
+DEFAULT_BATCH_WINDOW = 300  # seconds
+DEFAULT_POLL_INTERVAL = 30
+DEFAULT_STALE_BATCH_AFTER = 600  # seconds; must exceed the backend's send timeout
+SCAN_LIMIT = 5000
+
+# withdrawal_requests.payout_status
+PAYOUT_QUEUED = "queued"
+PAYOUT_BATCHED = "batched"
+PAYOUT_BROADCAST = "broadcast"
+PAYOUT_NEEDS_REVIEW = "needs_review"
+
+
+class PayoutRejected(Exception):
+    """The backend refused the batch and nothing was broadcast"""
+
+
+class PayoutBackend:
+    """Signs and broadcasts one batched payout transaction
+
+    Sending the same transfers again with the same nonce must not pay twice
+    (crash recovery relies on it); on EVM chains the nonce guarantees this.
+    Raise `PayoutRejected` only when the transaction certainly was not
+    accepted; any other exception is treated as possibly broadcast.
+    """
+
+    async def send_batch(self, network: str, token_symbol: str, transfers: List[Dict], nonce: int) -> str:
+        """Broadcast the transfers and return the transaction hash"""
+        raise NotImplementedError
+
+
+class FakePayoutBackend(PayoutBackend):
+    """Local backend that records batches and returns deterministic hashes"""
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.sent: List[Dict] = []
+        self._by_nonce: Dict[tuple, str] = {}
+
+    async def send_batch(self, network: str, token_symbol: str, transfers: List[Dict], nonce: int) -> str:
+        if self.fail:
+            raise PayoutRejected("Fake payout backend configured to fail")
+
+        # A nonce is spent once, like on-chain: a resend returns the first hash
+        if (network, nonce) in self._by_nonce:
+            return self._by_nonce[(network, nonce)]
+
+        self.sent.append({
+            "network": network,
+            "token_symbol": token_symbol,
+            "transfers": transfers,
+            "nonce": nonce
+        })
+        digest = hashlib.sha256(
+            f"{network}:{token_symbol}:{nonce}:{','.join(t['withdrawal_id'] for t in transfers)}".encode()
+        ).hexdigest()
+        self._by_nonce[(network, nonce)] = f"0x{digest}"
+        return f"0x{digest}"
+
+
+def automatic_payouts_enabled() -> bool:
+    """Whether approved crypto withdrawals are queued for the payout engine"""
+    return bool(os.getenv("PAYOUT_BACKEND"))
+
+
+PAYOUT_BACKENDS = {
+    "fake": FakePayoutBackend
+}
+
+
+def load_payout_backend(name: str) -> PayoutBackend:
+    """Resolve a backend by registered name or `module:ClassName` path"""
+    if name in PAYOUT_BACKENDS:
+        return PAYOUT_BACKENDS[name]()
+
+    module_name, _, class_name = name.partition(":")
+    if not class_name:
+        raise ValueError(f"Unknown payout backend: {name}")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def _parse_time(value) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class PayoutEngine:
+    """Groups approved crypto withdrawals into batched payouts"""
+
+    def __init__(
+        self,
+        db,
+        backend: PayoutBackend,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        batch_window: float = DEFAULT_BATCH_WINDOW,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        stale_batch_after: float = DEFAULT_STALE_BATCH_AFTER
+    ):
+        self.db = db
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.poll_interval = poll_interval
+        self.stale_batch_after = stale_batch_after
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, db) -> Optional["PayoutEngine"]:
+        """Build an engine when PAYOUT_BACKEND is set, otherwise None"""
+        backend_name = os.getenv("PAYOUT_BACKEND")
+        if not backend_name:
+            return None
+
+        return cls(
+            db,
+            load_payout_backend(backend_name),
+            max_batch_size=int(os.getenv("PAYOUT_MAX_BATCH_SIZE", DEFAULT_MAX_BATCH_SIZE)),
+            batch_window=float(os.getenv("PAYOUT_BATCH_WINDOW_SECONDS", DEFAULT_BATCH_WINDOW)),
+            poll_interval=float(os.getenv("PAYOUT_POLL_SECONDS", DEFAULT_POLL_INTERVAL)),
+            stale_batch_after=float(os.getenv("PAYOUT_STALE_BATCH_SECONDS", DEFAULT_STALE_BATCH_AFTER))
+        )
+
+    async def start(self):
+        self._task = asyncio.create_task(self.run())
+        logger.info(f"Payout engine started with {type(self.backend).__name__}")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Payout engine run failed: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def run_once(self, now: Optional[datetime] = None) -> int:
+        """Send every batch that is full or whose window has elapsed; returns batches sent"""
+        now = now or datetime.now(timezone.utc)
+        await self.recover(now)
+
+        withdrawals = await self.db.withdrawal_requests.find(
+            {
+                "status": "approved",
+                "metadata.withdrawal_type": "crypto",
+                "payout_status": PAYOUT_QUEUED
+            },
+            {"_id": 0, "id": 1, "amount": 1, "withdrawal_address": 1, "processed_at": 1, "metadata": 1}
+        ).sort("processed_at", 1).limit(SCAN_LIMIT).to_list(SCAN_LIMIT)
+
+        groups = defaultdict(list)
+        for withdrawal in withdrawals:
+            metadata = withdrawal.get('metadata', {})
+            groups[(metadata.get('network'), metadata.get('token_symbol'))].append(withdrawal)
+
+        sent = 0
+        for (network, token_symbol), items in groups.items():
+            oldest = _parse_time(items[0]['processed_at']) if items[0].get('processed_at') else now
+            window_elapsed = (now - oldest).total_seconds() >= self.batch_window
+
+            for start in range(0, len(items), self.max_batch_size):
+                chunk = items[start:start + self.max_batch_size]
+                if len(chunk) < self.max_batch_size and not window_elapsed:
+                    break
+                if await self._send_batch(network, token_symbol, chunk):
+                    sent += 1
+
+        return sent
+
+    async def _allocate_nonce(self, network: str, batch_id: str) -> int:
+        """
+        Reuse the lowest released nonce, otherwise take the next one. The
+        nonce is leased to `batch_id` in the same update that allocates it.
+        """
+        while True:
+            state = await self.db.payout_nonces.find_one({"_id": network})
+            lease = {"batch_id": batch_id, "at": datetime.now(timezone.utc)}
+
+            if not state:
+                try:
+                    await self.db.payout_nonces.insert_one(
+                        {"_id": network, "next_nonce": 1, "released": [], "leases": {"0": lease}}
+                    )
+                    return 0
+                except DuplicateKeyError:
+                    continue
+
+            if state.get('released'):
+                nonce = state['released'][0]
+                result = await self.db.payout_nonces.update_one(
+                    {"_id": network, "released.0": nonce},
+                    {"$pop": {"released": -1}, "$set": {f"leases.{nonce}": lease}}
+                )
+            else:
+                nonce = state['next_nonce']
+                result = await self.db.payout_nonces.update_one(
+                    {"_id": network, "next_nonce": nonce},
+                    {"$set": {"next_nonce": nonce + 1, f"leases.{nonce}": lease}}
+                )
+            # Another engine allocated in between: read the state again
+            if result.modified_count == 1:
+                return nonce
+
+    async def _settle_nonce(self, network: str, nonce: int):
+        """The batch holding the nonce is recorded: drop the lease"""
+        await self.db.payout_nonces.update_one({"_id": network}, {"$unset": {f"leases.{nonce}": ""}})
+
+    async def _release_nonce(self, network: str, nonce: int, batch_id: Optional[str] = None) -> bool:
+        """Make the nonce available again (only if still leased to `batch_id`, when given)"""
+        query = {"_id": network}
+        if batch_id:
+            query[f"leases.{nonce}.batch_id"] = batch_id
+        result = await self.db.payout_nonces.update_one(
+            query,
+            {
+                "$push": {"released": {"$each": [nonce], "$sort": 1}},
+                "$unset": {f"leases.{nonce}": ""}
+            }
+        )
+        return result.modified_count == 1
+
+    async def _send_batch(self, network: str, token_symbol: str, withdrawals: List[Dict]) -> bool:
+        batch_id = str(uuid.uuid4())
+        now = datetime.now(timezone.utc)
+
+        # Claim the withdrawals so concurrent engines cannot pay them twice
+        await self.db.withdrawal_requests.update_many(
+            {
+                "id": {"$in": [w['id'] for w in withdrawals]},
+                "status": "approved",
+                "payout_status": PAYOUT_QUEUED
+            },
+            {"$set": {"payout_batch_id": batch_id, "payout_status": PAYOUT_BATCHED, "updated_at": now}}
+        )
+        claimed = await self.db.withdrawal_requests.find(
+            {"payout_batch_id": batch_id},
+            {"_id": 0, "id": 1, "amount": 1, "withdrawal_address": 1}
+        ).to_list(len(withdrawals))
+        if not claimed:
+            return False
+
+        transfers = [
+            {"withdrawal_id": w['id'], "to_address": w['withdrawal_address'], "amount": w['amount']}
+            for w in claimed
+        ]
+        nonce = await self._allocate_nonce(network, batch_id)
+
+        batch_doc = {
+            "id": batch_id,
+            "network": network,
+            "token_symbol": token_symbol,
+            "withdrawal_ids": [t['withdrawal_id'] for t in transfers],
+            "transfers": transfers,
+            "transfer_count": len(transfers),
+            "total_amount": sum(t['amount'] for t in transfers),
+            "nonce": nonce,
+            "status": "building",
+            "tx_hash": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now
+        }
+        await self.db.payout_batches.insert_one(batch_doc)
+        await self._settle_nonce(network, nonce)
+
+        try:
+            tx_hash = await self.backend.send_batch(network, token_symbol, transfers, nonce)
+        except PayoutRejected as e:
+            logger.error(f"Payout batch {batch_id} rejected: {str(e)}")
+            await self._release_nonce(network, nonce)
+            await self.db.payout_batches.update_one(
+                {"id": batch_id},
+                {"$set": {"status": "failed", "error": str(e), "updated_at": datetime.now(timezone.utc)}}
+            )
+            # Hand the withdrawals back to the queue for the next run
+            await self._requeue({"payout_batch_id": batch_id})
+            return False
+        except Exception as e:
+            # The node may have accepted it: keep the batch and its nonce, so
+            # recovery re-sends the same nonce once the batch is stale
+            logger.error(f"Payout batch {batch_id} outcome unknown, left for recovery: {str(e)}")
+            await self.db.payout_batches.update_one(
+                {"id": batch_id},
+                {"$set": {"error": str(e), "updated_at": datetime.now(timezone.utc)}}
+            )
+            return False
+
+        await self._mark_broadcast(batch_doc, tx_hash)
+        return True
+
+    async def _requeue(self, query: Dict):
+        await self.db.withdrawal_requests.update_many(
+            {**query, "payout_status": PAYOUT_BATCHED},
+            {
+                "$set": {"payout_status": PAYOUT_QUEUED, "updated_at": datetime.now(timezone.utc)},
+                "$unset": {"payout_batch_id": ""}
+            }
+        )
+
+    async def _mark_broadcast(self, batch: Dict, tx_hash: str, recovered: bool = False):
+        done_at = datetime.now(timezone.utc)
+        await self.db.payout_batches.update_one(
+            {"id": batch['id']},
+            {"$set": {"status": "broadcast", "tx_hash": tx_hash, "updated_at": done_at}}
+        )
+        await self.db.withdrawal_requests.update_many(
+            {"payout_batch_id": batch['id']},
+            {"$set": {"payout_status": PAYOUT_BROADCAST, "payout_tx_hash": tx_hash, "updated_at": done_at}}
+        )
+
+        await log_audit(
+            self.db, None, "payout_batch_broadcast",
+            {
+                "batch_id": batch['id'],
+                "network": batch['network'],
+                "token": batch['token_symbol'],
+                "nonce": batch['nonce'],
+                "transfer_count": batch['transfer_count'],
+                "tx_hash": tx_hash,
+                "recovered": recovered
+            },
+            critical=True
+        )
+
+    async def recover(self, now: Optional[datetime] = None) -> int:
+        """Finish or hand back work left by a crashed run; returns batches and claims handled"""
+        now = now or datetime.now(timezone.utc)
+        cutoff = now - timedelta(seconds=self.stale_batch_after)
+        handled = 0
+
+        while True:
+            # Lease the batch, so only one engine resends it
+            batch = await self.db.payout_batches.find_one_and_update(
+                {"status": "building", "updated_at": {"$lt": cutoff}},
+                {"$set": {"updated_at": now}, "$inc": {"attempts": 1}},
+                return_document=ReturnDocument.AFTER
+            )
+            if not batch:
+                break
+            await self._resume_batch(batch)
+            handled += 1
+
+        # Claims whose batch was never inserted: nothing was sent for them
+        claimed_ids = await self.db.withdrawal_requests.distinct(
+            "payout_batch_id",
+            {"status": "approved", "payout_status": PAYOUT_BATCHED, "updated_at": {"$lt": cutoff}}
+        )
+        for batch_id in claimed_ids:
+            if not await self.db.payout_batches.find_one({"id": batch_id}, {"_id": 1}):
+                logger.warning(f"Payout engine: returning withdrawals of unrecorded batch {batch_id} to the queue")
+                await self._requeue({"payout_batch_id": batch_id})
+                handled += 1
+
+        # Nonces leased to a batch that was never recorded were never used
+        nonce_states = await self.db.payout_nonces.find(
+            {"leases": {"$exists": True, "$ne": {}}}, {"leases": 1}
+        ).to_list(None)
+        for state in nonce_states:
+            for nonce, lease in state['leases'].items():
+                if _parse_time(lease['at']) >= cutoff:
+                    continue
+                if await self.db.payout_batches.find_one({"id": lease['batch_id']}, {"_id": 1}):
+                    await self._settle_nonce(state['_id'], int(nonce))
+                elif await self._release_nonce(state['_id'], int(nonce), lease['batch_id']):
+                    logger.warning(f"Payout engine: released nonce {nonce} on {state['_id']} of unrecorded batch {lease['batch_id']}")
+                    handled += 1
+
+        return handled
+
+    async def _resume_batch(self, batch: Dict):
+        logger.warning(f"Payout engine: resending stale batch {batch['id']} with nonce {batch['nonce']}")
+        try:
+            tx_hash = await self.backend.send_batch(
+                batch['network'], batch['token_symbol'], batch['transfers'], batch['nonce']
+            )
+        except Exception as e:
+            # The first attempt may be on-chain already: never re-queue these
+            logger.error(f"Payout batch {batch['id']} could not be resumed: {str(e)}")
+            reviewed_at = datetime.now(timezone.utc)
+            await self.db.payout_batches.update_one(
+                {"id": batch['id']},
+                {"$set": {"status": PAYOUT_NEEDS_REVIEW, "error": str(e), "updated_at": reviewed_at}}
+            )
+            await self.db.withdrawal_requests.update_many(
+                {"payout_batch_id": batch['id']},
+                {"$set": {"payout_status": PAYOUT_NEEDS_REVIEW, "updated_at": reviewed_at}}
+            )
+            await log_audit(
+                self.db, None, "payout_batch_needs_review",
+                {"batch_id": batch['id'], "network": batch['network'], "nonce": batch['nonce'], "error": str(e)},
+                critical=True
+            )
+            return
+
+        await self._mark_broadcast(batch, tx_hash, recovered=True)
@@ -0,0 +1,102 @@
+"""API permission registry compiled into bitsets
+
+Every permission declared in `api_permissions` gets a bit the first time a
+load sees it; names a token holds that are not declared get none. Bits are
+never reassigned while the process runs, so masks computed for cached API
+keys stay valid across reloads, and `generation` moves on whenever new bits
+appear so those masks are recompiled once. Deactivated or deleted
+permissions are simply missing from `active_mask`. A check is then one
+AND: `mask & required & active_mask == required`.
+
+The registry also keeps the permission documents, so listing them does
+not go back to Mongo. It is reloaded after every permission change on this
+worker and at most `ttl` seconds after a change made by another worker.
+"""
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 60  # seconds
+
+
+class PermissionRegistry:
+    """In-process view of `api_permissions` with stable bit assignments"""
+
+    def __init__(self, ttl: float = DEFAULT_TTL):
+        self.ttl = ttl
+        self.bits: Dict[str, int] = {}
+        self.active_mask = 0
+        self.generation = 0
+        self.documents: List[Dict] = []
+        self._loaded_at: Optional[float] = None
+        self.reloads = 0
+
+    def _bit(self, name: str) -> int:
+        bit = self.bits.get(name)
+        if bit is None:
+            bit = self.bits[name] = 1 << len(self.bits)
+        return bit
+
+    async def load(self, db):
+        documents = await db.api_permissions.find({}, {"_id": 0}).sort("category", 1).to_list(None)
+
+        assigned = len(self.bits)
+        active_mask = 0
+        for doc in documents:
+            bit = self._bit(doc['name'])
+            if doc.get('is_active', True):
+                active_mask |= bit
+
+        if len(self.bits) != assigned:
+            self.generation += 1
+        self.documents = documents
+        self.active_mask = active_mask
+        self._loaded_at = time.monotonic()
+        self.reloads += 1
+
+    async def ensure_fresh(self, db):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl:
+            try:
+                await self.load(db)
+            except Exception as e:
+                if self._loaded_at is None:
+                    raise
+                logger.warning(f"Permission registry reload failed, serving cached copy: {str(e)}")
+
+    def mask(self, permissions: Iterable[str]) -> int:
+        """Compile permission names into a bitset, ignoring undeclared names"""
+        result = 0
+        for name in permissions:
+            result |= self.bits.get(name, 0)
+        return result
+
+    def principal_mask(self, principal: Dict) -> int:
+        """Mask of a cached API key principal, recompiled if bits were added since"""
+        if principal.get('permission_generation') != self.generation:
+            principal['permission_mask'] = self.mask(principal['permissions'])
+            principal['permission_generation'] = self.generation
+        return principal['permission_mask']
+
+    def allows(self, mask: int, permission: str) -> bool:
+        required = self.bits.get(permission, 0)
+        return required != 0 and mask & required & self.active_mask == required
+
+    def list(self, category: Optional[str] = None, is_active: Optional[bool] = None) -> List[Dict]:
+        return [
+            doc for doc in self.documents
+            if (category is None or doc.get('category') == category)
+            and (is_active is None or doc.get('is_active', True) == is_active)
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "permissions": len(self.documents),
+            "bits_assigned": len(self.bits),
+            "reloads": self.reloads
+        }
+
+
+permission_registry = PermissionRegistry(float(os.getenv("PERMISSION_REGISTRY_TTL", DEFAULT_TTL)))
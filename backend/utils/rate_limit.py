@@ -0,0 +1,220 @@
+"""Rate limiting algorithms and storage backends
+
+Two algorithms are available on every backend:
+- sliding window log: at most `limit` allowed hits in any `window` seconds.
+  Rejected hits are not logged, so a client that keeps retrying is let
+  back in as soon as its oldest allowed hit leaves the window.
+- token bucket: bursts up to `capacity`, refilled at `refill_rate` per second
+
+A fixed window counter is also provided for long windows such as daily quotas.
+
+`MemoryRateLimitBackend` keeps state in a bounded LRU/TTL store inside the
+worker. `MongoRateLimitBackend` keeps it in one document per key, updated
+atomically, so every worker shares the same limits.
+"""
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, NamedTuple, Optional
+
+from pymongo import ReturnDocument
+
+DEFAULT_MAX_KEYS = 100_000
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    remaining: int
+    retry_after: float  # seconds until the next hit would be allowed
+
+
+class BoundedTTLStore:
+    """LRU dictionary whose entries also expire after a per-entry TTL"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_KEYS):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str, now: Optional[float] = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+
+        value, expires_at = entry
+        if expires_at <= (now if now is not None else time.monotonic()):
+            del self._data[key]
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float, now: Optional[float] = None):
+        now = now if now is not None else time.monotonic()
+        self._data[key] = (value, now + ttl)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        self._data.pop(key, None)
+
+
+class MemoryRateLimitBackend:
+    """Per-worker rate limits held in a bounded store"""
+
+    def __init__(self, max_keys: int = DEFAULT_MAX_KEYS):
+        self.store = BoundedTTLStore(max_keys)
+
+    async def sliding_window(self, key: str, limit: int, window: float) -> RateLimitResult:
+        now = time.monotonic()
+        log = self.store.get(key, now)
+        if log is None:
+            log = deque()
+
+        while log and log[0] <= now - window:
+            log.popleft()
+
+        if len(log) >= limit:
+            self.store.set(key, log, window, now)
+            return RateLimitResult(False, 0, log[0] + window - now)
+
+        log.append(now)
+        self.store.set(key, log, window, now)
+        return RateLimitResult(True, limit - len(log), 0.0)
+
+    async def token_bucket(self, key: str, capacity: int, refill_rate: float) -> RateLimitResult:
+        now = time.monotonic()
+        state = self.store.get(key, now)
+        tokens, updated = state if state else (float(capacity), now)
+
+        tokens = min(float(capacity), tokens + (now - updated) * refill_rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+
+        self.store.set(key, (tokens, now), capacity / refill_rate, now)
+        retry_after = 0.0 if allowed else (1 - tokens) / refill_rate
+        return RateLimitResult(allowed, int(tokens), retry_after)
+
+    async def fixed_window(self, key: str, limit: int, window: float) -> RateLimitResult:
+        now = time.time()
+        window_index = int(now // window)
+        window_key = f"{key}:{window_index}"
+
+        count = (self.store.get(window_key) or 0) + 1
+        self.store.set(window_key, count, window)
+
+        if count > limit:
+            return RateLimitResult(False, 0, (window_index + 1) * window - now)
+        return RateLimitResult(True, limit - count, 0.0)
+
+
+class MongoRateLimitBackend:
+    """Rate limits shared by all workers through atomic updates on Mongo"""
+
+    def __init__(self, db, collection: str = "rate_limits"):
+        self.collection = db[collection]
+
+    async def sliding_window(self, key: str, limit: int, window: float) -> RateLimitResult:
+        # Same log as the memory backend: one server-clock timestamp (ms) per
+        # allowed hit, trimmed to the window, so the array never exceeds `limit`
+        now_ms = {"$toLong": "$$NOW"}
+        window_ms = int(window * 1000)
+        doc = await self.collection.find_one_and_update(
+            {"_id": f"sw:{key}"},
+            [
+                {"$set": {
+                    "log": {"$filter": {
+                        "input": {"$ifNull": ["$log", []]},
+                        "cond": {"$gt": ["$$this", {"$subtract": [now_ms, window_ms]}]}
+                    }},
+                    "now_ms": now_ms
+                }},
+                {"$set": {"allowed": {"$lt": [{"$size": "$log"}, limit]}}},
+                {"$set": {
+                    "log": {"$cond": ["$allowed", {"$concatArrays": ["$log", ["$now_ms"]]}, "$log"]},
+                    "expires_at": {"$add": ["$$NOW", window_ms]}
+                }}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+        if doc['allowed']:
+            return RateLimitResult(True, limit - len(doc['log']), 0.0)
+        return RateLimitResult(False, 0, (doc['log'][0] + window_ms - doc['now_ms']) / 1000)
+
+    async def token_bucket(self, key: str, capacity: int, refill_rate: float) -> RateLimitResult:
+        now_ms = {"$toLong": "$$NOW"}
+        doc = await self.collection.find_one_and_update(
+            {"_id": f"tb:{key}"},
+            [
+                {"$set": {
+                    "tokens": {"$min": [
+                        float(capacity),
+                        {"$add": [
+                            {"$ifNull": ["$tokens", float(capacity)]},
+                            {"$multiply": [
+                                {"$subtract": [now_ms, {"$ifNull": ["$updated_ms", now_ms]}]},
+                                refill_rate / 1000
+                            ]}
+                        ]}
+                    ]},
+                    "updated_ms": now_ms,
+                    "expires_at": {"$add": ["$$NOW", int(capacity / refill_rate * 1000) + 1000]}
+                }},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", 1]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]}
+                }}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+        if doc['allowed']:
+            return RateLimitResult(True, int(doc['tokens']), 0.0)
+        return RateLimitResult(False, 0, (1 - doc['tokens']) / refill_rate)
+
+    async def fixed_window(self, key: str, limit: int, window: float) -> RateLimitResult:
+        now = time.time()
+        window_index = int(now // window)
+        window_end = (window_index + 1) * window
+
+        doc = await self.collection.find_one_and_update(
+            {"_id": f"fw:{key}:{window_index}"},
+            [
+                {"$set": {
+                    "count": {"$add": [{"$ifNull": ["$count", 0]}, 1]},
+                    "expires_at": {"$add": ["$$NOW", int((window_end - now) * 1000) + 1000]}
+                }}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+        if doc['count'] > limit:
+            return RateLimitResult(False, 0, window_end - now)
+        return RateLimitResult(True, limit - doc['count'], 0.0)
+
+
+def create_rate_limit_backend():
+    """Build the backend selected by RATE_LIMIT_BACKEND (memory or mongo)"""
+    backend = os.getenv("RATE_LIMIT_BACKEND", "memory")
+
+    if backend == "mongo":
+        from database import db
+        return MongoRateLimitBackend(db)
+    if backend == "memory":
+        return MemoryRateLimitBackend(int(os.getenv("RATE_LIMIT_MAX_KEYS", DEFAULT_MAX_KEYS)))
+
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
+
+
+def retry_after_header(result: RateLimitResult) -> str:
+    return str(max(1, math.ceil(result.retry_after)))
@@ -0,0 +1,72 @@
+"""Timestamp storage codec
+
+Timestamps (`created_at`, `updated_at`, `reviewed_at`, `processed_at`,
+`timestamp`, ...) are stored as native BSON dates. Clients are opened with
+`CLIENT_OPTIONS`, so every date comes back as a timezone-aware UTC
+`datetime`. FastAPI still renders those as ISO 8601 strings in responses.
+
+Documents written before the switch hold ISO strings until
+`migrate_timestamps.py` has converted them. Until then, readers go through
+`parse_timestamp` and `timestamp_range`, which accept both forms.
+"""
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+# Keyword arguments for every Mongo client: decode dates as aware UTC datetimes
+CLIENT_OPTIONS = {"tz_aware": True, "tzinfo": timezone.utc}
+
+# Top-level fields converted by the migration
+TIMESTAMP_FIELDS = (
+    "created_at",
+    "updated_at",
+    "reviewed_at",
+    "processed_at",
+    "timestamp",
+    "last_login",
+    "last_used_at",
+    "expires_at",
+    "completed_at",
+    "unstaked_at",
+    "locked_until",
+)
+
+
+def parse_timestamp(value) -> Optional[datetime]:
+    """A stored timestamp (datetime or legacy ISO string) as an aware UTC datetime"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def timestamp_range(field: str, since=None, until=None) -> Dict:
+    """Range filter on a timestamp field matching both native and ISO-string values"""
+    since = parse_timestamp(since)
+    until = parse_timestamp(until)
+
+    native, legacy = {}, {}
+    if since:
+        native["$gte"] = since
+        legacy["$gte"] = since.isoformat()
+    if until:
+        native["$lte"] = until
+        legacy["$lte"] = until.isoformat()
+    if not native:
+        return {}
+    return {"$or": [{field: native}, {field: legacy}]}
+
+
+def encode_timestamps(doc: Dict) -> Dict:
+    """$set fields converting a document's ISO-string timestamps to datetimes"""
+    converted = {}
+    for field in TIMESTAMP_FIELDS:
+        value = doc.get(field)
+        if isinstance(value, str) and value:
+            try:
+                converted[field] = parse_timestamp(value)
+            except ValueError:
+                continue
+    return converted
@@ -0,0 +1,169 @@
+"""JWT revocation list with a per-worker Bloom filter
+
+Revoked token ids (`jti`) are stored in `revoked_tokens` until the token
+would have expired anyway. Every worker mirrors them in an in-memory Bloom
+filter, so checking a token that was never revoked needs no database
+lookup. Only Bloom filter hits are confirmed against the store.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CAPACITY = 100_000
+DEFAULT_ERROR_RATE = 0.001
+DEFAULT_SYNC_INTERVAL = 5  # seconds
+DEFAULT_REBUILD_INTERVAL = 3600  # seconds
+# Re-read a little before the last watermark to absorb clock skew between workers
+SYNC_OVERLAP = timedelta(seconds=10)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings"""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, error_rate: float = DEFAULT_ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class TokenRevocationList:
+    """Revocation store backed by Mongo with a Bloom filter fast path"""
+
+    def __init__(
+        self,
+        capacity: int = DEFAULT_CAPACITY,
+        error_rate: float = DEFAULT_ERROR_RATE,
+        sync_interval: float = DEFAULT_SYNC_INTERVAL,
+        rebuild_interval: float = DEFAULT_REBUILD_INTERVAL
+    ):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self.bloom = BloomFilter(capacity, error_rate)
+        self._watermark: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self.lookups = 0
+        self.bloom_hits = 0
+        self.false_positives = 0
+
+    async def load(self, db):
+        """Rebuild the Bloom filter from every revocation that has not expired"""
+        now = datetime.now(timezone.utc)
+        live = await db.revoked_tokens.count_documents({"expires_at": {"$gt": now}})
+
+        # Grow the filter if revocations outnumber the configured capacity
+        bloom = BloomFilter(max(self.capacity, live * 2), self.error_rate)
+        watermark = None
+        async for doc in db.revoked_tokens.find({"expires_at": {"$gt": now}}, {"_id": 0, "jti": 1, "revoked_at": 1}):
+            bloom.add(doc['jti'])
+            watermark = self._later(watermark, doc.get('revoked_at'))
+
+        self.bloom = bloom
+        self._watermark = watermark or now
+
+    async def sync(self, db):
+        """Pick up revocations written by other workers"""
+        since = (self._watermark or datetime.now(timezone.utc)) - SYNC_OVERLAP
+        async for doc in db.revoked_tokens.find({"revoked_at": {"$gt": since}}, {"_id": 0, "jti": 1, "revoked_at": 1}):
+            if doc['jti'] not in self.bloom:
+                self.bloom.add(doc['jti'])
+            self._watermark = self._later(self._watermark, doc.get('revoked_at'))
+
+    async def revoke(self, db, jti: str, expires_at: datetime, subject: Optional[str] = None, reason: Optional[str] = None):
+        """Revoke a token id until its natural expiry"""
+        await db.revoked_tokens.update_one(
+            {"jti": jti},
+            {"$setOnInsert": {
+                "jti": jti,
+                "sub": subject,
+                "reason": reason,
+                "expires_at": expires_at,
+                "revoked_at": datetime.now(timezone.utc)
+            }},
+            upsert=True
+        )
+        self.bloom.add(jti)
+
+    async def is_revoked(self, db, jti: str) -> bool:
+        self.lookups += 1
+        if jti not in self.bloom:
+            return False
+
+        self.bloom_hits += 1
+        if await db.revoked_tokens.find_one({"jti": jti}, {"_id": 1}):
+            return True
+
+        self.false_positives += 1
+        return False
+
+    async def start(self, db):
+        await self.load(db)
+        self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, db):
+        loop = asyncio.get_running_loop()
+        last_rebuild = loop.time()
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                # Bloom filters cannot forget: rebuild to drop expired entries
+                if loop.time() - last_rebuild >= self.rebuild_interval:
+                    await self.load(db)
+                    last_rebuild = loop.time()
+                else:
+                    await self.sync(db)
+            except Exception as e:
+                logger.warning(f"Token revocation sync failed: {str(e)}")
+
+    def stats(self) -> dict:
+        return {
+            "entries": self.bloom.count,
+            "bloom_bits": self.bloom.size,
+            "lookups": self.lookups,
+            "bloom_hits": self.bloom_hits,
+            "false_positives": self.false_positives
+        }
+
+    @staticmethod
+    def _later(current: Optional[datetime], candidate) -> Optional[datetime]:
+        if not isinstance(candidate, datetime):
+            return current
+        if candidate.tzinfo is None:
+            candidate = candidate.replace(tzinfo=timezone.utc)
+        return candidate if current is None or candidate > current else current
+
+
+revocation_list = TokenRevocationList()
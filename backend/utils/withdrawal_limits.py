@@ -0,0 +1,70 @@
+"""Per-user daily withdrawal counters
+
+One document per user per UTC day holds the running total of pending and
+approved withdrawals. Reserving an amount is a single conditional upsert on
+the `_id`, so the limit check is atomic and needs no aggregation.
+"""
+from datetime import datetime, timezone, timedelta
+from typing import Optional, Tuple
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# Counters are kept one extra day so late rejections can still be released
+COUNTER_RETENTION = timedelta(days=2)
+
+
+def _day_start(moment: Optional[datetime] = None) -> datetime:
+    moment = moment or datetime.now(timezone.utc)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _counter_id(user_id: str, day: datetime) -> str:
+    return f"{user_id}:{day.date().isoformat()}"
+
+
+async def reserve_daily_withdrawal(db, user_id: str, amount: float, daily_limit: float) -> Tuple[bool, float]:
+    """
+    Atomically add `amount` to today's withdrawal total if it stays within the limit.
+    Returns (reserved, today's total before this withdrawal).
+    """
+    day = _day_start()
+    counter_id = _counter_id(user_id, day)
+
+    if amount > daily_limit:
+        counter = await db.withdrawal_daily_counters.find_one({"_id": counter_id}, {"total": 1})
+        return False, counter['total'] if counter else 0.0
+
+    try:
+        counter = await db.withdrawal_daily_counters.find_one_and_update(
+            {"_id": counter_id, "total": {"$lte": daily_limit - amount}},
+            {
+                "$inc": {"total": amount, "count": 1},
+                "$setOnInsert": {
+                    "user_id": user_id,
+                    "day": day.date().isoformat(),
+                    "expires_at": day + COUNTER_RETENTION
+                }
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # The counter exists but the condition failed: limit would be exceeded
+        counter = await db.withdrawal_daily_counters.find_one({"_id": counter_id}, {"total": 1})
+        return False, counter['total'] if counter else 0.0
+
+    return True, counter['total'] - amount
+
+
+async def release_daily_withdrawal(db, user_id: str, amount: float, created_at) -> None:
+    """Give back a reserved amount, e.g. when the withdrawal is rejected"""
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    day = _day_start(created_at)
+
+    await db.withdrawal_daily_counters.update_one(
+        {"_id": _counter_id(user_id, day)},
+        {"$inc": {"total": -amount, "count": -1}}
+    )
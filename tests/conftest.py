@@ -0,0 +1,53 @@
+"""
+Shared test fixtures
+
+The backend modules are imported directly from backend/. Tests that need
+a database get `mongo_db`: a throwaway database on the MongoDB server at
+TEST_MONGO_URL (default mongodb://localhost:27017), dropped afterwards.
+They are skipped when no server answers. test_read_routing.py also needs
+a replica set at TEST_MONGO_REPLSET_URL.
+
+Async tests use the anyio pytest plugin (`pytest.mark.anyio`) on asyncio.
+"""
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+TEST_MONGO_URL = os.getenv("TEST_MONGO_URL", "mongodb://localhost:27017")
+
+# database.py builds its client at import time (it does not connect until used)
+os.environ.setdefault("MONGO_URL", TEST_MONGO_URL)
+os.environ.setdefault("DB_NAME", "trading_test")
+
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+from utils.timestamps import CLIENT_OPTIONS  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def mongo_db():
+    client = AsyncIOMotorClient(TEST_MONGO_URL, serverSelectionTimeoutMS=1000, **CLIENT_OPTIONS)
+    try:
+        await client.admin.command("ping")
+    except PyMongoError:
+        client.close()
+        pytest.skip(f"No MongoDB server at {TEST_MONGO_URL}")
+
+    db = client[f"test_{uuid.uuid4().hex[:12]}"]
+    try:
+        yield db
+    finally:
+        await client.drop_database(db.name)
+        client.close()
@@ -0,0 +1,101 @@
+"""
+Local stub of an Ethereum JSON-RPC endpoint
+
+Serves eth_blockNumber, eth_getTransactionReceipt and
+eth_getTransactionByHash (single and batch requests) from in-memory
+dictionaries over real HTTP, so the deposit watcher runs its normal
+httpx code path against it.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+
+class JSONRPCStub:
+    def __init__(self):
+        self.block_number = 0
+        self.receipts: Dict[str, Dict] = {}
+        self.transactions: Dict[str, Dict] = {}
+        self.http_requests = 0
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def add_transaction(
+        self,
+        tx_hash: str,
+        block_number: int,
+        sender: str,
+        to: str,
+        value_wei: int,
+        status: str = "0x1",
+        block_hash: Optional[str] = None
+    ):
+        self.receipts[tx_hash] = {
+            "transactionHash": tx_hash,
+            "blockNumber": hex(block_number),
+            "blockHash": block_hash or "0x" + f"{block_number:064x}",
+            "from": sender,
+            "to": to,
+            "status": status
+        }
+        self.transactions[tx_hash] = {
+            "hash": tx_hash,
+            "blockNumber": hex(block_number),
+            "from": sender,
+            "to": to,
+            "value": hex(value_wei)
+        }
+
+    def drop_transaction(self, tx_hash: str):
+        """Forget a transaction, as after a reorg that removed its block"""
+        self.receipts.pop(tx_hash, None)
+        self.transactions.pop(tx_hash, None)
+
+    def handle(self, call: Dict) -> Dict:
+        method, params = call.get("method"), call.get("params") or []
+        if method == "eth_blockNumber":
+            result = hex(self.block_number)
+        elif method == "eth_getTransactionReceipt":
+            result = self.receipts.get(params[0])
+        elif method == "eth_getTransactionByHash":
+            result = self.transactions.get(params[0])
+        else:
+            return {"jsonrpc": "2.0", "id": call.get("id"), "error": {"code": -32601, "message": "Method not found"}}
+        return {"jsonrpc": "2.0", "id": call.get("id"), "result": result}
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                stub.http_requests += 1
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if isinstance(body, list):
+                    # Answer in reverse order, as batch responses may be unordered
+                    response = [stub.handle(call) for call in reversed(body)]
+                else:
+                    response = stub.handle(body)
+                payload = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
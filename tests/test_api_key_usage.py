@@ -0,0 +1,31 @@
+"""API token usage rollups: minutes stored as dates and bucketed by date"""
+from datetime import datetime, timezone
+
+import pytest
+
+from routes.admin_advanced import get_api_token_usage
+from utils.api_keys import ApiKeyUsageRecorder
+
+pytestmark = pytest.mark.anyio
+
+ADMIN = {"id": "admin-1", "role": "admin"}
+
+
+async def test_flushed_minutes_are_dates_and_bucket_by_hour(mongo_db):
+    await mongo_db.api_tokens.insert_one({"id": "tok-1", "name": "ci", "usage_count": 0})
+    recorder = ApiKeyUsageRecorder()
+    recorder.record("tok-1")
+    recorder.record("tok-1")
+    recorder.record("tok-1", throttled=True)
+
+    await recorder.flush(mongo_db)
+
+    rollup = await mongo_db.api_token_usage.find_one({"token_id": "tok-1"})
+    assert isinstance(rollup['minute'], datetime)
+
+    usage = await get_api_token_usage("tok-1", ADMIN, mongo_db, hours=1, granularity="hour")
+    assert usage['series'] == [{
+        "period": rollup['minute'].astimezone(timezone.utc).strftime("%Y-%m-%dT%H"),
+        "requests": 2,
+        "throttled": 1
+    }]
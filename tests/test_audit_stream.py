@@ -0,0 +1,104 @@
+"""Audit tailer paging and re-authorization of open audit streams"""
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from middleware import reauthorize_admin
+from utils.admin_state import admin_state_cache
+from utils.audit_store import partition_name
+from utils.audit_stream import TAIL_BATCH, AuditEventHub, AuditTailer
+
+pytestmark = pytest.mark.anyio
+
+
+def object_id_at(timestamp: datetime) -> ObjectId:
+    return ObjectId(ObjectId.from_datetime(timestamp).binary[:4] + os.urandom(8))
+
+
+async def add_records(db, count: int, timestamp: datetime):
+    await db[partition_name(timestamp)].insert_many([
+        {"_id": object_id_at(timestamp), "action": "test_action", "user_id": "user-1"}
+        for _ in range(count)
+    ])
+
+
+def make_tailer():
+    hub = AuditEventHub(client_queue=10 * TAIL_BATCH)
+    hub.subscribe()
+    return hub, AuditTailer(hub)
+
+
+async def test_tailer_pages_through_more_than_a_batch(mongo_db):
+    now = datetime.now(timezone.utc)
+    await add_records(mongo_db, 2 * TAIL_BATCH + 200, now - timedelta(seconds=5))
+    hub, tailer = make_tailer()
+
+    await tailer.poll_once(mongo_db, now)
+    assert hub.published == 2 * TAIL_BATCH + 200
+
+    # Nothing new: the overlap pass only finds records already published
+    await tailer.poll_once(mongo_db, now)
+    assert hub.published == 2 * TAIL_BATCH + 200
+
+
+async def test_tailer_catches_late_flushes_behind_resume_point(mongo_db):
+    now = datetime.now(timezone.utc)
+    await add_records(mongo_db, 10, now - timedelta(seconds=2))
+    hub, tailer = make_tailer()
+    await tailer.poll_once(mongo_db, now)
+
+    # Another worker flushes records queued before the newest one seen
+    await add_records(mongo_db, TAIL_BATCH + 50, now - timedelta(seconds=10))
+    await tailer.poll_once(mongo_db, now)
+
+    assert hub.published == TAIL_BATCH + 60
+
+
+async def test_tailer_follows_resume_point_past_the_overlap_window(mongo_db):
+    now = datetime.now(timezone.utc)
+    hub, tailer = make_tailer()
+    tailer.resume_id = ObjectId.from_datetime(now - timedelta(minutes=5))
+    await add_records(mongo_db, TAIL_BATCH + 1, now - timedelta(minutes=4))
+
+    await tailer.poll_once(mongo_db, now)
+
+    assert hub.published == TAIL_BATCH + 1
+
+
+async def add_admin(db, **fields) -> dict:
+    admin_id = str(uuid.uuid4())
+    await db.admin_users.insert_one({"id": admin_id, "role": "admin", "is_active": True, **fields})
+    return {
+        "id": admin_id,
+        "role": "admin",
+        "jti": None,
+        "exp": (datetime.now(timezone.utc) + timedelta(hours=1)).timestamp()
+    }
+
+
+async def test_reauthorize_accepts_admin_that_still_has_access(mongo_db):
+    admin = await add_admin(mongo_db)
+    assert (await reauthorize_admin(mongo_db, admin, "view_audit_logs"))['role'] == "admin"
+
+
+async def test_reauthorize_rejects_expired_token(mongo_db):
+    admin = await add_admin(mongo_db)
+    admin['exp'] = (datetime.now(timezone.utc) - timedelta(seconds=1)).timestamp()
+
+    with pytest.raises(HTTPException) as exc_info:
+        await reauthorize_admin(mongo_db, admin, "view_audit_logs")
+    assert exc_info.value.status_code == 401
+
+
+async def test_reauthorize_rejects_deactivated_or_demoted_admin(mongo_db):
+    for fields in ({"is_active": False}, {"role": "moderator"}):
+        admin = await add_admin(mongo_db, **fields)
+        admin_state_cache.invalidate(admin['id'])
+
+        with pytest.raises(HTTPException) as exc_info:
+            await reauthorize_admin(mongo_db, admin, "view_audit_logs")
+        assert exc_info.value.status_code == 403
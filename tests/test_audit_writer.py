@@ -0,0 +1,66 @@
+"""Audit spill files: one per worker process, orphans replayed by exactly one worker"""
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+import pytest
+from bson import json_util
+
+from utils.audit_store import partition_name
+from utils.audit_writer import AuditWriter
+
+pytestmark = pytest.mark.anyio
+
+
+def finished_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def write_spill(path, count: int):
+    record = {"action": "test_action", "timestamp": datetime.now(timezone.utc)}
+    path.write_text("".join(json_util.dumps({**record, "n": n}) + "\n" for n in range(count)))
+
+
+async def count_records(db) -> int:
+    return await db[partition_name(datetime.now(timezone.utc))].count_documents({"action": "test_action"})
+
+
+async def test_each_process_spills_to_its_own_file(tmp_path):
+    writer = AuditWriter(spill_path=tmp_path / "audit_spill.jsonl")
+
+    writer._spill([{"action": "test_action"}])
+
+    assert [path.name for path in tmp_path.iterdir()] == [f"audit_spill.{os.getpid()}.jsonl"]
+
+
+async def test_replay_adopts_orphans_and_leaves_live_workers_alone(tmp_path, mongo_db):
+    write_spill(tmp_path / f"audit_spill.{finished_pid()}.jsonl", 3)
+    write_spill(tmp_path / f"audit_spill.{finished_pid()}.replay", 2)
+    write_spill(tmp_path / "audit_spill.jsonl", 1)
+    live = tmp_path / f"audit_spill.{os.getppid()}.jsonl"
+    write_spill(live, 4)
+
+    replayed = await AuditWriter(spill_path=tmp_path / "audit_spill.jsonl").replay_spill(mongo_db)
+
+    assert replayed == 6
+    assert await count_records(mongo_db) == 6
+    assert [path.name for path in tmp_path.iterdir()] == [live.name]
+
+
+async def test_two_workers_replay_an_orphan_once(tmp_path, mongo_db, monkeypatch):
+    write_spill(tmp_path / f"audit_spill.{finished_pid()}.jsonl", 5)
+    first = AuditWriter(spill_path=tmp_path / "audit_spill.jsonl")
+    second = AuditWriter(spill_path=tmp_path / "audit_spill.jsonl")
+
+    # Both workers list the orphan before either claims it
+    orphans = first._spill_files()
+    monkeypatch.setattr(second, "_spill_files", lambda: orphans)
+    replayed = await first.replay_spill(mongo_db)
+    monkeypatch.setattr(os, "getpid", lambda: os.getppid())
+    replayed += await second.replay_spill(mongo_db)
+
+    assert replayed == 5
+    assert await count_records(mongo_db) == 5
@@ -0,0 +1,91 @@
+"""Request deadlines: enforced before queries, never by cancelling a handler"""
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from pymongo.errors import ExecutionTimeout
+
+import middleware
+from database import get_db
+from middleware import DeadlineMiddleware, get_current_admin_user
+from utils.deadline import DeadlineCollection, DeadlineExceeded, remaining_ms, reset_deadline, start_deadline
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeCollection:
+    def __init__(self):
+        self.calls = []
+
+    async def insert_one(self, document):
+        self.calls.append(("insert_one", document))
+
+    async def find_one(self, *args, **kwargs):
+        self.calls.append(("find_one", kwargs))
+
+
+@pytest.fixture
+def expired_deadline():
+    token = start_deadline(0.01)
+    yield
+    reset_deadline(token)
+
+
+async def test_no_deadline_outside_requests():
+    assert remaining_ms() is None
+
+
+async def test_query_after_the_deadline_is_refused(expired_deadline):
+    collection = DeadlineCollection(FakeCollection())
+    await asyncio.sleep(0.02)
+
+    with pytest.raises(DeadlineExceeded):
+        await collection.find_one({"id": "x"})
+
+
+async def test_deadline_is_dropped_after_the_first_write(expired_deadline):
+    fake = FakeCollection()
+    collection = DeadlineCollection(fake)
+
+    await collection.insert_one({"id": "x"})
+    await asyncio.sleep(0.02)
+
+    # The rest of the request runs to completion, without maxTimeMS
+    assert remaining_ms() is None
+    await collection.find_one({"id": "x"})
+    assert fake.calls[-1] == ("find_one", {})
+
+
+async def test_middleware_does_not_cancel_a_slow_handler(monkeypatch):
+    monkeypatch.setattr(middleware, "budget_for", lambda path: 0.01)
+    finished = []
+
+    async def app(scope, receive, send):
+        await asyncio.sleep(0.05)
+        finished.append(True)
+
+    await DeadlineMiddleware(app)({"type": "http", "path": "/api/user/profile"}, None, None)
+    assert finished == [True]
+
+
+class TimingOutCollection:
+    async def find_one(self, *args, **kwargs):
+        raise ExecutionTimeout("operation exceeded time limit")
+
+
+class TimingOutDatabase:
+    admin_users = TimingOutCollection()
+
+
+def test_server_timeout_in_handler_with_catch_all_is_a_503():
+    from server import app
+
+    app.dependency_overrides[get_current_admin_user] = lambda: {"id": "admin-1", "role": "admin"}
+    app.dependency_overrides[get_db] = lambda: TimingOutDatabase()
+    try:
+        response = TestClient(app).get("/api/admin/auth/profile")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
@@ -0,0 +1,213 @@
+"""Deposit confirmation watcher against a local stub JSON-RPC server"""
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+from routes.web3 import PLATFORM_WALLETS
+from tests.jsonrpc_stub import JSONRPCStub
+from utils import deposit_watcher
+from utils.deposit_watcher import DepositConfirmationWatcher, NetworkRPCClient
+
+pytestmark = pytest.mark.anyio
+
+PLATFORM = PLATFORM_WALLETS["ethereum"]["mainnet"]
+SENDER = "0x" + "ab" * 20
+OTHER = "0x" + "cd" * 20
+WEI = 10 ** 18
+CONFIRMATIONS = 12
+
+
+def tx_hash(n: int) -> str:
+    return "0x" + f"{n:064x}"
+
+
+@pytest.fixture
+def rpc():
+    stub = JSONRPCStub()
+    stub.start()
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+async def watcher(mongo_db, rpc):
+    watcher = DepositConfirmationWatcher(mongo_db, {"ethereum": rpc.url}, block_cache_ttl=0)
+    watcher.open()
+    yield watcher
+    await watcher.stop()
+
+
+async def submit_deposit(db, n: int, amount: float = 1.5, sender: str = SENDER, created_at: datetime = None) -> str:
+    deposit_id = f"dep_{n}"
+    await db.deposit_requests.insert_one({
+        "id": deposit_id,
+        "user_id": "user-1",
+        "amount": amount,
+        "payment_method": "web3_ethereum",
+        "status": "pending",
+        "admin_note": None,
+        "metadata": {
+            "transaction_hash": tx_hash(n),
+            "network": "ethereum",
+            "token_symbol": "ETH",
+            "from_address": sender,
+            "deposit_type": "crypto"
+        },
+        "created_at": created_at or datetime.now(timezone.utc),
+        "processed_at": None
+    })
+    return deposit_id
+
+
+async def get_deposit(db, deposit_id: str) -> dict:
+    return await db.deposit_requests.find_one({"id": deposit_id}, {"_id": 0})
+
+
+async def test_batches_receipt_lookups(rpc):
+    for n in range(120):
+        rpc.add_transaction(tx_hash(n), 100, SENDER, PLATFORM, WEI)
+
+    async with httpx.AsyncClient() as http:
+        client = NetworkRPCClient("ethereum", rpc.url, http)
+        results = await client.get_transactions([tx_hash(n) for n in range(120)], batch_size=50)
+
+    # 3 batches of up to 50 hashes (receipt + transaction each), matched by id
+    assert rpc.http_requests == 3
+    assert len(results) == 120
+    receipt, transaction = results[tx_hash(7)]
+    assert receipt["transactionHash"] == tx_hash(7)
+    assert transaction["hash"] == tx_hash(7)
+
+
+async def test_confirmed_deposit_is_verified_but_not_credited(mongo_db, rpc, watcher):
+    deposit_id = await submit_deposit(mongo_db, 1)
+    rpc.add_transaction(tx_hash(1), 100, SENDER, PLATFORM, int(1.5 * WEI))
+    rpc.block_number = 100 + CONFIRMATIONS - 1
+
+    assert await watcher.poll_once() == 1
+
+    deposit = await get_deposit(mongo_db, deposit_id)
+    assert deposit["status"] == "pending"
+    assert deposit["metadata"]["watcher_status"] == "verified"
+    assert deposit["metadata"]["confirmations"] == CONFIRMATIONS
+    assert deposit["metadata"]["block_number"] == 100
+    assert await mongo_db.wallets.count_documents({}) == 0
+    assert await mongo_db.transactions.count_documents({}) == 0
+
+    # Verified deposits are left for the admin and not polled again
+    assert await watcher.poll_once() == 0
+
+
+async def test_reverted_transaction_rejects_deposit_once_confirmed(mongo_db, rpc, watcher):
+    deposit_id = await submit_deposit(mongo_db, 2)
+    rpc.add_transaction(tx_hash(2), 100, SENDER, PLATFORM, int(1.5 * WEI), status="0x0")
+
+    # A shallow failed receipt could still be reorged away
+    rpc.block_number = 100
+    assert await watcher.poll_once() == 0
+    assert (await get_deposit(mongo_db, deposit_id))["status"] == "pending"
+
+    rpc.block_number = 100 + CONFIRMATIONS - 1
+    assert await watcher.poll_once() == 1
+
+    deposit = await get_deposit(mongo_db, deposit_id)
+    assert deposit["status"] == "rejected"
+    assert deposit["metadata"]["watcher_status"] == "failed"
+
+
+async def test_wrong_recipient_needs_review(mongo_db, rpc, watcher):
+    deposit_id = await submit_deposit(mongo_db, 3)
+    rpc.add_transaction(tx_hash(3), 100, SENDER, OTHER, int(1.5 * WEI))
+    rpc.block_number = 200
+
+    assert await watcher.poll_once() == 0
+
+    deposit = await get_deposit(mongo_db, deposit_id)
+    assert deposit["status"] == "pending"
+    assert deposit["metadata"]["watcher_status"] == "needs_review"
+    assert deposit["metadata"]["watcher_note"] == "Recipient is not a platform wallet"
+
+
+async def test_underpaid_deposit_needs_review(mongo_db, rpc, watcher):
+    deposit_id = await submit_deposit(mongo_db, 4, amount=2.0)
+    rpc.add_transaction(tx_hash(4), 100, SENDER, PLATFORM, int(1.5 * WEI))
+    rpc.block_number = 200
+
+    await watcher.poll_once()
+
+    deposit = await get_deposit(mongo_db, deposit_id)
+    assert deposit["status"] == "pending"
+    assert deposit["metadata"]["watcher_status"] == "needs_review"
+    assert "below the submitted amount" in deposit["metadata"]["watcher_note"]
+
+
+async def test_sender_mismatch_needs_review(mongo_db, rpc, watcher):
+    deposit_id = await submit_deposit(mongo_db, 5, sender=OTHER)
+    rpc.add_transaction(tx_hash(5), 100, SENDER, PLATFORM, int(1.5 * WEI))
+    rpc.block_number = 200
+
+    await watcher.poll_once()
+
+    deposit = await get_deposit(mongo_db, deposit_id)
+    assert deposit["metadata"]["watcher_status"] == "needs_review"
+
+
+async def test_pending_and_reorged_transactions_wait(mongo_db, rpc, watcher):
+    deposit_id = await submit_deposit(mongo_db, 6)
+    rpc.block_number = 100
+
+    # Not mined yet
+    assert await watcher.poll_once() == 0
+    assert "watcher_status" not in (await get_deposit(mongo_db, deposit_id))["metadata"]
+
+    # Mined, but not deep enough
+    rpc.add_transaction(tx_hash(6), 100, SENDER, PLATFORM, int(1.5 * WEI), block_hash="0x" + "aa" * 32)
+    rpc.block_number = 105
+    assert await watcher.poll_once() == 0
+
+    # Reorged out before reaching the required depth
+    rpc.drop_transaction(tx_hash(6))
+    rpc.block_number = 110
+    assert await watcher.poll_once() == 0
+    assert (await get_deposit(mongo_db, deposit_id))["status"] == "pending"
+
+    # Re-mined in another block and confirmed there
+    rpc.add_transaction(tx_hash(6), 108, SENDER, PLATFORM, int(1.5 * WEI), block_hash="0x" + "bb" * 32)
+    rpc.block_number = 108 + CONFIRMATIONS - 1
+    assert await watcher.poll_once() == 1
+
+    deposit = await get_deposit(mongo_db, deposit_id)
+    assert deposit["status"] == "pending"
+    assert deposit["metadata"]["watcher_status"] == "verified"
+    assert deposit["metadata"]["block_number"] == 108
+    assert deposit["metadata"]["block_hash"] == "0x" + "bb" * 32
+
+
+async def test_unresolvable_hashes_do_not_starve_newer_deposits(mongo_db, rpc, watcher, monkeypatch):
+    monkeypatch.setattr(deposit_watcher, "PENDING_SCAN_LIMIT", 3)
+    # Older deposits whose hashes never get mined fill a whole scan
+    for n in range(10, 13):
+        await submit_deposit(mongo_db, n)
+    deposit_id = await submit_deposit(mongo_db, 13)
+    rpc.add_transaction(tx_hash(13), 100, SENDER, PLATFORM, int(1.5 * WEI))
+    rpc.block_number = 100 + CONFIRMATIONS - 1
+
+    verified = 0
+    for _ in range(2):
+        verified += await watcher.poll_once()
+
+    assert verified == 1
+    assert (await get_deposit(mongo_db, deposit_id))["metadata"]["watcher_status"] == "verified"
+
+
+async def test_hash_never_mined_goes_to_review(mongo_db, rpc, watcher):
+    deposit_id = await submit_deposit(mongo_db, 14, created_at=datetime.now(timezone.utc) - timedelta(days=2))
+    rpc.block_number = 200
+
+    assert await watcher.poll_once() == 0
+
+    deposit = await get_deposit(mongo_db, deposit_id)
+    assert deposit["status"] == "pending"
+    assert deposit["metadata"]["watcher_status"] == "needs_review"
+    assert deposit["metadata"]["watcher_note"] == "Transaction not found on-chain"
@@ -0,0 +1,249 @@
+"""Payout engine batching, failure handling and crash recovery with the fake backend"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from utils.payout_engine import FakePayoutBackend, PayoutEngine
+
+pytestmark = pytest.mark.anyio
+
+ADDRESS = "0x" + "ef" * 20
+
+
+class Crash(BaseException):
+    """Stands in for the process dying: not caught by the engine's error handling"""
+
+
+class CrashingBackend(FakePayoutBackend):
+    """Broadcasts (or not), then dies before the engine can record the result"""
+
+    def __init__(self, broadcast: bool):
+        super().__init__()
+        self.broadcast = broadcast
+        self.crash = True
+
+    async def send_batch(self, network, token_symbol, transfers, nonce):
+        if not self.crash:
+            return await super().send_batch(network, token_symbol, transfers, nonce)
+        if self.broadcast:
+            await super().send_batch(network, token_symbol, transfers, nonce)
+        raise Crash()
+
+
+class TimingOutBackend(FakePayoutBackend):
+    """The node accepts the transaction, but the reply never arrives"""
+
+    def __init__(self):
+        super().__init__()
+        self.time_out = True
+
+    async def send_batch(self, network, token_symbol, transfers, nonce):
+        tx_hash = await super().send_batch(network, token_symbol, transfers, nonce)
+        if self.time_out:
+            raise TimeoutError("RPC request timed out")
+        return tx_hash
+
+
+async def add_withdrawal(db, n: int, network: str = "ethereum", token: str = "ETH", **fields) -> str:
+    withdrawal_id = f"wdr_{n}"
+    approved_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    await db.withdrawal_requests.insert_one({
+        "id": withdrawal_id,
+        "user_id": f"user-{n}",
+        "amount": 10.0 + n,
+        "withdrawal_method": f"web3_{network}",
+        "withdrawal_address": ADDRESS,
+        "status": "approved",
+        "metadata": {"network": network, "token_symbol": token, "withdrawal_type": "crypto"},
+        "created_at": approved_at,
+        "processed_at": approved_at,
+        "payout_status": "queued",
+        **fields
+    })
+    return withdrawal_id
+
+
+async def payout_statuses(db) -> dict:
+    withdrawals = await db.withdrawal_requests.find({}, {"_id": 0, "id": 1, "payout_status": 1}).to_list(None)
+    return {w['id']: w.get('payout_status') for w in withdrawals}
+
+
+def later(hours: int = 1) -> datetime:
+    return datetime.now(timezone.utc) + timedelta(hours=hours)
+
+
+async def test_groups_by_network_and_token_in_bounded_batches(mongo_db):
+    for n in range(5):
+        await add_withdrawal(mongo_db, n)
+    for n in range(5, 7):
+        await add_withdrawal(mongo_db, n, network="bsc", token="BNB")
+
+    backend = FakePayoutBackend()
+    engine = PayoutEngine(mongo_db, backend, max_batch_size=2, batch_window=60)
+
+    assert await engine.run_once() == 4
+
+    sizes = sorted((b['network'], len(b['transfers'])) for b in backend.sent)
+    assert sizes == [("bsc", 2), ("ethereum", 1), ("ethereum", 2), ("ethereum", 2)]
+    nonces = sorted((b['network'], b['nonce']) for b in backend.sent)
+    assert nonces == [("bsc", 0), ("ethereum", 0), ("ethereum", 1), ("ethereum", 2)]
+    assert set((await payout_statuses(mongo_db)).values()) == {"broadcast"}
+    assert await mongo_db.payout_batches.count_documents({"status": "broadcast"}) == 4
+
+
+async def test_waits_for_full_batch_or_elapsed_window(mongo_db):
+    recent = datetime.now(timezone.utc)
+    await add_withdrawal(mongo_db, 1, processed_at=recent)
+
+    backend = FakePayoutBackend()
+    engine = PayoutEngine(mongo_db, backend, max_batch_size=10, batch_window=300)
+
+    assert await engine.run_once(now=recent) == 0
+    assert await engine.run_once(now=recent + timedelta(seconds=301)) == 1
+
+
+async def test_ignores_withdrawals_not_queued_for_automatic_payout(mongo_db):
+    # Approved before automatic payouts were enabled: already paid by hand
+    await add_withdrawal(mongo_db, 1)
+    await mongo_db.withdrawal_requests.update_one({"id": "wdr_1"}, {"$unset": {"payout_status": ""}})
+
+    backend = FakePayoutBackend()
+    assert await PayoutEngine(mongo_db, backend, batch_window=0).run_once() == 0
+    assert backend.sent == []
+
+
+async def test_failed_batch_releases_withdrawals_and_nonce(mongo_db):
+    for n in range(3):
+        await add_withdrawal(mongo_db, n)
+
+    backend = FakePayoutBackend(fail=True)
+    engine = PayoutEngine(mongo_db, backend, batch_window=0)
+
+    assert await engine.run_once() == 0
+    assert set((await payout_statuses(mongo_db)).values()) == {"queued"}
+    assert await mongo_db.withdrawal_requests.count_documents({"payout_batch_id": {"$exists": True}}) == 0
+    assert (await mongo_db.payout_batches.find_one({}))['status'] == "failed"
+
+    backend.fail = False
+    assert await engine.run_once() == 1
+    assert backend.sent[0]['nonce'] == 0  # The released nonce is reused
+    assert set((await payout_statuses(mongo_db)).values()) == {"broadcast"}
+
+
+async def test_resumes_batch_left_building_by_a_crash(mongo_db):
+    for n in range(3):
+        await add_withdrawal(mongo_db, n)
+
+    with pytest.raises(Crash):
+        await PayoutEngine(mongo_db, CrashingBackend(broadcast=False), batch_window=0).run_once()
+    assert set((await payout_statuses(mongo_db)).values()) == {"batched"}
+
+    backend = FakePayoutBackend()
+    engine = PayoutEngine(mongo_db, backend, batch_window=0, stale_batch_after=600)
+
+    # Not stale yet: left alone
+    assert await engine.recover() == 0
+
+    assert await engine.recover(now=later()) == 1
+    assert len(backend.sent) == 1
+    assert backend.sent[0]['nonce'] == 0
+    assert len(backend.sent[0]['transfers']) == 3
+    batch = await mongo_db.payout_batches.find_one({})
+    assert batch['status'] == "broadcast"
+    assert set((await payout_statuses(mongo_db)).values()) == {"broadcast"}
+
+
+async def test_resend_after_crash_does_not_pay_twice(mongo_db):
+    await add_withdrawal(mongo_db, 1)
+
+    backend = CrashingBackend(broadcast=True)
+    with pytest.raises(Crash):
+        await PayoutEngine(mongo_db, backend, batch_window=0).run_once()
+    first_hash = backend._by_nonce[("ethereum", 0)]
+
+    # Same backend (same chain) after restart: the resend reuses nonce 0
+    backend.crash = False
+    assert await PayoutEngine(mongo_db, backend, batch_window=0).recover(now=later()) == 1
+
+    assert len(backend.sent) == 1
+    withdrawal = await mongo_db.withdrawal_requests.find_one({"id": "wdr_1"})
+    assert withdrawal['payout_tx_hash'] == first_hash
+
+
+async def test_failed_resume_is_left_for_review(mongo_db):
+    await add_withdrawal(mongo_db, 1)
+
+    with pytest.raises(Crash):
+        await PayoutEngine(mongo_db, CrashingBackend(broadcast=False), batch_window=0).run_once()
+
+    engine = PayoutEngine(mongo_db, FakePayoutBackend(fail=True), batch_window=0)
+    await engine.run_once(now=later())
+
+    assert (await mongo_db.payout_batches.find_one({}))['status'] == "needs_review"
+    assert await payout_statuses(mongo_db) == {"wdr_1": "needs_review"}
+
+    # Never re-queued, so later runs do not pay it again
+    engine.backend = FakePayoutBackend()
+    assert await engine.run_once(now=later(2)) == 0
+    assert engine.backend.sent == []
+
+
+async def test_requeues_claims_without_a_recorded_batch(mongo_db):
+    # Claimed, then the process died before the batch was inserted
+    await add_withdrawal(
+        mongo_db, 1,
+        payout_status="batched",
+        payout_batch_id="lost-batch",
+        updated_at=datetime.now(timezone.utc)
+    )
+
+    backend = FakePayoutBackend()
+    engine = PayoutEngine(mongo_db, backend, batch_window=0)
+
+    assert await engine.recover() == 0
+    assert await engine.run_once(now=later()) == 1
+
+    withdrawal = await mongo_db.withdrawal_requests.find_one({"id": "wdr_1"})
+    assert withdrawal['payout_status'] == "broadcast"
+    assert withdrawal['payout_batch_id'] != "lost-batch"
+
+
+async def test_ambiguous_failure_keeps_batch_and_nonce_for_recovery(mongo_db):
+    for n in range(2):
+        await add_withdrawal(mongo_db, n)
+
+    backend = TimingOutBackend()
+    engine = PayoutEngine(mongo_db, backend, batch_window=0)
+
+    assert await engine.run_once() == 0
+    batch = await mongo_db.payout_batches.find_one({})
+    assert batch['status'] == "building"
+    assert batch['nonce'] == 0
+    assert set((await payout_statuses(mongo_db)).values()) == {"batched"}
+    assert (await mongo_db.payout_nonces.find_one({"_id": "ethereum"}))['released'] == []
+
+    # Not re-queued: the next run sends nothing new
+    assert await engine.run_once() == 0
+    assert len(backend.sent) == 1
+
+    # Once stale, the same nonce is re-sent; the chain pays it only once
+    backend.time_out = False
+    assert await engine.recover(now=later()) == 1
+    assert len(backend.sent) == 1
+    assert set((await payout_statuses(mongo_db)).values()) == {"broadcast"}
+
+
+async def test_recovery_releases_nonce_of_unrecorded_batch(mongo_db):
+    engine = PayoutEngine(mongo_db, FakePayoutBackend(), batch_window=0)
+    # The process died between allocating the nonce and recording the batch
+    assert await engine._allocate_nonce("ethereum", "lost-batch") == 0
+
+    assert await engine.recover() == 0
+    assert await engine.recover(now=later()) == 1
+
+    await add_withdrawal(mongo_db, 1)
+    assert await engine.run_once(now=later()) == 1
+    assert engine.backend.sent[0]['nonce'] == 0
+    state = await mongo_db.payout_nonces.find_one({"_id": "ethereum"})
+    assert state['leases'] == {}
+    assert state['released'] == []
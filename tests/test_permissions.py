@@ -0,0 +1,79 @@
+"""Admin role permissions on routes and the API permission registry"""
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from middleware import get_current_admin_user
+from routes.admin_management import router as admin_management_router
+from utils.permissions import PermissionRegistry
+
+pytestmark = pytest.mark.anyio
+
+
+def admin_client(role: str) -> TestClient:
+    app = FastAPI()
+    app.include_router(admin_management_router, prefix="/api")
+    app.dependency_overrides[get_current_admin_user] = lambda: {"id": "admin-1", "role": role}
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("path", [
+    "/api/admin/audit-logs",
+    "/api/admin/withdrawals",
+    "/api/admin/deposits",
+    "/api/admin/users"
+])
+def test_moderator_is_refused_routes_outside_its_role(path):
+    response = admin_client("moderator").get(path)
+    assert response.status_code == 403
+
+
+async def add_permission(db, name: str, is_active: bool = True):
+    await db.api_permissions.insert_one({
+        "id": str(uuid.uuid4()),
+        "name": name,
+        "category": "trading",
+        "is_active": is_active
+    })
+
+
+async def test_undeclared_permission_names_get_no_bit(mongo_db):
+    await add_permission(mongo_db, "read_orders")
+    registry = PermissionRegistry()
+    await registry.load(mongo_db)
+
+    mask = registry.mask(["read_orders", "made_up", "also_made_up"])
+
+    assert set(registry.bits) == {"read_orders"}
+    assert mask == registry.bits["read_orders"]
+    assert not registry.allows(mask, "made_up")
+
+
+async def test_cached_principal_picks_up_newly_declared_permission(mongo_db):
+    await add_permission(mongo_db, "read_orders")
+    registry = PermissionRegistry()
+    await registry.load(mongo_db)
+
+    permissions = ["read_orders", "place_orders"]
+    principal = {
+        "permissions": permissions,
+        "permission_mask": registry.mask(permissions),
+        "permission_generation": registry.generation
+    }
+    assert not registry.allows(registry.principal_mask(principal), "place_orders")
+
+    await add_permission(mongo_db, "place_orders")
+    await registry.load(mongo_db)
+
+    assert registry.allows(registry.principal_mask(principal), "place_orders")
+    assert registry.allows(registry.principal_mask(principal), "read_orders")
+
+
+async def test_deactivated_permission_is_refused(mongo_db):
+    await add_permission(mongo_db, "read_orders", is_active=False)
+    registry = PermissionRegistry()
+    await registry.load(mongo_db)
+
+    assert not registry.allows(registry.mask(["read_orders"]), "read_orders")
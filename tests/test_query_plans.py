@@ -0,0 +1,68 @@
+"""Registered query shapes are served by the declared indexes"""
+import pytest
+
+from database import create_indexes, ensure_required_indexes, find_duplicates, normalize_transaction_hashes
+from indexes import INDEXES, REQUIRED_INDEXES, check_query_plans
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_every_query_shape_uses_an_index(mongo_db):
+    # Also creates every collection, so no plan degenerates to EOF
+    assert await create_indexes(mongo_db)
+
+    assert await check_query_plans(mongo_db) == []
+
+
+async def test_duplicates_skip_the_unique_index_without_aborting(mongo_db):
+    await mongo_db.withdrawal_requests.insert_many([{"id": "wdr_1"}, {"id": "wdr_1"}])
+
+    assert not await create_indexes(mongo_db)
+
+    assert "id_1" not in await mongo_db.withdrawal_requests.index_information()
+    # Other collections were still indexed
+    assert "id_1" in await mongo_db.deposit_requests.index_information()
+
+
+async def test_find_duplicates_respects_partial_filter(mongo_db):
+    tx_hash = {"metadata": {"transaction_hash": "0xabc"}}
+    await mongo_db.deposit_requests.insert_many([{"id": "a"}, {"id": "b"}, {**tx_hash, "id": "c"}])
+    index = {
+        "key": {"metadata.transaction_hash": 1},
+        "unique": True,
+        "partialFilterExpression": {"metadata.transaction_hash": {"$exists": True}}
+    }
+    assert await find_duplicates(mongo_db.deposit_requests, index) == []
+
+    await mongo_db.deposit_requests.insert_one({**tx_hash, "id": "d"})
+    assert await find_duplicates(mongo_db.deposit_requests, index) == [{"metadata_transaction_hash": "0xabc"}]
+
+
+def test_required_indexes_are_declared():
+    for collection, names in REQUIRED_INDEXES.items():
+        declared = {model.document['name'] for model in INDEXES[collection]}
+        assert set(names) <= declared
+
+
+async def test_missing_hash_index_refuses_to_start(mongo_db):
+    deposit = {"metadata": {"network": "ethereum", "transaction_hash": "0xabc"}}
+    await mongo_db.deposit_requests.insert_many([{**deposit, "id": "a"}, {**deposit, "id": "b"}])
+
+    assert not await create_indexes(mongo_db)
+
+    with pytest.raises(RuntimeError):
+        await ensure_required_indexes(mongo_db)
+
+
+async def test_mixed_case_legacy_hashes_are_lowercased_before_indexing(mongo_db):
+    await mongo_db.deposit_requests.insert_many([
+        {"id": "a", "metadata": {"network": "ethereum", "transaction_hash": "0xABCdef"}},
+        {"id": "b", "metadata": {"network": "ethereum", "transaction_hash": "0x123"}}
+    ])
+
+    assert await normalize_transaction_hashes(mongo_db) == 1
+    assert await create_indexes(mongo_db)
+    await ensure_required_indexes(mongo_db)
+
+    deposit = await mongo_db.deposit_requests.find_one({"id": "a"})
+    assert deposit['metadata']['transaction_hash'] == "0xabcdef"
@@ -0,0 +1,107 @@
+"""Rate limit backends and principals"""
+import asyncio
+import hashlib
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from middleware import RateLimiter, get_rate_limit_principal
+from utils.rate_limit import MemoryRateLimitBackend, MongoRateLimitBackend
+
+pytestmark = pytest.mark.anyio
+
+CLIENT_IP = "203.0.113.7"
+
+
+@pytest.fixture(params=["memory", "mongo"])
+def backend(request):
+    if request.param == "memory":
+        return MemoryRateLimitBackend()
+    return MongoRateLimitBackend(request.getfixturevalue("mongo_db"))
+
+
+def make_request(headers: dict) -> Request:
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "path": "/api/admin/auth/login",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        "client": (CLIENT_IP, 50000)
+    })
+
+
+async def add_api_token(db, **fields) -> str:
+    api_key = f"tk_{uuid.uuid4().hex}"
+    await db.api_tokens.insert_one({
+        "id": f"token-{uuid.uuid4().hex[:8]}",
+        "user_id": "user-1",
+        "name": "test",
+        "token_key": hashlib.sha256(api_key.encode()).hexdigest(),
+        "permissions": [],
+        "is_active": True,
+        "expires_at": None,
+        **fields
+    })
+    return api_key
+
+
+async def test_sliding_window_allows_limit_hits_per_window(backend):
+    key = f"test:{uuid.uuid4().hex}"
+    results = [await backend.sliding_window(key, 3, 1.0) for _ in range(5)]
+
+    assert [r.allowed for r in results] == [True, True, True, False, False]
+    assert [r.remaining for r in results[:3]] == [2, 1, 0]
+    assert 0 < results[3].retry_after <= 1.0
+
+
+async def test_sliding_window_does_not_count_rejected_hits(backend):
+    key = f"test:{uuid.uuid4().hex}"
+    for _ in range(2):
+        await backend.sliding_window(key, 2, 1.0)
+    # Retrying while limited must not push the client's reset further out
+    for _ in range(5):
+        assert not (await backend.sliding_window(key, 2, 1.0)).allowed
+
+    await asyncio.sleep(1.1)
+    result = await backend.sliding_window(key, 2, 1.0)
+    assert result.allowed
+    assert result.remaining == 1
+
+
+async def test_random_api_keys_share_the_client_ip_bucket(mongo_db):
+    principals = {
+        await get_rate_limit_principal(make_request({"X-API-Key": f"tk_{uuid.uuid4().hex}"}), mongo_db)
+        for _ in range(5)
+    }
+    assert principals == {f"ip:{CLIENT_IP}"}
+
+
+async def test_valid_api_key_gets_its_own_bucket(mongo_db):
+    api_key = await add_api_token(mongo_db)
+    token = await mongo_db.api_tokens.find_one({}, {"id": 1})
+
+    principal = await get_rate_limit_principal(make_request({"Authorization": f"Bearer {api_key}"}), mongo_db)
+    assert principal == f"key:{token['id']}"
+
+
+async def test_inactive_or_expired_api_keys_fall_back_to_ip(mongo_db):
+    inactive = await add_api_token(mongo_db, is_active=False)
+    expired = await add_api_token(mongo_db, expires_at=datetime.now(timezone.utc) - timedelta(days=1))
+
+    for api_key in (inactive, expired):
+        principal = await get_rate_limit_principal(make_request({"X-API-Key": api_key}), mongo_db)
+        assert principal == f"ip:{CLIENT_IP}"
+
+
+async def test_login_limit_cannot_be_bypassed_with_random_keys(mongo_db):
+    limiter = RateLimiter(requests_per_minute=3, route_class=f"auth-{uuid.uuid4().hex}")
+
+    for _ in range(3):
+        await limiter(make_request({"X-API-Key": f"tk_{uuid.uuid4().hex}"}), mongo_db)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await limiter(make_request({"X-API-Key": f"tk_{uuid.uuid4().hex}"}), mongo_db)
+    assert exc_info.value.status_code == 429
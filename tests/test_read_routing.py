@@ -0,0 +1,100 @@
+"""
+Analytics reads go to a secondary, money-moving reads to the primary
+
+The routing test needs a replica set with at least one secondary at
+TEST_MONGO_REPLSET_URL and is skipped otherwise. Local three-node set:
+
+    for port in 27017 27018 27019; do
+        mkdir -p /tmp/rs0-$port && mongod --replSet rs0 --port $port --dbpath /tmp/rs0-$port --fork --logpath /tmp/rs0-$port.log
+    done
+    mongosh --port 27017 --eval 'rs.initiate({_id: "rs0", members: [
+        {_id: 0, host: "localhost:27017"}, {_id: 1, host: "localhost:27018"}, {_id: 2, host: "localhost:27019"}]})'
+
+    TEST_MONGO_REPLSET_URL="mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0" pytest tests/test_read_routing.py
+"""
+import os
+import uuid
+from typing import Dict
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+from pymongo.read_preferences import Primary
+
+from database import get_analytics_db, get_db
+from mongo_client import analytics_read_preference, client_options
+from utils.deadline import DeadlineDatabase
+
+pytestmark = pytest.mark.anyio
+
+TEST_MONGO_REPLSET_URL = os.getenv("TEST_MONGO_REPLSET_URL")
+
+
+class ServedBy(monitoring.CommandListener):
+    """Remembers which server answered each request id"""
+
+    def __init__(self):
+        self.servers: Dict[int, str] = {}
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.servers[event.request_id] = "%s:%s" % event.connection_id
+
+    def failed(self, event):
+        pass
+
+
+async def served_by(listener: ServedBy, query) -> str:
+    before = set(listener.servers)
+    await query
+    new = [request_id for request_id in listener.servers if request_id not in before]
+    return listener.servers[new[-1]]
+
+
+@pytest.fixture
+async def replica_set():
+    if not TEST_MONGO_REPLSET_URL:
+        pytest.skip("TEST_MONGO_REPLSET_URL is not set")
+
+    listener = ServedBy()
+    options = {**client_options(), "serverSelectionTimeoutMS": 2000}
+    client = AsyncIOMotorClient(TEST_MONGO_REPLSET_URL, event_listeners=[listener], **options)
+    try:
+        hello = await client.admin.command("hello")
+    except PyMongoError:
+        client.close()
+        pytest.skip(f"No MongoDB server at {TEST_MONGO_REPLSET_URL}")
+
+    primary = hello.get('primary')
+    secondaries = [host for host in hello.get('hosts', []) if host != primary]
+    if not primary or not secondaries:
+        client.close()
+        pytest.skip("Deployment is not a replica set with a secondary")
+
+    db_name = f"test_{uuid.uuid4().hex[:12]}"
+    try:
+        yield client, db_name, listener, primary
+    finally:
+        await client.drop_database(db_name)
+        client.close()
+
+
+async def test_route_dependencies_use_the_configured_read_preferences():
+    assert (await get_analytics_db())._database.read_preference == analytics_read_preference()
+    assert (await get_db())._database.read_preference == Primary()
+
+
+async def test_analytics_reads_use_a_secondary_and_money_reads_the_primary(replica_set):
+    client, db_name, listener, primary = replica_set
+    # The same handles database.py builds, wrapped as the route dependencies wrap them
+    db = DeadlineDatabase(client[db_name])
+    analytics_db = DeadlineDatabase(client.get_database(db_name, read_preference=analytics_read_preference()))
+
+    analytics_server = await served_by(listener, analytics_db.kyc_submissions.count_documents({"status": "pending"}))
+    money_server = await served_by(listener, db.wallets.find_one({}))
+
+    assert analytics_server != primary
+    assert money_server == primary
@@ -0,0 +1,137 @@
+"""Admin withdrawal decisions: decided once, debited before approval, counters released once"""
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from routes.admin_management import process_withdrawal
+from utils.withdrawal_limits import reserve_daily_withdrawal
+
+pytestmark = pytest.mark.anyio
+
+ADMIN = {"id": "admin-1", "role": "admin"}
+DAILY_LIMIT = 1000.0
+
+
+async def add_withdrawal(db, amount: float = 100.0, withdrawal_type: str = "crypto") -> str:
+    reserved, _ = await reserve_daily_withdrawal(db, "user-1", amount, DAILY_LIMIT)
+    assert reserved
+    await db.withdrawal_requests.insert_one({
+        "id": "wdr_1",
+        "user_id": "user-1",
+        "amount": amount,
+        "withdrawal_method": "web3_ethereum",
+        "status": "pending",
+        "metadata": {"withdrawal_type": withdrawal_type, "daily_limit_reserved": True},
+        "created_at": datetime.now(timezone.utc),
+        "processed_at": None
+    })
+    return "wdr_1"
+
+
+async def daily_total(db) -> float:
+    counter = await db.withdrawal_daily_counters.find_one({"user_id": "user-1"})
+    return counter['total']
+
+
+class ReadTogether:
+    """Database proxy: withdrawal reads return only once `parties` callers have read"""
+
+    def __init__(self, db, parties: int):
+        self._db = db
+        self._parties = parties
+        self._read = 0
+        self._all_read = asyncio.Event()
+
+    def __getattr__(self, name):
+        attr = getattr(self._db, name)
+        return self if name == "withdrawal_requests" else attr
+
+    async def find_one(self, *args, **kwargs):
+        withdrawal = await self._db.withdrawal_requests.find_one(*args, **kwargs)
+        self._read += 1
+        if self._read == self._parties:
+            self._all_read.set()
+        await self._all_read.wait()
+        return withdrawal
+
+    async def update_one(self, *args, **kwargs):
+        return await self._db.withdrawal_requests.update_one(*args, **kwargs)
+
+
+async def decide(db, withdrawal_id: str, approved: bool):
+    return await process_withdrawal(withdrawal_id, approved, None, ADMIN, None, db)
+
+
+async def test_concurrent_rejections_release_the_daily_counter_once(mongo_db):
+    withdrawal_id = await add_withdrawal(mongo_db)
+
+    # Every request sees the withdrawal still pending before any of them writes
+    racing_db = ReadTogether(mongo_db, 5)
+    results = await asyncio.gather(
+        *[decide(racing_db, withdrawal_id, False) for _ in range(5)],
+        return_exceptions=True
+    )
+
+    refused = [r for r in results if isinstance(r, HTTPException)]
+    assert len(refused) == 4
+    assert {r.status_code for r in refused} == {400}
+    assert await daily_total(mongo_db) == 0
+
+
+async def test_processed_withdrawal_cannot_be_decided_again(mongo_db):
+    withdrawal_id = await add_withdrawal(mongo_db)
+    await decide(mongo_db, withdrawal_id, False)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await decide(mongo_db, withdrawal_id, False)
+    assert exc_info.value.status_code == 400
+    assert await daily_total(mongo_db) == 0
+
+
+async def add_wallet(db, balance: float):
+    await db.wallets.insert_one({"user_id": "user-1", "balance": balance, "locked_balance": 0.0})
+
+
+async def test_unfunded_approval_is_not_queued_for_payout(mongo_db, monkeypatch):
+    monkeypatch.setenv("PAYOUT_BACKEND", "fake")
+    withdrawal_id = await add_withdrawal(mongo_db, amount=100.0)
+    await add_wallet(mongo_db, 50.0)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await decide(mongo_db, withdrawal_id, True)
+    assert exc_info.value.status_code == 400
+
+    withdrawal = await mongo_db.withdrawal_requests.find_one({"id": withdrawal_id})
+    assert withdrawal['status'] == "pending"
+    assert "payout_status" not in withdrawal
+    assert (await mongo_db.wallets.find_one({"user_id": "user-1"}))['balance'] == 50.0
+
+
+async def test_approval_debits_then_queues(mongo_db, monkeypatch):
+    monkeypatch.setenv("PAYOUT_BACKEND", "fake")
+    withdrawal_id = await add_withdrawal(mongo_db, amount=100.0)
+    await add_wallet(mongo_db, 150.0)
+
+    await decide(mongo_db, withdrawal_id, True)
+
+    withdrawal = await mongo_db.withdrawal_requests.find_one({"id": withdrawal_id})
+    assert withdrawal['status'] == "approved"
+    assert withdrawal['payout_status'] == "queued"
+    assert (await mongo_db.wallets.find_one({"user_id": "user-1"}))['balance'] == 50.0
+
+
+async def test_concurrent_approvals_debit_once(mongo_db):
+    withdrawal_id = await add_withdrawal(mongo_db, amount=100.0)
+    await add_wallet(mongo_db, 500.0)
+
+    racing_db = ReadTogether(mongo_db, 3)
+    results = await asyncio.gather(
+        *[decide(racing_db, withdrawal_id, True) for _ in range(3)],
+        return_exceptions=True
+    )
+
+    assert len([r for r in results if isinstance(r, HTTPException)]) == 2
+    assert (await mongo_db.wallets.find_one({"user_id": "user-1"}))['balance'] == 400.0
+    assert await mongo_db.transactions.count_documents({}) == 1